@@ -1,9 +1,8 @@
-import json
 import hmac
 import hashlib
+import os
 import time
 import urllib.parse
-import websocket
 import ssl
 import threading
 import logging
@@ -11,21 +10,22 @@ import urllib.request
 import urllib.error
 from concurrent.futures import ThreadPoolExecutor
 from collections import defaultdict
+import json_codec
+from clock import get_clock
 
-def setup_logging():
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(levelname)s - %(module)s - %(message)s',
-        handlers=[
-            logging.StreamHandler(),
-            logging.FileHandler('bot_errors.log')
-        ]
-    )
-    return logging.getLogger()
+logger = logging.getLogger(__name__)
+
+def _endpoint(url):
+    return urllib.parse.urlsplit(url).path
 
-logger = setup_logging()
+# Context SSL riêng cho request Binance, tạo khi cần thay vì sửa mặc định của cả tiến trình lúc import
+_ssl_context = None
 
-ssl._create_default_https_context = ssl._create_unverified_context
+def _get_ssl_context():
+    global _ssl_context
+    if _ssl_context is None:
+        _ssl_context = ssl._create_unverified_context()
+    return _ssl_context
 
 def sign(query, api_secret):
     try:
@@ -34,58 +34,251 @@ def sign(query, api_secret):
         logger.error(f"Lỗi tạo chữ ký: {str(e)}")
         return ""
 
+class CircuitBreaker:
+    """Cầu dao theo endpoint, dùng chung cho mọi bot: lỗi liên tiếp thì ngắt (fail-fast),
+    hết thời gian chờ thì chỉ cho một request thăm dò (half-open) trước khi đóng lại"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, failure_threshold=5, base_delay=1.0, max_delay=60.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.state = self.CLOSED
+        self.failures = 0
+        self.trips = 0
+        self.opened_at = 0
+        self.open_delay = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and get_clock().time() - self.opened_at >= self.open_delay:
+                self.state = self.HALF_OPEN
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info("Endpoint %s đã phục hồi", self.name)
+            self.state = self.CLOSED
+            self.failures = 0
+            self.trips = 0
+
+    def record_failure(self, retry_after=None):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold or retry_after:
+                self.trips += 1
+                # Chặn trên sau khi nhân jitter để thời gian ngắt không vượt max_delay
+                delay = min(self.max_delay, self.base_delay * 2 ** (self.trips - 1) * get_clock().random.uniform(0.5, 1.5))
+                self.open_delay = max(delay, retry_after or 0)
+                self.opened_at = get_clock().time()
+                self.state = self.OPEN
+                logger.error("Ngắt endpoint %s trong %.1fs", self.name, self.open_delay,
+                             extra={'log_key': f"breaker:{self.name}"})
+
+    def stats(self):
+        return {
+            'state': self.state,
+            'failures': self.failures,
+            'trips': self.trips,
+            'rejected': self.rejected,
+            'retry_in': max(0, self.opened_at + self.open_delay - get_clock().time()) if self.state == self.OPEN else 0
+        }
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+def get_circuit_breaker(endpoint):
+    breaker = _breakers.get(endpoint)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.setdefault(endpoint, CircuitBreaker(endpoint))
+    return breaker
+
+def circuit_breaker_stats():
+    return {endpoint: breaker.stats() for endpoint, breaker in list(_breakers.items())}
+
+def _backoff_delay(attempt, base=0.5, cap=8.0):
+    # Jitter trước rồi mới chặn cap, nếu không lần chờ có thể tới 1.5 * cap
+    return min(cap, base * 2 ** attempt * get_clock().random.uniform(0.5, 1.5))
+
+def _retry_after(e):
+    try:
+        return float(e.headers.get('Retry-After'))
+    except Exception:
+        return None
+
+class _InflightCall:
+    __slots__ = ('event', 'result')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+
+class RequestCoalescer:
+    """Gộp các request public giống hệt nhau đang chạy đồng thời thành một lần gọi (single-flight),
+    kèm cache rất ngắn theo endpoint"""
+
+    def __init__(self, ttls=None, max_entries=5000):
+        self.ttls = ttls or {}
+        self.max_entries = max_entries
+        self._inflight = {}
+        self._cache = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.merged = 0
+
+    def get(self, key, endpoint, fn):
+        ttl = self.ttls.get(endpoint, 0)
+        now = get_clock().time()
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None and now - cached[0] < ttl:
+                self.hits += 1
+                return cached[1]
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = _InflightCall()
+                self._inflight[key] = call
+                self.misses += 1
+            else:
+                self.merged += 1
+
+        if not leader:
+            call.event.wait()
+            return call.result
+
+        try:
+            call.result = fn()
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+                if ttl and call.result is not None:
+                    if len(self._cache) >= self.max_entries:
+                        self._evict(now)
+                    self._cache[key] = (get_clock().time(), call.result)
+            call.event.set()
+        return call.result
+
+    def _evict(self, now):
+        max_ttl = max(self.ttls.values(), default=0)
+        for key in [k for k, (ts, _) in self._cache.items() if now - ts >= max_ttl]:
+            del self._cache[key]
+        if len(self._cache) >= self.max_entries:
+            self._cache.clear()
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'merged': self.merged,
+            'inflight': len(self._inflight),
+            'cached': len(self._cache)
+        }
+
+# TTL (giây) của cache ngắn cho các endpoint public
+PUBLIC_CACHE_TTL = {
+    '/fapi/v1/exchangeInfo': 60.0,
+    '/fapi/v1/klines': 1.0,
+    '/fapi/v1/ticker/price': 0.5
+}
+
+public_coalescer = RequestCoalescer(PUBLIC_CACHE_TTL)
+
+def coalescer_stats():
+    return public_coalescer.stats()
+
 def binance_api_request(url, method='GET', params=None, headers=None):
+    if headers is None:
+        headers = {}
+    if 'User-Agent' not in headers:
+        headers['User-Agent'] = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+    if method.upper() == 'GET' and params:
+        url = f"{url}?{urllib.parse.urlencode(params)}"
+        params = None
+
+    # Request public (không ký) dùng chung kết quả giữa các bot
+    if method.upper() == 'GET' and 'X-MBX-APIKEY' not in headers:
+        return public_coalescer.get(url, _endpoint(url), lambda: _send_request(url, method, params, headers))
+    return _send_request(url, method, params, headers)
+
+def _send_request(url, method, params, headers):
     max_retries = 3
+    endpoint = _endpoint(url)
+    breaker = get_circuit_breaker(endpoint)
+
     for attempt in range(max_retries):
+        if not breaker.allow():
+            return None
         try:
-            if headers is None:
-                headers = {}
-            
-            if 'User-Agent' not in headers:
-                headers['User-Agent'] = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-            
             if method.upper() == 'GET':
-                if params:
-                    query = urllib.parse.urlencode(params)
-                    url = f"{url}?{query}"
                 req = urllib.request.Request(url, headers=headers)
             else:
                 data = urllib.parse.urlencode(params).encode() if params else None
                 req = urllib.request.Request(url, data=data, headers=headers, method=method)
             
-            with urllib.request.urlopen(req, timeout=30) as response:
+            with urllib.request.urlopen(req, timeout=30, context=_get_ssl_context()) as response:
                 if response.status == 200:
-                    return json.loads(response.read().decode())
+                    result = json_codec.loads(response.read())
+                    breaker.record_success()
+                    return result
                 else:
                     error_content = response.read().decode()
-                    logger.error(f"Lỗi API ({response.status}): {error_content}")
+                    logger.error("Lỗi API (%s): %s", response.status, error_content,
+                                 extra={'log_key': f"api:{endpoint}:{response.status}"})
                     if response.status == 401:
+                        breaker.record_success()
                         return None
-                    if response.status == 429:
-                        time.sleep(2 ** attempt)
-                    elif response.status >= 500:
-                        time.sleep(1)
+                    if response.status == 429 or response.status >= 500:
+                        breaker.record_failure()
+                    else:
+                        breaker.record_success()
+                    get_clock().sleep(_backoff_delay(attempt))
                     continue
                     
         except urllib.error.HTTPError as e:
             if e.code == 451:
-                logger.error(f"❌ Lỗi 451: Truy cập bị chặn")
+                logger.error("❌ Lỗi 451: Truy cập bị chặn", extra={'log_key': "api:451"})
+                breaker.record_success()
                 return None
             else:
-                logger.error(f"Lỗi HTTP ({e.code}): {e.reason}")            
+                logger.error("Lỗi HTTP (%s): %s", e.code, e.reason,
+                             extra={'log_key': f"api:{endpoint}:{e.code}",
+                                    'fields': {'endpoint': endpoint, 'status': e.code}})
+            if e.code in (418, 429):
+                # Bị giới hạn tần suất: ngắt ngay theo Retry-After để mọi bot cùng dừng
+                breaker.record_failure(retry_after=_retry_after(e) or _backoff_delay(attempt + 2))
+                return None
+            if e.code >= 500:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
             if e.code == 401:
                 return None
-            if e.code == 429:
-                time.sleep(2 ** attempt)
-            elif e.code >= 500:
-                time.sleep(1)
+            get_clock().sleep(_backoff_delay(attempt))
             continue
                 
         except Exception as e:
-            logger.error(f"Lỗi kết nối API (lần {attempt + 1}): {str(e)}")
-            time.sleep(1)
+            logger.error("Lỗi kết nối API (lần %s): %s", attempt + 1, e,
+                         extra={'log_key': f"api:{endpoint}:conn",
+                                'fields': {'endpoint': endpoint, 'attempt': attempt + 1}})
+            breaker.record_failure()
+            get_clock().sleep(_backoff_delay(attempt))
     
-    logger.error(f"Không thể thực hiện yêu cầu API sau {max_retries} lần thử")
+    logger.error("Không thể thực hiện yêu cầu API sau %s lần thử", max_retries,
+                 extra={'log_key': f"api:{endpoint}:failed"})
     return None
 
 def get_all_usdc_pairs(limit=100):
@@ -153,6 +346,23 @@ def get_step_size(symbol, api_key, api_secret):
         logger.error(f"Lỗi lấy step size: {str(e)}")
     return 0.001
 
+def get_tick_size(symbol, api_key=None, api_secret=None):
+    if not symbol:
+        return 0.0001
+    url = "https://fapi.binance.com/fapi/v1/exchangeInfo"
+    try:
+        data = binance_api_request(url)
+        if not data:
+            return 0.0001
+        for s in data['symbols']:
+            if s['symbol'] == symbol.upper():
+                for f in s['filters']:
+                    if f['filterType'] == 'PRICE_FILTER':
+                        return float(f['tickSize'])
+    except Exception as e:
+        logger.error(f"Lỗi lấy tick size: {str(e)}")
+    return 0.0001
+
 def set_leverage(symbol, lev, api_key, api_secret):
     if not symbol:
         return False
@@ -233,21 +443,183 @@ def cancel_all_orders(symbol, api_key, api_secret):
         url = f"https://fapi.binance.com/fapi/v1/allOpenOrders?{query}&signature={sig}"
         headers = {'X-MBX-APIKEY': api_key}
         
-        binance_api_request(url, method='DELETE', headers=headers)
-        return True
+        # None: request thất bại sau khi đã thử lại - nơi gọi (shutdown) cần biết để báo lại
+        return binance_api_request(url, method='DELETE', headers=headers) is not None
     except Exception as e:
         logger.error(f"Lỗi hủy lệnh: {str(e)}")
     return False
 
-def get_current_price(symbol):
+def place_trigger_order(symbol, side, order_type, stop_price, api_key, api_secret, qty=None,
+                        close_position=False, client_order_id=None):
+    # TAKE_PROFIT_MARKET / STOP_MARKET nằm trên sàn, kích hoạt theo giá đánh dấu kể cả khi bot không chạy
+    if not symbol:
+        return None
+    try:
+        ts = int(time.time() * 1000)
+        params = {
+            "symbol": symbol.upper(),
+            "side": side,
+            "type": order_type,
+            "stopPrice": stop_price,
+            "workingType": "MARK_PRICE",
+            "timestamp": ts
+        }
+        if close_position:
+            params["closePosition"] = "true"
+        else:
+            params["quantity"] = qty
+        if client_order_id:
+            params["newClientOrderId"] = client_order_id
+        query = urllib.parse.urlencode(params)
+        sig = sign(query, api_secret)
+        url = f"https://fapi.binance.com/fapi/v1/order?{query}&signature={sig}"
+        headers = {'X-MBX-APIKEY': api_key}
+
+        return binance_api_request(url, method='POST', headers=headers)
+    except Exception as e:
+        logger.error(f"Lỗi đặt lệnh điều kiện: {str(e)}")
+    return None
+
+def create_listen_key(api_key):
+    try:
+        url = "https://fapi.binance.com/fapi/v1/listenKey"
+        data = binance_api_request(url, method='POST', headers={'X-MBX-APIKEY': api_key})
+        return data.get('listenKey') if data else None
+    except Exception as e:
+        logger.error(f"Lỗi tạo listenKey: {str(e)}")
+    return None
+
+def keepalive_listen_key(api_key):
+    try:
+        url = "https://fapi.binance.com/fapi/v1/listenKey"
+        return binance_api_request(url, method='PUT', headers={'X-MBX-APIKEY': api_key}) is not None
+    except Exception as e:
+        logger.error(f"Lỗi gia hạn listenKey: {str(e)}")
+    return False
+
+class UserDataStream:
+    """Luồng dữ liệu tài khoản (listenKey): chuyển sự kiện khớp lệnh tới bot đang giữ symbol"""
+
+    STREAM_KEY = '!userData'
+
+    def __init__(self, api_key, ws_manager, keepalive_interval=1800):
+        self.api_key = api_key
+        self.ws_manager = ws_manager
+        self.keepalive_interval = keepalive_interval
+        self.listen_key = None
+        self.listeners = {}
+        self.executor = ThreadPoolExecutor(max_workers=4)
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if not self._connect():
+            return False
+        self._thread = threading.Thread(target=self._keepalive, daemon=True)
+        self._thread.start()
+        return True
+
+    def _connect(self):
+        self.listen_key = create_listen_key(self.api_key)
+        if not self.listen_key:
+            return False
+        self.ws_manager.remove_symbol(self.STREAM_KEY)
+        self.ws_manager.add_stream(self.STREAM_KEY, self.listen_key, self._handle)
+        return True
+
+    def _keepalive(self):
+        while not self._stop_event.wait(self.keepalive_interval):
+            if not keepalive_listen_key(self.api_key):
+                self._connect()
+
+    def subscribe(self, symbol, callback):
+        self.listeners[symbol] = callback
+
+    def unsubscribe(self, symbol, callback=None):
+        if callback is None or self.listeners.get(symbol) == callback:
+            self.listeners.pop(symbol, None)
+
+    def _handle(self, data):
+        event = data.get('e')
+        if event == 'ORDER_TRADE_UPDATE':
+            order = data.get('o') or {}
+            callback = self.listeners.get(order.get('s'))
+            if callback:
+                # Bot gọi REST khi xử lý khớp lệnh - không chặn luồng WebSocket
+                self.executor.submit(callback, order)
+        elif event == 'listenKeyExpired':
+            self._connect()
+
+    def stop(self):
+        self._stop_event.set()
+        self.ws_manager.remove_symbol(self.STREAM_KEY)
+        self.executor.shutdown(wait=False)
+
+class PriceCache:
+    """Giá gần nhất của mọi symbol trong tiến trình, được cập nhật từ các luồng WebSocket"""
+
+    def __init__(self, max_age=2.0):
+        self.max_age = max_age
+        self._prices = {}
+        self.fallback = None
+        self.hits = 0
+        self.misses = 0
+        self.last_update = 0
+
+    def update(self, symbol, price, ts=None):
+        ts = ts or get_clock().time()
+        self._prices[symbol] = (price, ts)
+        self.last_update = ts
+
+    def get(self, symbol, max_age=None):
+        entry = self._prices.get(symbol)
+        if entry is not None and get_clock().time() - entry[1] <= (self.max_age if max_age is None else max_age):
+            self.hits += 1
+            return entry[0]
+        if self.fallback is not None:
+            shared = self.fallback(symbol)
+            if shared and get_clock().time() - shared[1] <= (self.max_age if max_age is None else max_age):
+                self._prices[symbol] = shared
+                self.hits += 1
+                return shared[0]
+        self.misses += 1
+        return None
+
+    def stats(self):
+        return {'symbols': len(self._prices), 'hits': self.hits, 'misses': self.misses, 'max_age': self.max_age,
+                'last_update': self.last_update}
+
+price_cache = PriceCache(float(os.environ.get('PRICE_MAX_AGE', '2.0')))
+
+# Luồng giá toàn thị trường (cập nhật mỗi giây các symbol có thay đổi)
+BULK_PRICE_STREAM = os.environ.get('BULK_PRICE_STREAM', '!miniTicker@arr')
+
+def _handle_bulk_prices(data):
+    if not isinstance(data, list):
+        return
+    now = get_clock().time()
+    for item in data:
+        price = item.get('c') or item.get('p')
+        if price:
+            price_cache.update(item['s'], float(price), now)
+
+def start_price_feed(ws_manager):
+    ws_manager.add_stream(BULK_PRICE_STREAM, BULK_PRICE_STREAM, _handle_bulk_prices)
+
+def get_current_price(symbol, max_age=None):
     if not symbol:
         return 0
+    symbol = symbol.upper()
+    cached = price_cache.get(symbol, max_age)
+    if cached:
+        return cached
     try:
-        url = f"https://fapi.binance.com/fapi/v1/ticker/price?symbol={symbol.upper()}"
+        url = f"https://fapi.binance.com/fapi/v1/ticker/price?symbol={symbol}"
         data = binance_api_request(url)
         if data and 'price' in data:
             price = float(data['price'])
             if price > 0:
+                price_cache.update(symbol, price)
                 return price
         return 0
     except Exception as e:
@@ -255,6 +627,7 @@ def get_current_price(symbol):
     return 0
 
 def get_positions(symbol=None, api_key=None, api_secret=None):
+    # None = không lấy được (lỗi mạng/API), [] = tài khoản thật sự không có vị thế
     try:
         ts = int(time.time() * 1000)
         params = {"timestamp": ts}
@@ -266,6 +639,8 @@ def get_positions(symbol=None, api_key=None, api_secret=None):
         headers = {'X-MBX-APIKEY': api_key}
         
         positions = binance_api_request(url, headers=headers)
+        if positions is None:
+            return None
         if not positions:
             return []
         if symbol:
@@ -275,82 +650,247 @@ def get_positions(symbol=None, api_key=None, api_secret=None):
         return positions
     except Exception as e:
         logger.error(f"Lỗi lấy vị thế: {str(e)}")
-    return []
+    return None
+
+# Giám sát kết nối WebSocket: ping chủ động để đo RTT, coi là treo nếu im lặng quá lâu
+WS_PING_INTERVAL = float(os.environ.get('WS_PING_INTERVAL', '20'))
+WS_PONG_TIMEOUT = float(os.environ.get('WS_PONG_TIMEOUT', '10'))
+WS_STALL_TIMEOUT = float(os.environ.get('WS_STALL_TIMEOUT', '60'))
+# Kết nối sống lâu hơn mức này thì lần rớt sau bắt đầu lại backoff từ đầu
+WS_STABLE_AFTER = 60
 
 class WebSocketManager:
-    def __init__(self):
+    """Mỗi stream một kết nối (một thread run_forever); một thread giám sát duy nhất lo ping, phát hiện treo
+    và kết nối lại có backoff - callback của socket không tự ngủ hay tạo thread mới"""
+
+    def __init__(self, clock=None, supervise_interval=1.0):
+        self.clock = clock or get_clock()
         self.connections = {}
         self.executor = ThreadPoolExecutor(max_workers=30)
+        self.supervise_interval = supervise_interval
         self._lock = threading.Lock()
         self._stop_event = threading.Event()
+        self._supervisor = None
         
     def add_symbol(self, symbol, callback):
         if not symbol:
             return
         symbol = symbol.upper()
-        with self._lock:
-            if symbol not in self.connections:
-                self._create_connection(symbol, callback)
-                
-    def _create_connection(self, symbol, callback):
+
+        def handle_trade(data):
+            if 'p' in data:
+                price = float(data['p'])
+                price_cache.update(symbol, price)
+                try:
+                    self.executor.submit(callback, price)
+                except RuntimeError:
+                    # executor đã shutdown trong stop(), tin nhắn đến muộn thì bỏ qua
+                    pass
+
+        self.add_stream(symbol, f"{symbol.lower()}@trade", handle_trade, fields=('p',))
+
+    def add_stream(self, key, stream, handler, fields=None):
+        # fields: chỉ trích các khoá cần thiết thay vì giải mã toàn bộ tin nhắn
         if self._stop_event.is_set():
             return
-        stream = f"{symbol.lower()}@trade"
-        url = f"wss://fstream.binance.com/ws/{stream}"
-        
+        with self._lock:
+            if key in self.connections:
+                return
+            conn = self.connections[key] = {
+                'key': key,
+                'stream': stream,
+                'handler': handler,
+                'fields': fields,
+                'ws': None,
+                'thread': None,
+                'state': 'connecting',
+                'created_at': self.clock.time(),
+                'started_at': 0,
+                'connected_at': 0,
+                'last_message': 0,
+                'messages': 0,
+                'uptime': 0.0,
+                'reconnects': 0,
+                'stalls': 0,
+                'failures': 0,
+                'retry_at': 0,
+                'ping_sent': 0,
+                'last_pong': 0,
+                'rtt': None,
+                'last_error': None
+            }
+            self._start(conn)
+            if self._supervisor is None:
+                self._supervisor = threading.Thread(target=self._supervise, args=(self.clock.register(),),
+                                                    daemon=True)
+                self._supervisor.start()
+
+    def _start(self, conn):
+        import websocket
+
+        key = conn['key']
+        handler = conn['handler']
+        fields = conn['fields']
+
+        def on_open(ws):
+            now = self.clock.time()
+            conn['state'] = 'open'
+            conn['connected_at'] = now
+            conn['last_message'] = now
+
         def on_message(ws, message):
+            conn['last_message'] = self.clock.time()
+            conn['messages'] += 1
             try:
-                data = json.loads(message)
-                if 'p' in data:
-                    price = float(data['p'])
-                    self.executor.submit(callback, price)
+                data = json_codec.extract_fields(message, fields) if fields else None
+                handler(data if data is not None else json_codec.loads(message))
             except Exception as e:
-                logger.error(f"Lỗi xử lý tin nhắn WebSocket {symbol}: {str(e)}")
-                
+                logger.error("Lỗi xử lý tin nhắn WebSocket %s: %s", key, e,
+                             extra={'log_key': f"ws_msg:{key}"})
+
+        def on_pong(ws, data):
+            now = time.monotonic()
+            if conn['ping_sent']:
+                conn['rtt'] = now - conn['ping_sent']
+                conn['ping_sent'] = 0
+            conn['last_pong'] = self.clock.time()
+
         def on_error(ws, error):
-            logger.error(f"Lỗi WebSocket {symbol}: {str(error)}")
-            if not self._stop_event.is_set():
-                time.sleep(5)
-                self._reconnect(symbol, callback)
-            
+            conn['last_error'] = str(error)
+            logger.error("Lỗi WebSocket %s: %s", key, error, extra={'log_key': f"ws_err:{key}"})
+
         def on_close(ws, close_status_code, close_msg):
-            if not self._stop_event.is_set() and symbol in self.connections:
-                time.sleep(5)
-                self._reconnect(symbol, callback)
-                
+            self._mark_closed(conn)
+
         ws = websocket.WebSocketApp(
-            url,
+            f"wss://fstream.binance.com/ws/{conn['stream']}",
+            on_open=on_open,
             on_message=on_message,
+            on_pong=on_pong,
             on_error=on_error,
             on_close=on_close
         )
-        
-        thread = threading.Thread(target=ws.run_forever, daemon=True)
-        thread.start()
-        
-        self.connections[symbol] = {
-            'ws': ws,
-            'thread': thread,
-            'callback': callback
-        }
-        
-    def _reconnect(self, symbol, callback):
-        self.remove_symbol(symbol)
-        self._create_connection(symbol, callback)
-        
+        conn['ws'] = ws
+        conn['state'] = 'connecting'
+        conn['started_at'] = self.clock.time()
+        conn['ping_sent'] = 0
+        conn['thread'] = threading.Thread(target=ws.run_forever, daemon=True)
+        conn['thread'].start()
+
+    def _mark_closed(self, conn):
+        with self._lock:
+            if conn['state'] == 'closed':
+                return
+            now = self.clock.time()
+            if conn['connected_at']:
+                session = now - conn['connected_at']
+                conn['uptime'] += session
+                conn['connected_at'] = 0
+                if session >= WS_STABLE_AFTER:
+                    conn['failures'] = 0
+            conn['state'] = 'closed'
+            conn['retry_at'] = now + _backoff_delay(conn['failures'], base=1.0, cap=60.0)
+            conn['failures'] += 1
+
+    def _close_socket(self, conn):
+        try:
+            conn['ws'].close()
+        except Exception:
+            pass
+
+    def _supervise(self, ticket=None):
+        with self.clock.participant(ticket):
+            while not self.clock.wait(self._stop_event, self.supervise_interval):
+                for conn in list(self.connections.values()):
+                    try:
+                        self._check(conn)
+                    except Exception as e:
+                        logger.error("Lỗi giám sát WebSocket %s: %s", conn['key'], e,
+                                     extra={'log_key': f"ws_sup:{conn['key']}"})
+
+    def _check(self, conn):
+        now = self.clock.time()
+        thread = conn['thread']
+        if conn['state'] == 'open':
+            last_activity = max(conn['last_message'], conn['last_pong'], conn['connected_at'])
+            if conn['ping_sent'] and time.monotonic() - conn['ping_sent'] > WS_PONG_TIMEOUT:
+                reason = "không nhận được pong"
+            elif now - last_activity > WS_STALL_TIMEOUT:
+                reason = f"im lặng {now - last_activity:.0f}s"
+            else:
+                reason = None
+            if reason:
+                conn['stalls'] += 1
+                conn['last_error'] = reason
+                logger.warning("WebSocket %s bị treo (%s), kết nối lại", conn['key'], reason,
+                               extra={'log_key': f"ws_stall:{conn['key']}"})
+                self._close_socket(conn)
+                self._mark_closed(conn)
+            elif not conn['ping_sent'] and now - max(conn['last_pong'], conn['connected_at']) >= WS_PING_INTERVAL:
+                sock = conn['ws'].sock
+                if sock is not None:
+                    conn['ping_sent'] = time.monotonic()
+                    sock.ping()
+            return
+
+        if thread is not None and thread.is_alive():
+            if conn['state'] == 'connecting' and now - conn['started_at'] > WS_STALL_TIMEOUT:
+                conn['last_error'] = "quá thời gian kết nối"
+                self._close_socket(conn)
+                self._mark_closed(conn)
+            elif conn['state'] == 'closed':
+                # Chờ thread cũ thoát hẳn rồi mới mở kết nối mới - không bao giờ có hai thread cho một stream
+                self._close_socket(conn)
+            return
+        if conn['state'] != 'closed':
+            # run_forever thoát mà không gọi on_close (lỗi khi bắt tay, DNS, ...)
+            self._mark_closed(conn)
+        if now < conn['retry_at']:
+            return
+        with self._lock:
+            if self.connections.get(conn['key']) is not conn or self._stop_event.is_set():
+                return
+            conn['reconnects'] += 1
+            self._start(conn)
+
     def remove_symbol(self, symbol):
         if not symbol:
             return
-        symbol = symbol.upper()
+        key = symbol.upper() if not symbol.startswith('!') else symbol
         with self._lock:
-            if symbol in self.connections:
-                try:
-                    self.connections[symbol]['ws'].close()
-                except:
-                    pass
-                del self.connections[symbol]
+            conn = self.connections.pop(key, None)
+        # Đóng ngoài khoá: on_close của socket cũng cần khoá
+        if conn is not None and conn['ws'] is not None:
+            self._close_socket(conn)
+
+    def stats(self):
+        now = self.clock.time()
+        streams = {}
+        for key, conn in list(self.connections.items()):
+            session = now - conn['connected_at'] if conn['state'] == 'open' and conn['connected_at'] else 0
+            age = now - conn['created_at']
+            streams[key] = {
+                'state': conn['state'],
+                'uptime': session,
+                'uptime_ratio': (conn['uptime'] + session) / age if age > 0 else None,
+                'reconnects': conn['reconnects'],
+                'stalls': conn['stalls'],
+                'messages': conn['messages'],
+                'last_message_age': now - conn['last_message'] if conn['last_message'] else None,
+                'rtt_ms': conn['rtt'] * 1000 if conn['rtt'] is not None else None,
+                'retry_in': max(0, conn['retry_at'] - now) if conn['state'] == 'closed' else 0,
+                'last_error': conn['last_error']
+            }
+        return {
+            'streams': streams,
+            'open': sum(1 for s in streams.values() if s['state'] == 'open'),
+            'threads': sum(1 for conn in list(self.connections.values())
+                           if conn['thread'] is not None and conn['thread'].is_alive())
+        }
                 
     def stop(self):
         self._stop_event.set()
         for symbol in list(self.connections.keys()):
             self.remove_symbol(symbol)
+        # Không chờ các callback đang chạy - chúng có thể đang gọi REST, luồng gọi stop() không nên bị treo theo
+        self.executor.shutdown(wait=False)
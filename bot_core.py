@@ -1,18 +1,48 @@
+import os
 import time
 import threading
-import random
 import math
-from collections import defaultdict
+import zlib
+import itertools
+import hashlib
+from collections import defaultdict, OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from binance_client import (
     get_max_leverage, get_step_size, set_leverage, get_balance, 
-    place_order, cancel_all_orders, get_current_price, get_positions,
-    get_all_usdc_pairs, binance_api_request, WebSocketManager
+    place_order, cancel_all_orders, get_current_price, get_positions, get_tick_size, place_trigger_order,
+    binance_api_request, WebSocketManager, start_price_feed, UserDataStream
 )
+from strategies import VolumeSignalStrategy
+from risk_engine import RiskEngine
+from order_book import OrderBookManager
+from clock import get_clock
+
+# Số thứ tự toàn cục cho mọi thay đổi trạng thái bot (dùng cho /api/bots?since=)
+_state_version = itertools.count(1)
+
+def account_fingerprint(api_key):
+    return hashlib.sha256((api_key or "").encode()).hexdigest()[:12]
+
+def _removed_window_lost(removed_bots, since):
+    """True nếu deque xoá đã đầy và có thể đã đẩy ra bản ghi mới hơn since"""
+    return len(removed_bots) == removed_bots.maxlen and since < removed_bots[0][0]
+
+
+def shard_for_symbol(symbol, shards):
+    # Cách chia symbol cho shard dùng chung cho bot tĩnh (ShardedBotManager) và coin của bot động (CoinManager)
+    return zlib.crc32(symbol.upper().encode()) % shards
 
 class CoinManager:
-    def __init__(self):
+    def __init__(self, shard_id=0, shards=1):
         self.active_coins = set()
+        self.shard_id = shard_id
+        self.shards = shards
         self._lock = threading.Lock()
+
+    def owns(self, symbol):
+        # Nhiều shard: mỗi symbol chỉ thuộc một shard để bot ở hai tiến trình không giành cùng một coin
+        return self.shards <= 1 or shard_for_symbol(symbol, self.shards) == self.shard_id
     
     def register_coin(self, symbol):
         if not symbol:
@@ -36,57 +66,113 @@ class CoinManager:
         with self._lock:
             return list(self.active_coins)
 
+    def try_claim(self, symbol):
+        # Kiểm tra và đăng ký trong cùng một lần giữ khoá để hai bot không chọn trùng coin
+        if not symbol:
+            return False
+        symbol = symbol.upper()
+        if not self.owns(symbol):
+            return False
+        with self._lock:
+            if symbol in self.active_coins:
+                return False
+            self.active_coins.add(symbol)
+            return True
+
+class EligibleUniverse:
+    """Chỉ mục các cặp USDC theo đòn bẩy tối đa và trạng thái, cập nhật tăng dần từ exchangeInfo"""
+
+    def __init__(self, quote_asset='USDC', refresh_interval=300):
+        self.quote_asset = quote_asset
+        self.refresh_interval = refresh_interval
+        self.symbols = {}
+        self.by_leverage = defaultdict(set)
+        self.by_status = defaultdict(set)
+        self.last_refresh = 0
+        self._lock = threading.Lock()
+
+    def _parse(self, data):
+        parsed = {}
+        for symbol_info in data.get('symbols', []):
+            symbol = symbol_info.get('symbol', '')
+            if not symbol.endswith(self.quote_asset):
+                continue
+            max_lev = 1
+            for f in symbol_info.get('filters', []):
+                if f.get('filterType') == 'LEVERAGE' and 'maxLeverage' in f:
+                    max_lev = int(f['maxLeverage'])
+            parsed[symbol] = (max_lev, symbol_info.get('status'))
+        return parsed
+
+    def update(self, data):
+        parsed = self._parse(data)
+        with self._lock:
+            for symbol in [s for s in self.symbols if s not in parsed]:
+                self._remove(symbol)
+            for symbol, entry in parsed.items():
+                if self.symbols.get(symbol) != entry:
+                    self._remove(symbol)
+                    max_lev, status = entry
+                    self.symbols[symbol] = entry
+                    self.by_leverage[max_lev].add(symbol)
+                    self.by_status[status].add(symbol)
+            self.last_refresh = get_clock().time()
+
+    def _remove(self, symbol):
+        entry = self.symbols.pop(symbol, None)
+        if entry:
+            self.by_leverage[entry[0]].discard(symbol)
+            self.by_status[entry[1]].discard(symbol)
+
+    def refresh(self, force=False):
+        if not force and get_clock().time() - self.last_refresh < self.refresh_interval:
+            return
+        data = binance_api_request("https://fapi.binance.com/fapi/v1/exchangeInfo")
+        if data:
+            self.update(data)
+
+    def max_leverage(self, symbol):
+        entry = self.symbols.get(symbol.upper()) if symbol else None
+        return entry[0] if entry else None
+
+    def candidates(self, required_leverage=1, excluded=None, status='TRADING'):
+        self.refresh()
+        with self._lock:
+            result = set()
+            for max_lev, bucket in self.by_leverage.items():
+                if max_lev >= required_leverage:
+                    result |= bucket
+            result &= self.by_status[status]
+        if excluded:
+            result.difference_update(excluded)
+        return result
+
+eligible_universe = EligibleUniverse()
+
 class SmartCoinFinder:
-    def __init__(self, api_key, api_secret):
+    def __init__(self, api_key, api_secret, universe=None, strategy=None):
         self.api_key = api_key
         self.api_secret = api_secret
+        self.universe = universe or eligible_universe
+        self.strategy = strategy or VolumeSignalStrategy()
+        self.max_scan = 100
         
     def get_symbol_leverage(self, symbol):
+        self.universe.refresh()
+        max_lev = self.universe.max_leverage(symbol)
+        if max_lev is not None:
+            return max_lev
         return get_max_leverage(symbol, self.api_key, self.api_secret)
     
     def get_volume_signal(self, symbol):
-        try:
-            data = binance_api_request(
-                "https://fapi.binance.com/fapi/v1/klines",
-                params={"symbol": symbol, "interval": "5m", "limit": 10}
-            )
-            if not data or len(data) < 10:
-                return None
-            
-            current_candle = data[-2]
-            prev_candle = data[-3]
-
-            open_price = float(current_candle[1])
-            close_price = float(current_candle[4])
-            current_volume = float(current_candle[5])
-            prev_volume = float(prev_candle[5])
+        return self.strategy.signal(symbol)
 
-            volumes = [float(k[5]) for k in data[:-1]]
-            avg_volume = sum(volumes) / len(volumes)
-
-            volume_increase = current_volume > prev_volume * 1.2
-            volume_above_average = current_volume > avg_volume * 1.1
-
-            if close_price > open_price:
-                candle_direction = "GREEN"
-            elif close_price < open_price:
-                candle_direction = "RED"
-            else:
-                candle_direction = "DOJI"
-
-            if volume_increase and volume_above_average:
-                if candle_direction == "GREEN":
-                    return "BUY"
-                elif candle_direction == "RED":
-                    return "SELL"
-            return None
-
-        except Exception as e:
-            return None
-    
     def has_existing_position(self, symbol):
         try:
             positions = get_positions(symbol, self.api_key, self.api_secret)
+            if positions is None:
+                # Không rõ trạng thái: coi như đang có vị thế để không mở chồng lên
+                return True
             if positions:
                 for pos in positions:
                     position_amt = float(pos.get('positionAmt', 0))
@@ -96,42 +182,77 @@ class SmartCoinFinder:
         except Exception:
             return False
     
-    def find_best_coin(self, target_direction, excluded_coins=None, required_leverage=10):
+    def _symbols_with_position(self):
+        positions = get_positions(api_key=self.api_key, api_secret=self.api_secret)
+        if positions is None:
+            raise IOError("Không lấy được danh sách vị thế")
+        return {pos['symbol'] for pos in positions if abs(float(pos.get('positionAmt', 0))) > 0}
+
+    def find_best_coin(self, target_direction, excluded_coins=None, required_leverage=10, claim=None,
+                       symbol_filter=None):
         try:
-            all_symbols = get_all_usdc_pairs(limit=100)
-            if not all_symbols:
+            candidates = self.universe.candidates(required_leverage, excluded_coins)
+            if symbol_filter is not None:
+                candidates = {symbol for symbol in candidates if symbol_filter(symbol)}
+            if not candidates:
                 return None
-            
-            valid_symbols = []
-            
-            for symbol in all_symbols:
-                if excluded_coins and symbol in excluded_coins:
-                    continue
-                
-                if self.has_existing_position(symbol):
-                    continue
-                
-                max_lev = self.get_symbol_leverage(symbol)
-                if max_lev < required_leverage:
+            candidates.difference_update(self._symbols_with_position())
+
+            # Duyệt ngẫu nhiên và dừng ở coin đầu tiên khớp tín hiệu và giành được quyền sử dụng
+            ordered = sorted(candidates)
+            get_clock().random.shuffle(ordered)
+            for symbol in ordered[:self.max_scan]:
+                if self.strategy.signal(symbol) != target_direction:
                     continue
-                
-                volume_signal = self.get_volume_signal(symbol)
-                if volume_signal == target_direction:
-                    valid_symbols.append(symbol)
-            
-            if not valid_symbols:
-                return None
-            
-            selected_symbol = random.choice(valid_symbols)
-            return selected_symbol
+                if claim is None or claim(symbol):
+                    return symbol
+            return None
             
         except Exception:
             return None
 
 class BaseBot:
-    def __init__(self, symbol, lev, percent, tp, sl, roi_trigger, ws_manager, api_key, api_secret,
-                 strategy_name, config_key=None, bot_id=None, coin_manager=None, symbol_locks=None):
+    # Chiến lược mặc định, lớp con có thể thay bằng chiến lược khác trong strategies.py
+    strategy_class = VolumeSignalStrategy
+
+    # Các trường xuất hiện trong get_bot_info - thay đổi sẽ được báo cho state_listener
+    TRACKED_FIELDS = frozenset([
+        'symbol', 'status', 'side', 'qty', 'entry', 'current_price', 'position_open',
+        'last_side', 'is_first_trade', 'average_down_count',
+        'global_long_count', 'global_short_count', 'global_long_pnl', 'global_short_pnl'
+    ])
+    # Các trường được lưu vào StateStore để khôi phục bot sau khi khởi động lại
+    PERSISTED_FIELDS = frozenset([
+        'symbol', 'status', 'side', 'qty', 'entry', 'entry_base', 'average_down_count',
+        'high_water_mark_roi', 'roi_check_activated', 'last_side', 'is_first_trade',
+        'last_trade_time', 'last_close_time', 'last_average_down_time', 'trade_id'
+    ])
+    WATCHED_FIELDS = TRACKED_FIELDS | PERSISTED_FIELDS
+    # Ngưỡng ROI âm (%) tính từ giá vào ban đầu cho từng lần nhồi lệnh
+    FIB_LEVELS = (200, 300, 500, 800, 1300, 2100, 3400)
 
+    def __init__(self, symbol, lev, percent, tp, sl, roi_trigger, ws_manager, api_key, api_secret,
+                 strategy_name, config_key=None, bot_id=None, coin_manager=None, symbol_locks=None,
+                 state_listener=None, positions_listener=None, restored_state=None, positions=None,
+                 journal=None, strategy=None, risk_engine=None, user_stream=None, order_books=None,
+                 clock=None):
+
+        # Đồng hồ cho cooldown, chu kỳ kiểm tra và các lần ngủ - VirtualClock khi mô phỏng
+        self.clock = clock or get_clock()
+        self.state_listener = state_listener
+        self.positions_listener = positions_listener
+        self.version = next(_state_version)
+        self._info_cache = None
+        self.journal = journal
+        self.risk_engine = risk_engine
+        self.order_books = order_books
+        # Có user_stream: TP/SL và bậc nhồi lệnh được đặt sẵn trên sàn, bot chỉ đối chiếu khi khớp lệnh
+        self.user_stream = user_stream
+        self._exchange_orders = {}
+        self._exchange_retry_at = 0
+        self._order_seq = 0
+        self._bracket_lock = threading.RLock()
+        self.trade_id = None
         self.symbol = symbol.upper() if symbol else None
         self.lev = lev
         self.percent = percent
@@ -143,7 +264,7 @@ class BaseBot:
         self.api_secret = api_secret
         self.strategy_name = strategy_name
         self.config_key = config_key
-        self.bot_id = bot_id or f"{strategy_name}_{int(time.time())}_{random.randint(1000, 9999)}"
+        self.bot_id = bot_id or f"{strategy_name}_{int(self.clock.time())}_{self.clock.random.randint(1000, 9999)}"
 
         self.status = "searching"
         self.side = ""
@@ -153,6 +274,12 @@ class BaseBot:
         self.current_price = 0
         self.position_open = False
         self._stop = False
+        self._stop_event = threading.Event()
+        # Số lệnh đang gửi (luồng bot và luồng user stream) - _order_idle được set khi về 0
+        self._orders_in_flight = 0
+        self._order_lock = threading.Lock()
+        self._order_idle = threading.Event()
+        self._order_idle.set()
 
         self.last_trade_time = 0
         self.last_close_time = 0
@@ -170,7 +297,9 @@ class BaseBot:
         self.coin_manager = coin_manager or CoinManager()
         self.symbol_locks = symbol_locks
 
-        self.coin_finder = SmartCoinFinder(api_key, api_secret)
+        self.strategy = strategy or self.strategy_class()
+        self._signal_symbol = None
+        self.coin_finder = SmartCoinFinder(api_key, api_secret, strategy=self.strategy)
 
         self.last_side = None
         self.is_first_trade = True
@@ -194,25 +323,48 @@ class BaseBot:
         self.global_position_check_interval = 10
 
         self.find_new_bot_after_close = True
-        self.bot_creation_time = time.time()
+        self.bot_creation_time = self.clock.time()
 
-        if symbol and self.coin_finder.has_existing_position(symbol):
+        if restored_state:
+            self._restore_state(restored_state, positions)
+        elif positions is not None:
+            self._init_from_snapshot(positions)
+        elif symbol and self.coin_finder.has_existing_position(symbol):
             self.symbol = None
             self.status = "searching"
         else:
             self.check_position_status()
             if self.symbol:
-                self.ws_manager.add_symbol(self.symbol, self._handle_price_update)
+                self._watch_symbol(self.symbol)
 
-        self.thread = threading.Thread(target=self._run, daemon=True)
+        # Vé của đồng hồ lấy ngay tại đây để thứ tự các bot trong mô phỏng không phụ thuộc lịch thread
+        self.thread = threading.Thread(target=self._run, args=(self.clock.register(),), daemon=True)
         self.thread.start()
 
+    def __setattr__(self, name, value):
+        if name not in self.WATCHED_FIELDS:
+            object.__setattr__(self, name, value)
+            return
+        old = self.__dict__.get(name)
+        object.__setattr__(self, name, value)
+        if old != value:
+            if name in self.TRACKED_FIELDS:
+                object.__setattr__(self, 'version', next(_state_version))
+            listener = self.__dict__.get('state_listener')
+            if listener:
+                try:
+                    listener(self, name, old, value)
+                except Exception:
+                    pass
+
     def check_position_status(self):
         if not self.symbol:
             return
             
         try:
             positions = get_positions(self.symbol, self.api_key, self.api_secret)
+            if positions is None:
+                return
             if not positions:
                 self._reset_position()
                 return
@@ -220,21 +372,9 @@ class BaseBot:
             position_found = False
             for pos in positions:
                 if pos['symbol'] == self.symbol:
-                    position_amt = float(pos.get('positionAmt', 0))
-                    if abs(position_amt) > 0:
-                        position_found = True
-                        self.position_open = True
-                        self.status = "open"
-                        self.side = "BUY" if position_amt > 0 else "SELL"
-                        self.qty = position_amt
-                        self.entry = float(pos.get('entryPrice', 0))
-                        self.last_side = self.side
-                        self.is_first_trade = False
-                        break
-                    else:
-                        position_found = True
-                        self._reset_position()
-                        break
+                    position_found = True
+                    self._apply_position(pos)
+                    break
             
             if not position_found:
                 self._reset_position()
@@ -242,9 +382,88 @@ class BaseBot:
         except Exception:
             pass
 
+    def _apply_position(self, pos):
+        position_amt = float(pos.get('positionAmt', 0)) if pos else 0
+        if abs(position_amt) > 0:
+            if self.position_open and self._exchange_orders:
+                self._reconcile_exchange_orders(position_amt, float(pos.get('entryPrice', 0)))
+            self.position_open = True
+            self.status = "open"
+            self.side = "BUY" if position_amt > 0 else "SELL"
+            self.qty = position_amt
+            self.entry = float(pos.get('entryPrice', 0))
+            self.last_side = self.side
+            self.is_first_trade = False
+        else:
+            self._reset_position()
+
+    def get_persist_state(self):
+        state = {key: getattr(self, key) for key in self.PERSISTED_FIELDS}
+        state.update({
+            'bot_id': self.bot_id,
+            'bot_class': type(self).__name__,
+            'account': account_fingerprint(self.api_key),
+            'lev': self.lev,
+            'percent': self.percent,
+            'tp': self.tp,
+            'sl': self.sl,
+            'roi_trigger': self.roi_trigger,
+            'bot_creation_time': self.bot_creation_time
+        })
+        return state
+
+    def _init_from_snapshot(self, positions):
+        # Giống nhánh khởi tạo thường nhưng dùng snapshot vị thế chung thay cho REST riêng từng bot
+        pos = positions.get(self.symbol) if self.symbol else None
+        if pos is not None and abs(float(pos.get('positionAmt', 0))) > 0:
+            self.symbol = None
+            self.status = "searching"
+        elif self.symbol:
+            self._reset_position()
+            self._watch_symbol(self.symbol)
+
+    def _restore_state(self, state, positions=None):
+        for key in self.PERSISTED_FIELDS:
+            if key in state:
+                setattr(self, key, state[key])
+        self.bot_creation_time = state.get('bot_creation_time', self.bot_creation_time)
+        if not self.symbol:
+            self.status = "searching"
+            return
+
+        # Tin trạng thái đã lưu cho tới khi sàn trả lời được - lỗi REST lúc khởi động không được
+        # khiến bot coi là không có vị thế và mở chồng lên vị thế thật
+        self.position_open = bool(self.qty)
+        restored_open = self.position_open
+        # Đối chiếu với snapshot vị thế chung, chỉ gọi REST khi không có snapshot
+        if positions is None:
+            self.check_position_status()
+        else:
+            self._apply_position(positions.get(self.symbol))
+        if restored_open and not self.position_open:
+            # Vị thế đã đóng trên sàn khi tiến trình dừng (TP/SL khớp): lệnh chờ còn lại như bậc nhồi lệnh
+            # không nằm trong _exchange_orders sau khi khởi động lại nên phải huỷ theo symbol
+            cancel_all_orders(self.symbol, self.api_key, self.api_secret)
+        self.coin_manager.register_coin(self.symbol)
+        self._watch_symbol(self.symbol)
+
     def check_global_positions(self):
+        summary = self.risk_engine.side_summary() if self.risk_engine else None
+        if summary is not None:
+            # Sổ rủi ro chung đã cộng dồn sẵn, không cần tải lại toàn bộ vị thế
+            self.global_long_count = summary['long_count']
+            self.global_short_count = summary['short_count']
+            self.global_long_pnl = summary['long_pnl']
+            self.global_short_pnl = summary['short_pnl']
+            self.global_long_value = summary['long_value']
+            self.global_short_value = summary['short_value']
+            return
         try:
             positions = get_positions(api_key=self.api_key, api_secret=self.api_secret)
+            if positions is None:
+                return
+            if self.positions_listener:
+                self.positions_listener(positions)
             if not positions:
                 self.global_long_count = 0
                 self.global_short_count = 0
@@ -299,7 +518,7 @@ class BaseBot:
         elif short_pnl > long_pnl:
             return "SELL"
         else:
-            return random.choice(["BUY", "SELL"])
+            return self.clock.random.choice(["BUY", "SELL"])
 
     def _reset_position(self):
         self.position_open = False
@@ -315,6 +534,10 @@ class BaseBot:
         self.entry_red_count = 0
         self.high_water_mark_roi = 0
         self.roi_check_activated = False
+        if self._exchange_orders:
+            # Vị thế đã đóng mà còn lệnh chờ trên sàn (ví dụ bậc nhồi lệnh) - huỷ để không mở lại vị thế
+            self._exchange_orders = {}
+            cancel_all_orders(self.symbol, self.api_key, self.api_secret)
 
     def find_and_set_coin(self):
         try:
@@ -324,18 +547,18 @@ class BaseBot:
             new_symbol = self.coin_finder.find_best_coin(
                 target_direction=target_direction,
                 excluded_coins=active_coins,
-                required_leverage=self.lev
+                required_leverage=self.lev,
+                claim=self.coin_manager.try_claim,
+                symbol_filter=self.coin_manager.owns
             )
             
             if new_symbol:
-                self.coin_manager.register_coin(new_symbol)
-                
                 if self.symbol:
-                    self.ws_manager.remove_symbol(self.symbol)
+                    self._unwatch_symbol(self.symbol)
                     self.coin_manager.unregister_coin(self.symbol)
                 
                 self.symbol = new_symbol
-                self.ws_manager.add_symbol(new_symbol, self._handle_price_update)
+                self._watch_symbol(new_symbol)
                 self.status = "waiting"
                 return True
             else:
@@ -357,18 +580,22 @@ class BaseBot:
         except Exception:
             return False
 
-    def _run(self):
+    def _run(self, ticket=None):
+        with self.clock.participant(ticket):
+            self._loop()
+
+    def _loop(self):
         while not self._stop:
             try:
-                current_time = time.time()
+                current_time = self.clock.time()
                 
                 if current_time - getattr(self, '_last_leverage_check', 0) > 60:
                     if not self.verify_leverage_and_switch():
                         if self.symbol:
-                            self.ws_manager.remove_symbol(self.symbol)
+                            self._unwatch_symbol(self.symbol)
                             self.coin_manager.unregister_coin(self.symbol)
                             self.symbol = None
-                        time.sleep(1)
+                        self._sleep(1)
                         continue
                     self._last_leverage_check = current_time
                 
@@ -380,39 +607,45 @@ class BaseBot:
                     self.check_position_status()
                     self.last_position_check = current_time
                 
+                if self.position_open and self._exchange_orders:
+                    # TP/SL/nhồi lệnh đã nằm trên sàn - chỉ cần chờ sự kiện khớp lệnh và đối chiếu định kỳ
+                    self._sleep(self.position_check_interval)
+                    continue
+
                 if self.position_open:
-                    self.check_averaging_down()
+                    if not self._place_exchange_orders():
+                        self.check_averaging_down()
                               
                 if not self.position_open:
                     if not self.symbol:
                         if self.find_and_set_coin():
                             pass
                         else:
-                            time.sleep(5)
+                            self._sleep(5)
                         continue
                     
                     if current_time - self.last_trade_time > 60 and current_time - self.last_close_time > self.cooldown_period:
                         target_side = self.get_next_side_based_on_comprehensive_analysis()
-                        current_volume_signal = self.coin_finder.get_volume_signal(self.symbol)
+                        current_volume_signal = self.strategy.signal(self.symbol)
                         
                         if current_volume_signal == target_side:
                             if self.open_position(target_side):
                                 self.last_trade_time = current_time
                             else:
-                                time.sleep(1)
+                                self._sleep(1)
                         else:
                             self._cleanup_symbol()
-                            time.sleep(1)
+                            self._sleep(1)
                     else:
-                        time.sleep(1)
+                        self._sleep(1)
                 
-                if self.position_open and not self._close_attempted:
+                if self.position_open and not self._close_attempted and not self._exchange_orders:
                     self.check_tp_sl()
                     
-                time.sleep(1)
+                self._sleep(1)
             
             except Exception:
-                time.sleep(1)
+                self._sleep(1)
 
     def _handle_price_update(self, price):
         self.current_price = price
@@ -421,28 +654,106 @@ class BaseBot:
         if len(self.prices) > 100:
             self.prices.pop(0)
 
-    def stop(self):
+    def _watch_symbol(self, symbol):
+        # Luồng giá cho TP/SL và luồng nến cho chỉ báo của chiến lược (dùng chung theo symbol)
+        self.ws_manager.add_symbol(symbol, self._handle_price_update)
+        if self._signal_symbol != symbol:
+            if self._signal_symbol:
+                self.strategy.unsubscribe(self._signal_symbol)
+                if self.order_books:
+                    self.order_books.unsubscribe(self._signal_symbol)
+            self.strategy.subscribe(self.ws_manager, symbol)
+            if self.order_books:
+                self.order_books.subscribe(self.ws_manager, symbol)
+            self._signal_symbol = symbol
+
+    def _unwatch_symbol(self, symbol):
+        self.ws_manager.remove_symbol(symbol)
+        if self.user_stream:
+            self.user_stream.unsubscribe(symbol, self._on_order_update)
+        if self._signal_symbol == symbol:
+            self.strategy.unsubscribe(symbol)
+            if self.order_books:
+                self.order_books.unsubscribe(symbol)
+            self._signal_symbol = None
+
+    def _sleep(self, seconds):
+        # Ngủ nhưng thức dậy ngay khi bot bị dừng
+        self.clock.wait(self._stop_event, seconds)
+
+    def _available_balance(self):
+        # Số dư từ sổ rủi ro chung (do BotManager làm mới) thay cho gọi REST mỗi lệnh
+        if self.risk_engine:
+            balance = self.risk_engine.available_balance()
+            if balance is not None:
+                return balance
+        balance = get_balance(self.api_key, self.api_secret)
+        if self.risk_engine:
+            self.risk_engine.set_balance(balance)
+        return balance
+
+    def _reserve_risk(self, side, qty, price):
+        if not self.risk_engine:
+            return True
+        ok, reason = self.risk_engine.reserve(self.bot_id, self.symbol, side, qty, price, self.lev)
+        return ok
+
+    def _release_risk(self):
+        if self.risk_engine:
+            self.risk_engine.release(self.bot_id)
+
+    @contextmanager
+    def _order_in_flight(self):
+        with self._order_lock:
+            self._orders_in_flight += 1
+            self._order_idle.clear()
+        try:
+            yield
+        finally:
+            with self._order_lock:
+                self._orders_in_flight -= 1
+                if not self._orders_in_flight:
+                    self._order_idle.set()
+
+    def _send_order(self, side, qty):
+        with self._order_in_flight():
+            # Kiểm tra sau khi đánh dấu bận: shutdown đặt _stop rồi chờ _order_idle, nên lệnh hoặc bị bỏ ở đây
+            # hoặc đã gửi xong trước khi shutdown huỷ lệnh của symbol
+            if self._stop:
+                return None
+            return place_order(self.symbol, side, qty, self.api_key, self.api_secret)
+
+    def signal_stop(self):
         self._stop = True
+        self._stop_event.set()
+
+    def release(self, cancel_orders=True):
         if self.symbol:
             try:
-                self.ws_manager.remove_symbol(self.symbol)
+                self._unwatch_symbol(self.symbol)
             except Exception:
                 pass
             try:
                 self.coin_manager.unregister_coin(self.symbol)
             except Exception:
                 pass
-            try:
-                cancel_all_orders(self.symbol, self.api_key, self.api_secret)
-            except Exception:
-                pass
+            if cancel_orders:
+                self._exchange_orders = {}
+                try:
+                    cancel_all_orders(self.symbol, self.api_key, self.api_secret)
+                except Exception:
+                    pass
+
+    def stop(self):
+        self.signal_stop()
+        self.release()
 
     def open_position(self, side):
         if side not in ["BUY", "SELL"]:
             return False
 
         if self.symbol:
-            current_volume_signal = self.coin_finder.get_volume_signal(self.symbol)
+            current_volume_signal = self.strategy.signal(self.symbol)
             if current_volume_signal != side:
                 return False
 
@@ -469,7 +780,7 @@ class BaseBot:
                     self._cleanup_symbol()
                     return False
 
-                balance = get_balance(self.api_key, self.api_secret)
+                balance = self._available_balance()
                 if balance is None or balance <= 0:
                     return False
 
@@ -485,20 +796,31 @@ class BaseBot:
                 if step_size > 0:
                     qty = math.floor(qty / step_size) * step_size
                     qty = round(qty, 8)
+                # Sổ lệnh quá mỏng cho khối lượng tối thiểu thì bỏ coin để tìm coin khác
+                qty = self._fit_to_book(side, qty)
 
                 if qty <= 0 or qty < step_size:
                     self._cleanup_symbol()
                     return False
 
+                if not self._reserve_risk(side, qty, current_price):
+                    return False
+
                 cancel_all_orders(self.symbol, self.api_key, self.api_secret)
-                time.sleep(0.2)
+                self.clock.sleep(0.2)
 
-                result = place_order(self.symbol, side, qty, self.api_key, self.api_secret)
+                order_start = self.clock.time()
+                result = self._send_order(side, qty)
+                latency_ms = (self.clock.time() - order_start) * 1000
                 if result and 'orderId' in result:
                     executed_qty = float(result.get('executedQty', 0))
                     avg_price = float(result.get('avgPrice', current_price))
 
                     if executed_qty >= 0:
+                        self.trade_id = f"{self.bot_id}-{int(order_start * 1000)}"
+                        if self.journal:
+                            self.journal.record_entry(self.trade_id, self.bot_id, self.symbol, side,
+                                                      executed_qty, avg_price, latency_ms)
                         self.entry = avg_price
                         self.entry_base = avg_price
                         self.average_down_count = 0
@@ -512,6 +834,7 @@ class BaseBot:
 
                         self.high_water_mark_roi = 0
                         self.roi_check_activated = False
+                        self._place_exchange_orders()
                         return True
                     else:
                         self._cleanup_symbol()
@@ -523,11 +846,13 @@ class BaseBot:
             except Exception:
                 self._cleanup_symbol()
                 return False
+            finally:
+                self._release_risk()
     
     def _cleanup_symbol(self):
         if self.symbol:
             try:
-                self.ws_manager.remove_symbol(self.symbol)
+                self._unwatch_symbol(self.symbol)
                 self.coin_manager.unregister_coin(self.symbol)
             except Exception:
                 pass
@@ -551,7 +876,7 @@ class BaseBot:
             if not self.position_open or abs(self.qty) <= 0:
                 return False
 
-            current_time = time.time()
+            current_time = self.clock.time()
             if self._close_attempted and current_time - self._last_close_attempt < 30:
                 return False
             
@@ -561,22 +886,32 @@ class BaseBot:
             close_side = "SELL" if self.side == "BUY" else "BUY"
             close_qty = abs(self.qty)
             
+            self._exchange_orders = {}
             cancel_all_orders(self.symbol, self.api_key, self.api_secret)
-            time.sleep(0.5)
+            self.clock.sleep(0.5)
             
-            result = place_order(self.symbol, close_side, close_qty, self.api_key, self.api_secret)
+            order_start = self.clock.time()
+            result = self._send_order(close_side, close_qty)
+            latency_ms = (self.clock.time() - order_start) * 1000
             if result and 'orderId' in result:
-                current_price = get_current_price(self.symbol)
+                # PnL tính theo giá khớp thực tế; chỉ dùng giá thị trường khi sàn chưa trả avgPrice
+                exit_price = float(result.get('avgPrice', 0) or 0) or get_current_price(self.symbol)
                 pnl = 0
                 if self.entry > 0:
                     if self.side == "BUY":
-                        pnl = (current_price - self.entry) * abs(self.qty)
+                        pnl = (exit_price - self.entry) * close_qty
                     else:
-                        pnl = (self.entry - current_price) * abs(self.qty)
+                        pnl = (self.entry - exit_price) * close_qty
+
+                if self.journal:
+                    self.journal.record_exit(self.trade_id or f"{self.bot_id}-unknown", self.bot_id,
+                                             self.symbol, close_side, close_qty, exit_price, pnl,
+                                             reason, latency_ms)
+                self.trade_id = None
                 
-                self.last_close_time = time.time()
+                self.last_close_time = self.clock.time()
                 
-                time.sleep(2)
+                self.clock.sleep(2)
                 self.check_position_status()
                 
                 return True
@@ -588,6 +923,170 @@ class BaseBot:
             self._close_attempted = False
             return False
 
+    def _average_down_qty(self, price):
+        balance = self._available_balance()
+        if balance is None or balance <= 0:
+            return 0
+
+        additional_percent = self.percent * (self.average_down_count + 1)
+        usd_amount = balance * (additional_percent / 100)
+        qty = (usd_amount * self.lev) / price
+
+        step_size = get_step_size(self.symbol, self.api_key, self.api_secret)
+        if step_size > 0:
+            qty = math.floor(qty / step_size) * step_size
+            qty = round(qty, 8)
+
+        if qty < step_size:
+            return 0
+        return qty
+
+    def _fit_to_book(self, side, qty):
+        # Giảm khối lượng lệnh MARKET để trượt giá ước tính từ sổ lệnh cục bộ không vượt giới hạn
+        if not self.order_books or not qty:
+            return qty
+        limited = self.order_books.limit_qty(self.symbol, side, qty)
+        if limited is None or limited >= qty:
+            return qty
+        step_size = get_step_size(self.symbol, self.api_key, self.api_secret)
+        if step_size > 0:
+            limited = round(math.floor(limited / step_size) * step_size, 8)
+            if limited < step_size:
+                return 0
+        return limited
+
+    def _roi_price(self, base, roi, tick_size):
+        # Giá mà tại đó ROI (theo đòn bẩy) đạt roi% so với base, làm tròn theo tick size
+        direction = 1 if self.side == "BUY" else -1
+        price = base * (1 + direction * roi / (100 * self.lev))
+        if tick_size > 0:
+            price = round(round(price / tick_size) * tick_size, 8)
+        return price
+
+    def _place_exchange_orders(self):
+        """Đặt TP/SL (closePosition) và bậc nhồi lệnh kế tiếp lên sàn; False nếu phải quay về theo dõi giá"""
+        if not self.user_stream or not self.symbol or not self.position_open or self.entry <= 0:
+            return False
+        if self.clock.time() < self._exchange_retry_at:
+            return False
+
+        with self._bracket_lock, self._order_in_flight():
+            return self._place_bracket()
+
+    def _place_bracket(self):
+        # Gọi khi giữ _bracket_lock và đang đánh dấu có lệnh gửi dở như _send_order
+        if self._stop:
+            return False
+        if self._exchange_orders:
+            return True
+        self.user_stream.subscribe(self.symbol, self._on_order_update)
+        cancel_all_orders(self.symbol, self.api_key, self.api_secret)
+
+        tick_size = get_tick_size(self.symbol, self.api_key, self.api_secret)
+        close_side = "SELL" if self.side == "BUY" else "BUY"
+        self._order_seq += 1
+        tag = f"b{hashlib.sha1(self.bot_id.encode()).hexdigest()[:10]}{self._order_seq}"
+        orders = {}
+        planned = []
+        if self.tp is not None:
+            planned.append(('tp', close_side, "TAKE_PROFIT_MARKET", self._roi_price(self.entry, self.tp, tick_size), None))
+        if self.sl is not None and self.sl > 0:
+            planned.append(('sl', close_side, "STOP_MARKET", self._roi_price(self.entry, -self.sl, tick_size), None))
+
+        if self.entry_base and self.average_down_count < min(self.max_average_down_count, len(self.FIB_LEVELS)):
+            level = self.FIB_LEVELS[self.average_down_count]
+            price = self._roi_price(self.entry_base, -level, tick_size)
+            qty = self._average_down_qty(price) if price > 0 else 0
+            # Bậc nhồi lệnh cũng phải qua kiểm tra rủi ro như lệnh thị trường
+            if qty and self._reserve_risk(self.side, qty, price):
+                self._release_risk()
+                # TAKE_PROFIT_MARKET chiều mua kích hoạt khi giá giảm xuống, chiều bán khi giá tăng lên
+                planned.append(('ladder', self.side, "TAKE_PROFIT_MARKET", price, qty))
+
+        for kind, side, order_type, price, qty in planned:
+            if self._stop:
+                break
+            client_id = f"{tag}{kind}"
+            result = place_trigger_order(self.symbol, side, order_type, price, self.api_key, self.api_secret,
+                                         qty=qty, close_position=qty is None, client_order_id=client_id)
+            if not result or 'orderId' not in result:
+                if kind == 'ladder':
+                    continue
+                cancel_all_orders(self.symbol, self.api_key, self.api_secret)
+                self._exchange_retry_at = self.clock.time() + 60
+                return False
+            orders[client_id] = kind
+
+        self._exchange_orders = orders
+        return bool(orders)
+
+    def _reconcile_exchange_orders(self, position_amt, entry):
+        # Vị thế trên sàn lệch với bot (mất sự kiện khớp lệnh): ghi nhận bậc nhồi đã khớp và đặt lại toàn bộ lệnh chờ
+        with self._bracket_lock:
+            old_qty = abs(self.qty)
+            new_qty = abs(position_amt)
+            if math.isclose(new_qty, old_qty, rel_tol=1e-9) and math.isclose(entry, self.entry, rel_tol=1e-9):
+                return
+            if new_qty > old_qty and 'ladder' in self._exchange_orders.values():
+                filled_qty = new_qty - old_qty
+                avg_price = (entry * new_qty - self.entry * old_qty) / filled_qty
+                self.average_down_count += 1
+                self.last_average_down_time = self.clock.time()
+                if self.journal:
+                    self.journal.record_average_down(self.trade_id or f"{self.bot_id}-unknown", self.bot_id,
+                                                     self.symbol, self.side, filled_qty, avg_price,
+                                                     self.average_down_count, 0)
+            # Vòng lặp kế tiếp thấy không còn lệnh chờ sẽ huỷ và đặt lại theo giá vào mới
+            self._exchange_orders = {}
+
+    def _on_order_update(self, order):
+        # Sự kiện ORDER_TRADE_UPDATE từ user data stream cho lệnh đặt sẵn của bot
+        with self._bracket_lock:
+            client_id = order.get('c')
+            kind = self._exchange_orders.get(client_id)
+            if kind is None:
+                return
+            status = order.get('X')
+            if status in ('CANCELED', 'EXPIRED', 'REJECTED'):
+                self._exchange_orders.pop(client_id, None)
+                if kind != 'ladder':
+                    # Mất TP/SL trên sàn - đặt lại toàn bộ ở vòng lặp kế tiếp
+                    self._exchange_orders = {}
+                    cancel_all_orders(self.symbol, self.api_key, self.api_secret)
+                return
+            if status != 'FILLED':
+                return
+
+            filled_qty = float(order.get('z', 0))
+            avg_price = float(order.get('ap', 0) or 0)
+            self._exchange_orders = {}
+
+            if kind == 'ladder':
+                total_qty = abs(self.qty) + filled_qty
+                if total_qty > 0 and avg_price > 0:
+                    self.entry = (abs(self.qty) * self.entry + filled_qty * avg_price) / total_qty
+                self.qty = total_qty if self.side == "BUY" else -total_qty
+                self.average_down_count += 1
+                self.last_average_down_time = self.clock.time()
+                if self.journal:
+                    self.journal.record_average_down(self.trade_id or f"{self.bot_id}-unknown", self.bot_id,
+                                                     self.symbol, self.side, filled_qty, avg_price,
+                                                     self.average_down_count, 0)
+                # Giá vào đổi - huỷ và đặt lại TP/SL cùng bậc nhồi kế tiếp
+                self._place_exchange_orders()
+                return
+
+            close_side = "SELL" if self.side == "BUY" else "BUY"
+            if self.journal:
+                reason = f"✅ Đạt TP {self.tp}% (lệnh trên sàn)" if kind == 'tp' else f"❌ Đạt SL {self.sl}% (lệnh trên sàn)"
+                self.journal.record_exit(self.trade_id or f"{self.bot_id}-unknown", self.bot_id, self.symbol,
+                                         close_side, filled_qty, avg_price, float(order.get('rp', 0) or 0),
+                                         reason, 0)
+            self.trade_id = None
+            self.last_close_time = self.clock.time()
+            cancel_all_orders(self.symbol, self.api_key, self.api_secret)
+            self._reset_position()
+
     def check_tp_sl(self):
         if not self.symbol or not self.position_open or self.entry <= 0 or self._close_attempted:
             return
@@ -623,7 +1122,7 @@ class BaseBot:
             return
             
         try:
-            current_time = time.time()
+            current_time = self.clock.time()
             if current_time - self.last_average_down_time < self.average_down_cooldown:
                 return
                 
@@ -647,10 +1146,8 @@ class BaseBot:
                 
             roi_negative = abs(current_roi)
             
-            fib_levels = [200, 300, 500, 800, 1300, 2100, 3400]
-            
-            if self.average_down_count < len(fib_levels):
-                current_fib_level = fib_levels[self.average_down_count]
+            if self.average_down_count < len(self.FIB_LEVELS):
+                current_fib_level = self.FIB_LEVELS[self.average_down_count]
                 
                 if roi_negative >= current_fib_level:
                     if self.execute_average_down_order():
@@ -662,33 +1159,30 @@ class BaseBot:
 
     def execute_average_down_order(self):
         try:
-            balance = get_balance(self.api_key, self.api_secret)
-            if balance is None or balance <= 0:
-                return False
-                
             current_price = get_current_price(self.symbol)
             if current_price < 0:
                 return False
-                
-            additional_percent = self.percent * (self.average_down_count + 1)
-            usd_amount = balance * (additional_percent / 100)
-            qty = (usd_amount * self.lev) / current_price
-            
-            step_size = get_step_size(self.symbol, self.api_key, self.api_secret)
-            if step_size > 0:
-                qty = math.floor(qty / step_size) * step_size
-                qty = round(qty, 8)
-            
-            if qty < step_size:
+
+            qty = self._fit_to_book(self.side, self._average_down_qty(current_price))
+            if not qty:
+                return False
+
+            if not self._reserve_risk(self.side, qty, current_price):
                 return False
                 
-            result = place_order(self.symbol, self.side, qty, self.api_key, self.api_secret)
+            order_start = self.clock.time()
+            result = self._send_order(self.side, qty)
+            latency_ms = (self.clock.time() - order_start) * 1000
             
             if result and 'orderId' in result:
                 executed_qty = float(result.get('executedQty', 0))
                 avg_price = float(result.get('avgPrice', current_price))
                 
                 if executed_qty >= 0:
+                    if self.journal:
+                        self.journal.record_average_down(self.trade_id or f"{self.bot_id}-unknown", self.bot_id,
+                                                         self.symbol, self.side, executed_qty, avg_price,
+                                                         self.average_down_count + 1, latency_ms)
                     total_qty = abs(self.qty) + executed_qty
                     self.entry = (abs(self.qty) * self.entry + executed_qty * avg_price) / total_qty
                     self.qty = total_qty if self.side == "BUY" else -total_qty
@@ -699,10 +1193,16 @@ class BaseBot:
             
         except Exception:
             return False
+        finally:
+            self._release_risk()
 
     def get_bot_info(self):
-        return {
+        cached = self._info_cache
+        if cached is not None and cached['version'] == self.version:
+            return cached
+        info = {
             'bot_id': self.bot_id,
+            'version': self.version,
             'symbol': self.symbol,
             'status': self.status,
             'side': self.side,
@@ -724,29 +1224,80 @@ class BaseBot:
             'global_long_pnl': self.global_long_pnl,
             'global_short_pnl': self.global_short_pnl
         }
+        self._info_cache = info
+        return info
 
 class GlobalMarketBot(BaseBot):
+    strategy_class = VolumeSignalStrategy
+
     def __init__(self, symbol, lev, percent, tp, sl, roi_trigger, ws_manager,
                  api_key, api_secret, bot_id=None, **kwargs):
         super().__init__(symbol, lev, percent, tp, sl, roi_trigger, ws_manager,
                          api_key, api_secret, "Global-Market-PnL-Khối-Lượng", 
                          bot_id=bot_id, **kwargs)
 
+BOT_CLASSES = {'GlobalMarketBot': GlobalMarketBot}
+
 class BotManager:
-    def __init__(self, api_key=None, api_secret=None):
-        self.ws_manager = WebSocketManager()
+    def __init__(self, api_key=None, api_secret=None, state_store=None, journal=None, ws_manager=None,
+                 risk_engine=None, exchange_orders=None, order_books=None, clock=None, coin_manager=None):
+        self.clock = clock or get_clock()
+        # ws_manager truyền từ ngoài (luồng giá đã khởi động sẵn, market bus) thì không dừng khi close
+        self._owns_ws_manager = ws_manager is None
+        self.ws_manager = ws_manager or WebSocketManager(clock=self.clock)
+        self.risk_engine = risk_engine or RiskEngine(clock=self.clock)
+        if exchange_orders is None:
+            exchange_orders = os.environ.get('EXCHANGE_ORDERS', '').lower() in ('1', 'true', 'yes')
+        if order_books is None and os.environ.get('ORDER_BOOKS', '').lower() in ('1', 'true', 'yes'):
+            order_books = OrderBookManager(clock=self.clock)
+        self.order_books = order_books or None
+        self.user_stream = None
+        if exchange_orders and api_key:
+            user_stream = UserDataStream(api_key, self.ws_manager)
+            if user_stream.start():
+                self.user_stream = user_stream
+        start_price_feed(self.ws_manager)
         self.bots = {}
         self.running = True
-        self.start_time = time.time()
+        self.start_time = self.clock.time()
 
         self.api_key = api_key
         self.api_secret = api_secret
+        self.state_store = state_store
+        self.journal = journal
 
-        self.coin_manager = CoinManager()
+        self.coin_manager = coin_manager or CoinManager()
         self.symbol_locks = defaultdict(threading.Lock)
 
+        self.system_info_refresh_interval = 15
+        self.system_info_min_refresh_gap = 2
+        self.system_info_max_age = 60
+        self._snapshot_lock = threading.Lock()
+        self._bot_status = {}
+        self._changed_order = OrderedDict()
+        self._removed_bots = deque(maxlen=1000)
+        self.fleet_version = 0
+        self._system_snapshot = {
+            'balance': None,
+            'total_bots': 0,
+            'searching_bots': 0,
+            'waiting_bots': 0,
+            'trading_bots': 0,
+            'total_long_count': 0,
+            'total_short_count': 0,
+            'total_long_pnl': 0,
+            'total_short_pnl': 0,
+            'total_unrealized_pnl': 0,
+            'balance_updated_at': 0,
+            'positions_updated_at': 0
+        }
+        self._account_dirty = threading.Event()
+
         if api_key and api_secret:
             self._verify_api_connection()
+            self._snapshot_thread = threading.Thread(target=self._snapshot_loop, args=(self.clock.register(),),
+                                                     daemon=True)
+            self._snapshot_thread.start()
 
     def _verify_api_connection(self):
         try:
@@ -754,122 +1305,393 @@ class BotManager:
             if balance is None:
                 return False
             else:
+                self._on_balance(balance)
                 return True
         except Exception:
             return False
 
-    def add_bot(self, symbol, lev, percent, tp, sl, roi_trigger, strategy_type, bot_count=1, **kwargs):
+    _STATUS_KEYS = {'searching': 'searching_bots', 'waiting': 'waiting_bots', 'open': 'trading_bots'}
+
+    def _count_status(self, status, delta):
+        key = self._STATUS_KEYS.get(status)
+        if key:
+            self._system_snapshot[key] += delta
+
+    def _bot_kwargs(self, bot_id, **extra):
+        kwargs = {
+            'coin_manager': self.coin_manager,
+            'symbol_locks': self.symbol_locks,
+            'bot_id': bot_id,
+            'state_listener': self._on_bot_state_change,
+            'positions_listener': self._on_positions,
+            'journal': self.journal,
+            'risk_engine': self.risk_engine,
+            'user_stream': self.user_stream,
+            'order_books': self.order_books,
+            'clock': self.clock
+        }
+        kwargs.update(extra)
+        return kwargs
+
+    def _register_bot(self, bot):
+        with self._snapshot_lock:
+            self.bots[bot.bot_id] = bot
+            self._touch(bot)
+            self._bot_status[bot.bot_id] = bot.status
+            self._count_status(bot.status, 1)
+            self._system_snapshot['total_bots'] = len(self.bots)
+        if self.state_store:
+            self.state_store.mark_dirty(bot.bot_id, bot.get_persist_state)
+
+    def _touch(self, bot):
+        # Gọi khi giữ _snapshot_lock. Cấp version mới cùng lúc đưa bot về cuối để _changed_order luôn
+        # tăng dần theo version - version bot tự lấy trong __setattr__ nằm ngoài khoá nên có thể đến sau
+        object.__setattr__(bot, 'version', next(_state_version))
+        self._changed_order[bot.bot_id] = bot
+        self._changed_order.move_to_end(bot.bot_id)
+        self.fleet_version = bot.version
+
+    def _unregister_bot(self, bot_id):
+        with self._snapshot_lock:
+            bot = self.bots.pop(bot_id, None)
+            self._changed_order.pop(bot_id, None)
+            if bot is not None:
+                self.fleet_version = next(_state_version)
+                self._removed_bots.append((self.fleet_version, bot_id))
+            status = self._bot_status.pop(bot_id, None)
+            if status is not None:
+                self._count_status(status, -1)
+            self._system_snapshot['total_bots'] = len(self.bots)
+        if bot is not None and self.state_store:
+            self.state_store.delete_bot(bot_id)
+        return bot
+
+    def _on_bot_state_change(self, bot, name, old, new):
+        if name == 'current_price':
+            self.risk_engine.on_price(bot.symbol, new)
+        elif name in ('qty', 'entry'):
+            self.risk_engine.set_position(bot.symbol, bot.qty, bot.entry, bot.lev, bot.current_price)
+        elif name == 'symbol' and old:
+            self.risk_engine.set_position(old, 0, 0, bot.lev)
+        if name in bot.PERSISTED_FIELDS and self.state_store and bot.bot_id in self.bots:
+            self.state_store.mark_dirty(bot.bot_id, bot.get_persist_state)
+        if name not in bot.TRACKED_FIELDS:
+            return
+        with self._snapshot_lock:
+            if bot.bot_id in self._changed_order:
+                self._touch(bot)
+        if name == 'status':
+            with self._snapshot_lock:
+                counted = self._bot_status.get(bot.bot_id)
+                if counted is None or counted == new:
+                    return
+                self._count_status(counted, -1)
+                self._count_status(new, 1)
+                self._bot_status[bot.bot_id] = new
+        elif name == 'position_open':
+            # Mở/đóng vị thế làm thay đổi số dư và vị thế - làm mới snapshot tài khoản sớm
+            self._account_dirty.set()
+
+    def _on_balance(self, balance):
+        if balance is None:
+            return
+        self.risk_engine.set_balance(balance)
+        with self._snapshot_lock:
+            self._system_snapshot['balance'] = balance
+            self._system_snapshot['balance_updated_at'] = self.clock.time()
+
+    def _on_positions(self, positions):
+        if positions is None:
+            return
+        self.risk_engine.sync_positions(positions)
+        long_count = short_count = 0
+        long_pnl = short_pnl = 0
+        for pos in positions:
+            position_amt = float(pos.get('positionAmt', 0))
+            if position_amt == 0:
+                continue
+            unrealized_pnl = float(pos.get('unRealizedProfit', 0))
+            if position_amt > 0:
+                long_count += 1
+                long_pnl += unrealized_pnl
+            else:
+                short_count += 1
+                short_pnl += unrealized_pnl
+        with self._snapshot_lock:
+            self._system_snapshot.update({
+                'total_long_count': long_count,
+                'total_short_count': short_count,
+                'total_long_pnl': long_pnl,
+                'total_short_pnl': short_pnl,
+                'total_unrealized_pnl': long_pnl + short_pnl,
+                'positions_updated_at': self.clock.time()
+            })
+
+    def refresh_account_snapshot(self):
+        try:
+            self._on_balance(get_balance(self.api_key, self.api_secret))
+            positions_age = self.clock.time() - self._system_snapshot['positions_updated_at']
+            if positions_age >= self.system_info_min_refresh_gap:
+                self._on_positions(get_positions(api_key=self.api_key, api_secret=self.api_secret))
+        except Exception:
+            pass
+
+    def _snapshot_loop(self, ticket=None):
+        with self.clock.participant(ticket):
+            while self.running:
+                self.clock.wait(self._account_dirty, self.system_info_refresh_interval)
+                if not self.running:
+                    break
+                self._account_dirty.clear()
+                self.refresh_account_snapshot()
+                self.clock.sleep(self.system_info_min_refresh_gap)
+
+    def _take_positions_snapshot(self):
+        # None khi REST lỗi: không biết vị thế nào đang mở, mỗi bot phải tự kiểm tra
+        snapshot = get_positions(api_key=self.api_key, api_secret=self.api_secret)
+        if snapshot is None:
+            return None
+        positions = {pos['symbol']: pos for pos in snapshot}
+        self._on_positions(snapshot)
+        return positions
+
+    def _preassign_symbols(self, count, lev, positions):
+        # Giành trước các coin khác nhau cho bot động để chúng không cùng quét và tranh một coin
+        if positions is None:
+            # Không biết coin nào đang có vị thế - để từng bot tự tìm (có loại coin đang giữ)
+            return []
+        held = {s for s, pos in positions.items() if abs(float(pos.get('positionAmt', 0))) > 0}
+        candidates = sorted(symbol for symbol in
+                            eligible_universe.candidates(lev, held | set(self.coin_manager.get_active_coins()))
+                            if self.coin_manager.owns(symbol))
+        self.clock.random.shuffle(candidates)
+        assigned = []
+        for candidate in candidates:
+            if len(assigned) >= count:
+                break
+            if self.coin_manager.try_claim(candidate):
+                assigned.append(candidate)
+        return assigned
+
+    def add_bot(self, symbol, lev, percent, tp, sl, roi_trigger, strategy_type, bot_count=1,
+                progress_callback=None, **kwargs):
         if sl == 0:
             sl = None
             
         if not self.api_key or not self.api_secret:
             return False
         
+        # Xác thực và lấy vị thế một lần cho cả lô bot
         if not self._verify_api_connection():
             return False
+        positions = self._take_positions_snapshot()
         
         bot_mode = kwargs.get('bot_mode', 'static')
-        created_count = 0
+        created_at = int(self.clock.time())
+        specs = []
+        if bot_mode == 'static' and symbol:
+            for i in range(bot_count):
+                specs.append((f"{symbol}_{strategy_type}_{i}_{created_at}", symbol))
+        else:
+            assigned = self._preassign_symbols(bot_count, lev, positions)
+            for i in range(bot_count):
+                specs.append((f"DYNAMIC_{strategy_type}_{i}_{created_at}", assigned[i] if i < len(assigned) else None))
+        specs = [(bot_id, bot_symbol) for bot_id, bot_symbol in specs if bot_id not in self.bots]
         
-        for i in range(bot_count):
+        progress = {'total': len(specs), 'created': 0, 'failed': 0}
+        progress_lock = threading.Lock()
+
+        def create(spec):
+            bot_id, bot_symbol = spec
             try:
-                if bot_mode == 'static' and symbol:
-                    bot_id = f"{symbol}_{strategy_type}_{i}_{int(time.time())}"
-                    
-                    if bot_id in self.bots:
-                        continue
-                    
-                    bot_class = GlobalMarketBot
-                    
-                    bot = bot_class(
-                        symbol, lev, percent, tp, sl, roi_trigger, self.ws_manager,
-                        self.api_key, self.api_secret,
-                        coin_manager=self.coin_manager,
-                        symbol_locks=self.symbol_locks,
-                        bot_id=bot_id
-                    )
-                    
-                else:
-                    bot_id = f"DYNAMIC_{strategy_type}_{i}_{int(time.time())}"
-                    
-                    if bot_id in self.bots:
-                        continue
-                    
-                    bot_class = GlobalMarketBot
-                    
-                    bot = bot_class(
-                        None, lev, percent, tp, sl, roi_trigger, self.ws_manager,
-                        self.api_key, self.api_secret,
-                        coin_manager=self.coin_manager,
-                        symbol_locks=self.symbol_locks,
-                        bot_id=bot_id
-                    )
-                
-                self.bots[bot_id] = bot
-                created_count += 1
-                
+                bot = GlobalMarketBot(
+                    bot_symbol, lev, percent, tp, sl, roi_trigger, self.ws_manager,
+                    self.api_key, self.api_secret,
+                    **self._bot_kwargs(bot_id, positions=positions)
+                )
+                self._register_bot(bot)
+                key = 'created'
             except Exception:
-                continue
+                if bot_mode != 'static' and bot_symbol:
+                    self.coin_manager.unregister_coin(bot_symbol)
+                key = 'failed'
+            with progress_lock:
+                progress[key] += 1
+                if progress_callback:
+                    progress_callback(dict(progress))
+
+        if len(specs) > 1:
+            with ThreadPoolExecutor(max_workers=min(16, len(specs))) as executor:
+                list(executor.map(create, specs))
+        else:
+            for spec in specs:
+                create(spec)
         
-        return created_count > 0
+        return progress['created'] > 0
+
+    def restore_bots(self):
+        if not self.state_store or not self.api_key or not self.api_secret:
+            return 0
+        account = account_fingerprint(self.api_key)
+        records = [r for r in self.state_store.load_bots() if r.get('account') == account]
+        if not records:
+            return 0
+
+        # Một snapshot vị thế duy nhất cho toàn bộ bot được khôi phục; lỗi REST thì từng bot tự kiểm tra
+        # thay vì coi là không có vị thế và xoá mất trạng thái nhồi lệnh đã lưu
+        positions = self._take_positions_snapshot()
+
+        restored = 0
+        for record in records:
+            bot_id = record.get('bot_id')
+            if not bot_id or bot_id in self.bots:
+                continue
+            try:
+                bot_class = BOT_CLASSES.get(record.get('bot_class'), GlobalMarketBot)
+                bot = bot_class(
+                    record.get('symbol'), record['lev'], record['percent'], record['tp'], record['sl'],
+                    record.get('roi_trigger'), self.ws_manager,
+                    self.api_key, self.api_secret,
+                    **self._bot_kwargs(bot_id, restored_state=record, positions=positions)
+                )
+                self._register_bot(bot)
+                restored += 1
+            except Exception:
+                continue
+        return restored
 
     def stop_bot(self, bot_id):
-        bot = self.bots.get(bot_id)
+        bot = self._unregister_bot(bot_id)
         if bot:
             bot.stop()
-            del self.bots[bot_id]
             return True
         return False
 
-    def stop_all(self):
-        for bot_id in list(self.bots.keys()):
-            self.stop_bot(bot_id)
+    def stop_all(self, deadline=30):
+        return self.shutdown(deadline=deadline, forget=True)
+
+    def shutdown(self, deadline=30, cancel_orders=True, batch_size=10, forget=False):
+        """Dừng mọi bot song song trong giới hạn deadline giây và báo lại những gì chưa xong.
+        forget=False giữ trạng thái đã lưu để khôi phục sau khi redeploy."""
+        start = time.time()
+        end = start + deadline
+        bots = list(self.bots.values())
+
+        for bot in bots:
+            bot.signal_stop()
+
+        # Chờ các lệnh đang gửi dở hoàn tất trước khi huỷ lệnh
+        orders_pending = [bot.bot_id for bot in bots
+                          if not bot._order_idle.wait(max(0, end - time.time()))]
+
+        cancel_failed = []
+        if cancel_orders:
+            symbols = {bot.symbol for bot in bots if bot.symbol}
+
+            def cancel(symbol):
+                if time.time() >= end or not cancel_all_orders(symbol, self.api_key, self.api_secret):
+                    cancel_failed.append(symbol)
+
+            if symbols:
+                executor = ThreadPoolExecutor(max_workers=batch_size)
+                futures = [executor.submit(cancel, symbol) for symbol in symbols]
+                for future in futures:
+                    try:
+                        future.result(timeout=max(0, end - time.time()))
+                    except Exception:
+                        pass
+                executor.shutdown(wait=False, cancel_futures=True)
+                cancel_failed.extend(s for s, f in zip(symbols, futures) if not f.done())
+
+        for bot in bots:
+            bot.release(cancel_orders=False)
+            if forget:
+                self._unregister_bot(bot.bot_id)
+
+        threads_alive = []
+        for bot in bots:
+            bot.thread.join(max(0, end - time.time()))
+            if bot.thread.is_alive():
+                threads_alive.append(bot.bot_id)
+
+        return {
+            'stopped': len(bots) - len(threads_alive),
+            'total': len(bots),
+            'orders_pending': orders_pending,
+            'cancel_failed': sorted(set(cancel_failed)),
+            'threads_alive': threads_alive,
+            'elapsed': time.time() - start
+        }
+
+    def close(self, deadline=0):
+        # Dừng các thread nhưng giữ nguyên trạng thái đã lưu để khôi phục lần sau.
+        # Không huỷ lệnh: TP/SL và bậc nhồi lệnh trên sàn phải tiếp tục bảo vệ vị thế trong lúc redeploy
+        # (chỉ stop_bot/stop_all mới huỷ lệnh)
+        report = self.shutdown(deadline=deadline, cancel_orders=False, forget=False)
+        self.running = False
+        self._account_dirty.set()
+        if self.user_stream:
+            self.user_stream.stop()
+        if self._owns_ws_manager:
+            self.ws_manager.stop()
+        return report
 
     def get_bots_info(self):
         bots_info = []
-        for bot_id, bot in self.bots.items():
+        for bot_id, bot in list(self.bots.items()):
             bots_info.append(bot.get_bot_info())
         return bots_info
 
+    def query_bots(self, since=None, status=None, symbol=None, offset=0, limit=None):
+        with self._snapshot_lock:
+            fleet_version = self.fleet_version
+            # Nhật ký xoá đã đầy và since cũ hơn bản ghi cũ nhất còn giữ: có thể đã mất bot bị xoá,
+            # trả toàn bộ danh sách kèm resync để client thay hẳn trạng thái
+            resync = since is not None and _removed_window_lost(self._removed_bots, since)
+            if since is None or resync:
+                candidates = list(self.bots.values())
+                removed = []
+            else:
+                # _changed_order xếp theo lần thay đổi gần nhất - chỉ duyệt phần đuôi mới hơn since
+                candidates = []
+                for bot in reversed(self._changed_order.values()):
+                    if bot.version <= since:
+                        break
+                    candidates.append(bot)
+                candidates.reverse()
+                removed = [bot_id for version, bot_id in self._removed_bots if version > since]
+
+        symbol = symbol.upper() if symbol else None
+        bots_info = []
+        for bot in candidates:
+            info = bot.get_bot_info()
+            if (status and info['status'] != status) or (symbol and info['symbol'] != symbol):
+                # Bot đổi trạng thái/coin ra khỏi bộ lọc - với client đang lọc thì coi như đã bị xoá
+                if since is not None and not resync:
+                    removed.append(info['bot_id'])
+                continue
+            bots_info.append(info)
+
+        total = len(bots_info)
+        end = offset + limit if limit else None
+        return {
+            'version': fleet_version,
+            'total': total,
+            'offset': offset,
+            'limit': limit,
+            'bots': bots_info[offset:end],
+            'removed': removed,
+            'resync': resync
+        }
+
     def get_system_info(self):
-        try:
-            balance = get_balance(self.api_key, self.api_secret)
-            positions = get_positions(api_key=self.api_key, api_secret=self.api_secret)
-            
-            total_long_count = 0
-            total_short_count = 0
-            total_long_pnl = 0
-            total_short_pnl = 0
-            total_unrealized_pnl = 0
-            
-            for pos in positions:
-                position_amt = float(pos.get('positionAmt', 0))
-                if position_amt != 0:
-                    unrealized_pnl = float(pos.get('unRealizedProfit', 0))
-                    total_unrealized_pnl += unrealized_pnl
-                    
-                    if position_amt > 0:
-                        total_long_count += 1
-                        total_long_pnl += unrealized_pnl
-                    else:
-                        total_short_count += 1
-                        total_short_pnl += unrealized_pnl
-            
-            searching_bots = sum(1 for bot in self.bots.values() if bot.status == "searching")
-            waiting_bots = sum(1 for bot in self.bots.values() if bot.status == "waiting")
-            trading_bots = sum(1 for bot in self.bots.values() if bot.status == "open")
-            
-            return {
-                'balance': balance,
-                'total_bots': len(self.bots),
-                'searching_bots': searching_bots,
-                'waiting_bots': waiting_bots,
-                'trading_bots': trading_bots,
-                'total_long_count': total_long_count,
-                'total_short_count': total_short_count,
-                'total_long_pnl': total_long_pnl,
-                'total_short_pnl': total_short_pnl,
-                'total_unrealized_pnl': total_unrealized_pnl
-            }
-        except Exception:
-            return {}
+        with self._snapshot_lock:
+            info = dict(self._system_snapshot)
+        updated_at = min(info.pop('balance_updated_at'), info.pop('positions_updated_at'))
+        age = self.clock.time() - updated_at if updated_at else None
+        info['updated_at'] = updated_at
+        info['age'] = age
+        info['stale'] = age is None or age > self.system_info_max_age
+        if info['stale']:
+            self._account_dirty.set()
+        return info
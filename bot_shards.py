@@ -0,0 +1,434 @@
+import time
+import itertools
+import threading
+import logging
+import multiprocessing
+from collections import OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+# Các phương thức của BotManager được phép gọi qua kênh điều khiển
+WORKER_METHODS = frozenset([
+    'add_bot', 'stop_bot', 'stop_all', 'get_bots_info', 'query_bots', 'get_system_info', 'restore_bots'
+])
+
+def _worker_main(shard_id, api_key, api_secret, conn, state_db_path, journal_path, market_bus_name=None,
+                 risk_ledger=None):
+    import engine_logging
+    from bot_core import BotManager, CoinManager
+    from risk_engine import RiskEngine
+    from state_store import StateStore
+    from trade_journal import TradeJournal
+
+    # RotatingFileHandler không an toàn giữa nhiều tiến trình - mỗi shard ghi file riêng
+    engine_logging.setup_logging(f'bot_errors.log.shard{shard_id}')
+    store = StateStore(state_db_path) if state_db_path else None
+    journal = TradeJournal(journal_path) if journal_path else None
+    ws_manager = None
+    if market_bus_name:
+        from market_bus import MarketDataReader, BusWebSocketManager, attach_price_cache
+        reader = MarketDataReader(market_bus_name, reader_id=shard_id)
+        attach_price_cache(reader)
+        ws_manager = BusWebSocketManager(reader)
+    # Coin được chia cố định theo shard, giới hạn rủi ro tính trên cả tài khoản qua sổ dùng chung
+    shards = risk_ledger.shards if risk_ledger is not None else 1
+    risk_engine = RiskEngine(ledger=risk_ledger, shard_id=shard_id)
+    if risk_ledger is not None:
+        # Shard khởi động lại: bỏ phần giữ chỗ còn sót của tiến trình cũ
+        with risk_ledger.lock:
+            risk_engine._publish()
+    manager = BotManager(api_key, api_secret, state_store=store, journal=journal, ws_manager=ws_manager,
+                         risk_engine=risk_engine, coin_manager=CoinManager(shard_id, shards))
+    manager.restore_bots()
+
+    while True:
+        try:
+            method, args, kwargs = conn.recv()
+        except (EOFError, OSError):
+            break
+        if method == 'ping':
+            conn.send(('ok', shard_id))
+            continue
+        if method == 'shutdown':
+            report = manager.close(*args, **kwargs)
+            if ws_manager is not None:
+                ws_manager.stop()
+            if store:
+                store.close()
+            if journal:
+                journal.close()
+            conn.send(('ok', report))
+            break
+        if method not in WORKER_METHODS:
+            conn.send(('error', f"Phương thức không hợp lệ: {method}"))
+            continue
+        try:
+            conn.send(('ok', getattr(manager, method)(*args, **kwargs)))
+        except Exception as e:
+            conn.send(('error', str(e)))
+
+class ShardWorker:
+    def __init__(self, shard_id, ctx, api_key, api_secret, state_db_path, journal_path, market_bus_name=None,
+                 risk_ledger=None):
+        self.shard_id = shard_id
+        self.market_bus_name = market_bus_name
+        self.risk_ledger = risk_ledger
+        self.ctx = ctx
+        self.api_key = api_key
+        self.api_secret = api_secret
+        self.state_db_path = state_db_path
+        self.journal_path = journal_path
+        self.process = None
+        self.conn = None
+        self.lock = threading.Lock()
+        self.restarts = 0
+        self.started_at = 0
+        self.last_ok = 0
+        self.call_started = None
+        self.stale_replies = 0
+        self.bot_count = 0
+        self.version = 0
+
+    def start(self):
+        parent_conn, child_conn = self.ctx.Pipe()
+        self.process = self.ctx.Process(
+            target=_worker_main,
+            args=(self.shard_id, self.api_key, self.api_secret, child_conn,
+                  self.state_db_path, self.journal_path, self.market_bus_name, self.risk_ledger),
+            name=f"bot-shard-{self.shard_id}",
+            daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.conn = parent_conn
+        self.started_at = time.time()
+        self.last_ok = self.started_at
+        self.stale_replies = 0
+        self.version = 0
+
+    def call(self, method, *args, timeout=None, **kwargs):
+        acquired = self.lock.acquire(timeout=timeout) if timeout is not None else self.lock.acquire()
+        if not acquired:
+            raise TimeoutError(f"Shard {self.shard_id} đang bận")
+        try:
+            # Bỏ các phản hồi trễ của lần gọi đã hết thời gian chờ trước đó
+            while self.stale_replies:
+                if timeout is not None and not self.conn.poll(timeout):
+                    raise TimeoutError(f"Shard {self.shard_id} vẫn đang xử lý lệnh trước")
+                self.conn.recv()
+                self.stale_replies -= 1
+            self.call_started = time.time()
+            self.conn.send((method, args, kwargs))
+            if timeout is not None and not self.conn.poll(timeout):
+                self.stale_replies += 1
+                raise TimeoutError(f"Shard {self.shard_id} không phản hồi {method}")
+            status, result = self.conn.recv()
+            self.last_ok = time.time()
+            if status != 'ok':
+                raise RuntimeError(result)
+            return result
+        finally:
+            if not self.stale_replies:
+                self.call_started = None
+            self.lock.release()
+
+    def is_hung(self, max_call_time):
+        started = self.call_started
+        return started is not None and time.time() - started > max_call_time
+
+    def stop(self, timeout=10, deadline=0):
+        report = None
+        try:
+            report = self.call('shutdown', deadline=deadline, timeout=timeout + deadline)
+        except Exception:
+            pass
+        if self.process is not None:
+            self.process.join(timeout)
+            if self.process.is_alive():
+                self.process.terminate()
+        return report
+
+    def stats(self):
+        return {
+            'shard_id': self.shard_id,
+            'alive': bool(self.process and self.process.is_alive()),
+            'pid': self.process.pid if self.process else None,
+            'bots': self.bot_count,
+            'restarts': self.restarts,
+            'uptime': time.time() - self.started_at if self.started_at else 0,
+            'last_ok_age': time.time() - self.last_ok if self.last_ok else None
+        }
+
+class ShardedBotManager:
+    """Phân bot ra nhiều tiến trình BotManager, giữ nguyên giao diện của BotManager cho API"""
+
+    def __init__(self, api_key, api_secret, shards=2, state_db_path=None, journal_path=None,
+                 poll_interval=1.0, max_call_time=120, market_bus=False):
+        from bot_core import account_fingerprint
+        from binance_client import get_balance
+
+        self.api_key = api_key
+        self.api_secret = api_secret
+        self.poll_interval = poll_interval
+        self.max_call_time = max_call_time
+        self.running = True
+        self.start_time = time.time()
+
+        ctx = multiprocessing.get_context('spawn')
+        account = account_fingerprint(api_key)
+        self.publisher = None
+        if market_bus:
+            from market_bus import MAX_READERS
+            if shards > MAX_READERS:
+                logger.warning("Market bus chỉ hỗ trợ %s shard, các shard sẽ tự mở kết nối WebSocket", MAX_READERS)
+                market_bus = False
+        from risk_engine import SharedRiskLedger
+        self.risk_ledger = SharedRiskLedger(shards, ctx)
+        self.workers = []
+        for shard_id in range(shards):
+            shard_db = f"{state_db_path}.{account}.shard{shard_id}" if state_db_path else None
+            self.workers.append(ShardWorker(shard_id, ctx, api_key, api_secret, shard_db, journal_path,
+                                            f"market_bus_{account}" if market_bus else None, self.risk_ledger))
+
+        self._lock = threading.Lock()
+        self._version_counter = itertools.count(1)
+        self._bots = OrderedDict()
+        self._bot_shard = {}
+        self._removed_bots = deque(maxlen=1000)
+        self.fleet_version = 0
+        self._system_info = {}
+        self._balance = get_balance(api_key, api_secret)
+
+        if self._balance is None:
+            self.running = False
+            return
+        if market_bus:
+            # Một luồng dữ liệu thị trường cho cả máy, các shard chỉ đọc từ shared memory
+            from market_bus import MarketDataPublisher
+            self.publisher = MarketDataPublisher(f"market_bus_{account}")
+        for worker in self.workers:
+            worker.start()
+        self._supervisor = threading.Thread(target=self._supervise, daemon=True)
+        self._supervisor.start()
+
+    def _shard_for_symbol(self, symbol):
+        from bot_core import shard_for_symbol
+        return self.workers[shard_for_symbol(symbol, len(self.workers))]
+
+    def _least_loaded(self):
+        return min(self.workers, key=lambda w: w.bot_count)
+
+    def add_bot(self, symbol, lev, percent, tp, sl, roi_trigger, strategy_type, bot_count=1,
+                progress_callback=None, **kwargs):
+        bot_mode = kwargs.get('bot_mode', 'static')
+        if bot_mode == 'static' and symbol:
+            # Bot cùng symbol luôn nằm chung shard để dùng chung luồng giá và khoá symbol
+            placements = [(self._shard_for_symbol(symbol), bot_count)]
+        else:
+            counts = {}
+            for _ in range(bot_count):
+                worker = self._least_loaded()
+                counts[worker] = counts.get(worker, 0) + 1
+                worker.bot_count += 1
+            placements = list(counts.items())
+
+        created = False
+        done_shards = 0
+        for worker, count in placements:
+            try:
+                created = worker.call('add_bot', symbol, lev, percent, tp, sl, roi_trigger, strategy_type,
+                                      bot_count=count, **kwargs) or created
+            except Exception as e:
+                logger.error(f"Lỗi thêm bot trên shard {worker.shard_id}: {str(e)}")
+            done_shards += 1
+            if progress_callback:
+                progress_callback({'shards_total': len(placements), 'shards_done': done_shards})
+        return created
+
+    def stop_bot(self, bot_id):
+        shard_id = self._bot_shard.get(bot_id)
+        workers = [self.workers[shard_id]] if shard_id is not None else self.workers
+        for worker in workers:
+            try:
+                if worker.call('stop_bot', bot_id):
+                    return True
+            except Exception:
+                continue
+        return False
+
+    def _on_all_workers(self, fn):
+        results = [None] * len(self.workers)
+
+        def run(index, worker):
+            try:
+                results[index] = fn(worker)
+            except Exception as e:
+                logger.error(f"Lỗi trên shard {worker.shard_id}: {str(e)}")
+
+        threads = [threading.Thread(target=run, args=(i, w), daemon=True) for i, w in enumerate(self.workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    @staticmethod
+    def _merge_reports(reports):
+        merged = {'stopped': 0, 'total': 0, 'orders_pending': [], 'cancel_failed': [],
+                  'threads_alive': [], 'elapsed': 0}
+        for report in reports:
+            if not report:
+                continue
+            for key in ('stopped', 'total'):
+                merged[key] += report[key]
+            for key in ('orders_pending', 'cancel_failed', 'threads_alive'):
+                merged[key].extend(report[key])
+            merged['elapsed'] = max(merged['elapsed'], report['elapsed'])
+        return merged
+
+    def stop_all(self, deadline=30):
+        return self._merge_reports(self._on_all_workers(lambda w: w.call('stop_all', deadline=deadline)))
+
+    def shutdown(self, deadline=30):
+        self.running = False
+        reports = self._on_all_workers(lambda w: w.stop(deadline=deadline))
+        if self.publisher is not None:
+            self.publisher.close()
+            self.publisher = None
+        return self._merge_reports(reports)
+
+    def restore_bots(self):
+        # Mỗi worker tự khôi phục bot từ kho trạng thái riêng khi khởi động
+        return 0
+
+    def _poll_worker(self, worker):
+        result = worker.call('query_bots', since=worker.version or None, timeout=self.poll_interval)
+        system_info = worker.call('get_system_info', timeout=self.poll_interval)
+        with self._lock:
+            if result.get('resync'):
+                # Shard đã mất nhật ký xoá kể từ lần đọc trước - bỏ các bot không còn trong danh sách đầy đủ
+                current = {info['bot_id'] for info in result['bots']}
+                for bot_id in [b for b, s in self._bot_shard.items() if s == worker.shard_id and b not in current]:
+                    self._drop_bot(bot_id)
+            for info in result['bots']:
+                bot_id = info['bot_id']
+                self._bot_shard[bot_id] = worker.shard_id
+                self._bots[bot_id] = dict(info, version=next(self._version_counter), shard=worker.shard_id)
+                self._bots.move_to_end(bot_id)
+                self.fleet_version = self._bots[bot_id]['version']
+            for bot_id in result['removed']:
+                self._drop_bot(bot_id)
+            worker.version = result['version']
+            worker.bot_count = system_info.get('total_bots', worker.bot_count)
+            self._system_info[worker.shard_id] = system_info
+
+    def _drop_bot(self, bot_id):
+        # Gọi khi đang giữ self._lock
+        if self._bots.pop(bot_id, None) is not None:
+            self._bot_shard.pop(bot_id, None)
+            self.fleet_version = next(self._version_counter)
+            self._removed_bots.append((self.fleet_version, bot_id))
+
+    def _forget_shard(self, worker):
+        with self._lock:
+            for bot_id in [b for b, s in self._bot_shard.items() if s == worker.shard_id]:
+                self._drop_bot(bot_id)
+            self._system_info.pop(worker.shard_id, None)
+
+    def _restart(self, worker):
+        logger.error(f"Khởi động lại shard {worker.shard_id}")
+        if worker.process is not None and worker.process.is_alive():
+            worker.process.terminate()
+            worker.process.join(5)
+        self._forget_shard(worker)
+        worker.restarts += 1
+        worker.lock = threading.Lock()
+        worker.start()
+
+    def _supervise(self):
+        while self.running:
+            for worker in self.workers:
+                if not self.running:
+                    break
+                if not worker.process.is_alive() or worker.is_hung(self.max_call_time):
+                    self._restart(worker)
+                    continue
+                try:
+                    self._poll_worker(worker)
+                except TimeoutError:
+                    pass
+                except Exception as e:
+                    logger.error(f"Lỗi đọc trạng thái shard {worker.shard_id}: {str(e)}")
+            time.sleep(self.poll_interval)
+
+    def get_bots_info(self):
+        with self._lock:
+            return list(self._bots.values())
+
+    def query_bots(self, since=None, status=None, symbol=None, offset=0, limit=None):
+        from bot_core import _removed_window_lost
+
+        with self._lock:
+            fleet_version = self.fleet_version
+            resync = since is not None and _removed_window_lost(self._removed_bots, since)
+            if since is None or resync:
+                candidates = list(self._bots.values())
+                removed = []
+            else:
+                candidates = []
+                for info in reversed(self._bots.values()):
+                    if info['version'] <= since:
+                        break
+                    candidates.append(info)
+                candidates.reverse()
+                removed = [bot_id for version, bot_id in self._removed_bots if version > since]
+
+        symbol = symbol.upper() if symbol else None
+        bots_info = []
+        for info in candidates:
+            if (status and info['status'] != status) or (symbol and info['symbol'] != symbol):
+                # Bot ra khỏi bộ lọc - báo là đã xoá cho client đang lọc
+                if since is not None and not resync:
+                    removed.append(info['bot_id'])
+                continue
+            bots_info.append(info)
+        end = offset + limit if limit else None
+        return {
+            'version': fleet_version,
+            'total': len(bots_info),
+            'offset': offset,
+            'limit': limit,
+            'bots': bots_info[offset:end],
+            'removed': removed,
+            'resync': resync
+        }
+
+    def get_system_info(self):
+        with self._lock:
+            shard_infos = list(self._system_info.values())
+        info = {
+            'balance': self._balance,
+            'total_bots': 0,
+            'searching_bots': 0,
+            'waiting_bots': 0,
+            'trading_bots': 0,
+            'updated_at': None,
+            'age': None,
+            'stale': True
+        }
+        for shard_info in shard_infos:
+            for key in ('total_bots', 'searching_bots', 'waiting_bots', 'trading_bots'):
+                info[key] += shard_info.get(key, 0)
+        # Số dư và vị thế là của cả tài khoản - lấy từ shard có snapshot mới nhất
+        freshest = [s for s in shard_infos if s.get('updated_at')]
+        if freshest:
+            latest = max(freshest, key=lambda s: s['updated_at'])
+            for key in ('balance', 'total_long_count', 'total_short_count', 'total_long_pnl',
+                        'total_short_pnl', 'total_unrealized_pnl', 'updated_at', 'age', 'stale'):
+                if key in latest:
+                    info[key] = latest[key]
+        info['shards'] = [worker.stats() for worker in self.workers]
+        return info
+
+    def close(self, deadline=0):
+        return self.shutdown(deadline=deadline)
@@ -0,0 +1,161 @@
+import time
+import random
+import itertools
+import threading
+from contextlib import contextmanager, nullcontext
+
+class SystemClock:
+    """Đồng hồ thật của hệ thống"""
+
+    def __init__(self):
+        # Nguồn ngẫu nhiên đi kèm đồng hồ (jitter, chọn coin, id bot) - VirtualClock thay bằng bản có seed
+        self.random = random.Random()
+
+    def time(self):
+        return time.time()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def wait(self, event, timeout=None):
+        return event.wait(timeout)
+
+    def register(self):
+        return None
+
+    def participant(self, ticket=None):
+        return nullcontext()
+
+class VirtualClock:
+    """Đồng hồ ảo cho mô phỏng: sleep/wait không chờ thật mà tua thời gian.
+
+    Luồng tham gia (vòng lặp bot, luồng nền) chạy lần lượt từng luồng một: luồng đang giữ lượt nhường lượt
+    khi sleep/wait, lượt được trao cho luồng có thời điểm thức sớm nhất (cùng thời điểm thì theo thứ tự
+    xếp hàng) và đồng hồ nhảy tới thời điểm đó, không vượt quá mốc run_until(). Vé tham gia được lấy bằng
+    register() ở luồng tạo thread nên thứ tự khởi động cũng cố định. Luồng không tham gia (luồng điều khiển,
+    test gọi trực tiếp) thì sleep tua thẳng đồng hồ.
+
+    Luồng tham gia không được ngủ khi đang giữ khoá mà luồng tham gia khác cần - luồng kia sẽ giữ lượt
+    và chờ khoá mãi."""
+
+    # Mốc mặc định cố định để các lần chạy lặp lại giống hệt nhau
+    DEFAULT_START = 1700000000.0
+
+    def __init__(self, start=None, seed=0):
+        self._now = float(start if start is not None else self.DEFAULT_START)
+        self.horizon = self._now
+        self.random = random.Random(seed)
+        self._cond = threading.Condition()
+        self._local = threading.local()
+        self._order = itertools.count()
+        # (thời điểm thức, thứ tự xếp hàng, vé, event) của các luồng đang chờ lượt
+        self._queue = []
+        self._running = None
+
+    def time(self):
+        return self._now
+
+    def sleep(self, seconds):
+        self.wait(None, seconds)
+
+    def wait(self, event, timeout=None):
+        if event is not None and event.is_set():
+            return True
+        ticket = getattr(self._local, 'ticket', None)
+        if ticket is None:
+            if timeout:
+                self.advance(timeout)
+            return event.is_set() if event is not None else False
+        with self._cond:
+            deadline = self._now + (timeout if timeout is not None else float('inf'))
+            self._queue.append((deadline, next(self._order), ticket, event))
+            if self._running is ticket:
+                self._running = None
+            self._await_turn(ticket, event is not None)
+        return event.is_set() if event is not None else False
+
+    def _await_turn(self, ticket, poll):
+        # Gọi khi giữ _cond
+        self._schedule()
+        self._cond.notify_all()
+        while self._running is not ticket:
+            # Event được set từ luồng không tham gia không báo qua condition nên phải kiểm tra lại định kỳ
+            self._cond.wait(0.05 if poll else None)
+            self._schedule()
+
+    def _schedule(self):
+        # Gọi khi giữ _cond: trao lượt cho luồng chờ thức sớm nhất; event đã set coi như thức ngay
+        if self._running is not None or not self._queue:
+            return
+        now = self._now
+
+        def due(entry):
+            deadline, order, _, event = entry
+            if event is not None and event.is_set():
+                deadline = min(deadline, now)
+            return deadline, order
+
+        entry = min(self._queue, key=due)
+        deadline = due(entry)[0]
+        if deadline > self.horizon:
+            return
+        self._queue.remove(entry)
+        self._now = max(now, deadline)
+        self._running = entry[2]
+        self._cond.notify_all()
+
+    def advance(self, seconds):
+        with self._cond:
+            self._now += seconds
+            self.horizon = max(self.horizon, self._now)
+            self._schedule()
+
+    def run_until(self, target):
+        """Cho các luồng tham gia chạy tới thời điểm target rồi dừng đồng hồ ở đó"""
+        with self._cond:
+            self.horizon = max(self.horizon, target)
+            while True:
+                self._schedule()
+                if self._running is None:
+                    break
+                self._cond.wait(0.05)
+            self._now = max(self._now, target)
+
+    def run_for(self, seconds):
+        self.run_until(self._now + seconds)
+
+    def register(self):
+        """Lấy vé tham gia ở luồng tạo thread, trước khi thread chạy"""
+        ticket = object()
+        with self._cond:
+            self._queue.append((self._now, next(self._order), ticket, None))
+        return ticket
+
+    @contextmanager
+    def participant(self, ticket=None):
+        if ticket is None:
+            ticket = self.register()
+        self._local.ticket = ticket
+        with self._cond:
+            self._await_turn(ticket, False)
+        try:
+            yield self
+        finally:
+            self._local.ticket = None
+            with self._cond:
+                if self._running is ticket:
+                    self._running = None
+                self._queue = [entry for entry in self._queue if entry[2] is not ticket]
+                self._schedule()
+                self._cond.notify_all()
+
+_clock = SystemClock()
+
+def get_clock():
+    return _clock
+
+def set_clock(clock):
+    """Đổi đồng hồ mặc định của tiến trình (dùng bởi binance_client và các đối tượng không được truyền clock)"""
+    global _clock
+    _clock = clock or SystemClock()
+    return _clock
@@ -0,0 +1,73 @@
+import time
+import uuid
+import threading
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+class EngineExecutor:
+    """Chạy các thao tác engine (gọi REST Binance, tạo/dừng bot) ngoài event loop của API"""
+
+    def __init__(self, max_workers=4, max_jobs=500):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="engine")
+        self.max_jobs = max_jobs
+        self.jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, kind, fn, *args, **kwargs):
+        return self._submit(uuid.uuid4().hex[:12], kind, fn, args, kwargs)
+
+    def submit_with_progress(self, kind, fn, *args, **kwargs):
+        # fn nhận thêm progress_callback để báo tiến độ vào job
+        job_id = uuid.uuid4().hex[:12]
+        kwargs['progress_callback'] = lambda progress: self.set_progress(job_id, progress)
+        return self._submit(job_id, kind, fn, args, kwargs)
+
+    def _submit(self, job_id, kind, fn, args, kwargs):
+        job = {
+            'job_id': job_id,
+            'kind': kind,
+            'status': 'pending',
+            'progress': None,
+            'result': None,
+            'error': None,
+            'created_at': time.time(),
+            'started_at': None,
+            'finished_at': None
+        }
+        with self._lock:
+            self.jobs[job_id] = job
+            while len(self.jobs) > self.max_jobs:
+                self.jobs.popitem(last=False)
+        self.executor.submit(self._run_job, job, fn, args, kwargs)
+        return job_id
+
+    def _run_job(self, job, fn, args, kwargs):
+        job['status'] = 'running'
+        job['started_at'] = time.time()
+        try:
+            job['result'] = fn(*args, **kwargs)
+            job['status'] = 'done'
+        except Exception as e:
+            logger.error(f"Lỗi job {job['kind']} {job['job_id']}: {str(e)}")
+            job['error'] = str(e)
+            job['status'] = 'failed'
+        finally:
+            job['finished_at'] = time.time()
+
+    def set_progress(self, job_id, progress):
+        job = self.jobs.get(job_id)
+        if job:
+            job['progress'] = progress
+
+    def get_job(self, job_id):
+        job = self.jobs.get(job_id)
+        return dict(job) if job else None
+
+    def run(self, fn, *args, **kwargs):
+        return self.executor.submit(fn, *args, **kwargs)
+
+    def shutdown(self, wait=False):
+        self.executor.shutdown(wait=wait, cancel_futures=True)
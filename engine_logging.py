@@ -0,0 +1,118 @@
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+import logging.handlers
+from collections import OrderedDict
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(module)s - %(message)s'
+
+class StructuredFormatter(logging.Formatter):
+    """Ghi mỗi bản ghi thành một dòng JSON, kèm log_key và các trường trong extra={'fields': {...}}"""
+
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'module': record.module,
+            'msg': record.getMessage()
+        }
+        log_key = getattr(record, 'log_key', None)
+        if log_key:
+            entry['key'] = log_key
+        suppressed = getattr(record, 'suppressed', 0)
+        if suppressed:
+            entry['suppressed'] = suppressed
+        fields = getattr(record, 'fields', None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class RateLimitFilter(logging.Filter):
+    """Mỗi khoá chỉ ghi tối đa một lần trong interval giây, số lần bị bỏ qua được cộng vào lần ghi kế tiếp"""
+
+    def __init__(self, interval=30, max_keys=10000):
+        super().__init__()
+        self.interval = interval
+        self.max_keys = max_keys
+        self._state = OrderedDict()
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        key = getattr(record, 'log_key', None) or (record.module, record.levelno, str(record.msg))
+        now = time.time()
+        with self._lock:
+            last_time, suppressed = self._state.get(key, (0, 0))
+            if now - last_time < self.interval:
+                self._state[key] = (last_time, suppressed + 1)
+                return False
+            self._state[key] = (now, 0)
+            self._state.move_to_end(key)
+            while len(self._state) > self.max_keys:
+                self._state.popitem(last=False)
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Không bao giờ chặn thread gọi log: khi hàng đợi đầy thì bỏ bản ghi và đếm lại"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class _SuppressedSuffixFormatter(logging.Formatter):
+    def format(self, record):
+        message = super().format(record)
+        suppressed = getattr(record, 'suppressed', 0)
+        if suppressed:
+            message += f" (bỏ qua {suppressed} lần lặp)"
+        return message
+
+_listener = None
+_queue_handler = None
+_setup_lock = threading.Lock()
+
+def setup_logging(log_file='bot_errors.log', level=logging.INFO, rate_limit_interval=30,
+                  max_bytes=10 * 1024 * 1024, backup_count=5, queue_size=10000):
+    global _listener, _queue_handler
+    with _setup_lock:
+        root = logging.getLogger()
+        if _listener is not None:
+            return root
+
+        console = logging.StreamHandler()
+        console.setFormatter(_SuppressedSuffixFormatter(LOG_FORMAT))
+        handlers = [console]
+        if log_file:
+            file_handler = logging.handlers.RotatingFileHandler(
+                log_file, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8', delay=True
+            )
+            file_handler.setFormatter(StructuredFormatter())
+            handlers.append(file_handler)
+
+        log_queue = queue.Queue(maxsize=queue_size)
+        _queue_handler = DroppingQueueHandler(log_queue)
+        _queue_handler.addFilter(RateLimitFilter(rate_limit_interval))
+        _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
+
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(_queue_handler)
+        root.setLevel(level)
+        return root
+
+def dropped_records():
+    return _queue_handler.dropped if _queue_handler else 0
@@ -0,0 +1,162 @@
+import math
+from collections import deque
+
+# Các chỉ báo cập nhật tăng dần: mỗi nến/tick mới chỉ tốn O(1)
+
+class SMA:
+    def __init__(self, period):
+        self.period = period
+        self.window = deque()
+        self.total = 0.0
+        self.value = None
+
+    @property
+    def ready(self):
+        return len(self.window) >= self.period
+
+    def update(self, x):
+        self.window.append(x)
+        self.total += x
+        if len(self.window) > self.period:
+            self.total -= self.window.popleft()
+        self.value = self.total / len(self.window)
+        return self.value
+
+class EMA:
+    def __init__(self, period):
+        self.period = period
+        self.alpha = 2 / (period + 1)
+        self.count = 0
+        self.value = None
+
+    @property
+    def ready(self):
+        return self.count >= self.period
+
+    def update(self, x):
+        self.count += 1
+        self.value = x if self.value is None else self.value + self.alpha * (x - self.value)
+        return self.value
+
+class RSI:
+    """RSI kiểu Wilder"""
+
+    def __init__(self, period=14):
+        self.period = period
+        self.prev = None
+        self.avg_gain = 0.0
+        self.avg_loss = 0.0
+        self.count = 0
+        self.value = None
+
+    @property
+    def ready(self):
+        return self.count >= self.period
+
+    def update(self, close):
+        if self.prev is None:
+            self.prev = close
+            return None
+        change = close - self.prev
+        self.prev = close
+        gain = max(change, 0.0)
+        loss = max(-change, 0.0)
+        self.count += 1
+        if self.count <= self.period:
+            self.avg_gain += gain / self.period
+            self.avg_loss += loss / self.period
+        else:
+            self.avg_gain = (self.avg_gain * (self.period - 1) + gain) / self.period
+            self.avg_loss = (self.avg_loss * (self.period - 1) + loss) / self.period
+        if self.count < self.period:
+            return None
+        if self.avg_loss == 0:
+            self.value = 100.0
+        else:
+            self.value = 100 - 100 / (1 + self.avg_gain / self.avg_loss)
+        return self.value
+
+class ATR:
+    """ATR kiểu Wilder, cập nhật theo nến (high, low, close)"""
+
+    def __init__(self, period=14):
+        self.period = period
+        self.prev_close = None
+        self.count = 0
+        self.value = None
+
+    @property
+    def ready(self):
+        return self.count >= self.period
+
+    def update(self, high, low, close):
+        if self.prev_close is None:
+            true_range = high - low
+        else:
+            true_range = max(high - low, abs(high - self.prev_close), abs(low - self.prev_close))
+        self.prev_close = close
+        self.count += 1
+        if self.value is None:
+            self.value = true_range
+        elif self.count <= self.period:
+            self.value += (true_range - self.value) / self.count
+        else:
+            self.value = (self.value * (self.period - 1) + true_range) / self.period
+        return self.value
+
+class VWAP:
+    """VWAP trên cửa sổ trượt period nến (period=None: cộng dồn từ đầu)"""
+
+    def __init__(self, period=None):
+        self.period = period
+        self.window = deque()
+        self.pv = 0.0
+        self.volume = 0.0
+        self.value = None
+
+    @property
+    def ready(self):
+        return self.volume > 0
+
+    def update(self, price, volume):
+        self.window.append((price * volume, volume))
+        self.pv += price * volume
+        self.volume += volume
+        if self.period and len(self.window) > self.period:
+            old_pv, old_volume = self.window.popleft()
+            self.pv -= old_pv
+            self.volume -= old_volume
+        elif not self.period:
+            self.window.clear()
+        self.value = self.pv / self.volume if self.volume > 0 else None
+        return self.value
+
+class ZScore:
+    """Độ lệch chuẩn hoá của giá trị mới so với cửa sổ trượt (dùng cho khối lượng)"""
+
+    def __init__(self, period=20):
+        self.period = period
+        self.window = deque()
+        self.total = 0.0
+        self.total_sq = 0.0
+        self.value = None
+
+    @property
+    def ready(self):
+        return len(self.window) >= self.period
+
+    def update(self, x):
+        if self.window:
+            n = len(self.window)
+            mean = self.total / n
+            variance = max(self.total_sq / n - mean * mean, 0.0)
+            std = math.sqrt(variance)
+            self.value = (x - mean) / std if std > 0 else 0.0
+        self.window.append(x)
+        self.total += x
+        self.total_sq += x * x
+        if len(self.window) > self.period:
+            old = self.window.popleft()
+            self.total -= old
+            self.total_sq -= old * old
+        return self.value
@@ -0,0 +1,72 @@
+import os
+import re
+import json
+
+# Bộ giải mã JSON nhanh nhất có sẵn, có thể ép bằng biến môi trường JSON_BACKEND
+_BACKENDS = ('orjson', 'ujson', 'json')
+
+def _load_backend(name):
+    if name == 'orjson':
+        import orjson
+        return orjson.loads
+    if name == 'ujson':
+        import ujson
+        return ujson.loads
+    return json.loads
+
+def set_backend(name=None):
+    global loads, backend
+    candidates = [name] if name else _BACKENDS
+    for candidate in candidates:
+        try:
+            loads = _load_backend(candidate)
+            backend = candidate
+            return backend
+        except ImportError:
+            continue
+    loads = json.loads
+    backend = 'json'
+    return backend
+
+loads = json.loads
+backend = 'json'
+set_backend(os.environ.get('JSON_BACKEND') or None)
+
+_field_patterns = {}
+
+def _field_pattern(field):
+    pattern = _field_patterns.get(field)
+    if pattern is None:
+        # Cho phép khoảng trắng quanh dấu hai chấm: "p": "1.0" cũng như "p":"1.0"
+        pattern = _field_patterns[field] = re.compile(r'"%s"\s*:\s*' % re.escape(field))
+    return pattern
+
+def extract_fields(message, fields):
+    """Lấy nhanh giá trị (dạng chuỗi) của vài khoá cấp một trong JSON phẳng mà không giải mã toàn bộ.
+    Trả về None nếu thiếu khoá hoặc không đọc được giá trị để nơi gọi dùng loads() đầy đủ."""
+    try:
+        if isinstance(message, (bytes, bytearray)):
+            message = message.decode()
+        result = {}
+        for field in fields:
+            match = _field_pattern(field).search(message)
+            if match is None:
+                return None
+            start = match.end()
+            if message[start] == '"':
+                end = message.index('"', start + 1)
+                value = message[start + 1:end]
+                if '\\' in value:
+                    # Chuỗi có ký tự escape - để loads() xử lý
+                    return None
+            else:
+                end = start
+                while end < len(message) and message[end] not in ',}]':
+                    end += 1
+                value = message[start:end].strip()
+                if not value or value[0] in '{[':
+                    return None
+            result[field] = value
+        return result
+    except Exception:
+        return None
@@ -0,0 +1,217 @@
+import os
+import sys
+import time
+import zlib
+import bisect
+import struct
+import threading
+import logging
+from array import array
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from binance_client import binance_api_request, get_all_usdc_pairs
+from strategies import INTERVAL_MS
+
+logger = logging.getLogger(__name__)
+
+KLINES_URL = "https://fapi.binance.com/fapi/v1/klines"
+KLINE_CACHE_DIR = os.environ.get('KLINE_CACHE_DIR', 'kline_cache')
+# Mỗi khối trên đĩa ứng với đúng một request klines (limit tối đa 1500)
+BLOCK_CANDLES = 1000
+# Trọng số klines theo limit của Binance Futures: 500-1000 nến = 5
+BLOCK_WEIGHT = 5
+
+MAGIC = b'KLC1'
+# magic, số nến, khối đã đủ nến đóng
+FILE_HEADER = struct.Struct('<4sIB')
+# Tên cột và kiểu array tương ứng - lưu theo cột để đọc ra array dùng thẳng cho backtest
+COLUMNS = (
+    ('open_time', 'q'), ('open', 'd'), ('high', 'd'), ('low', 'd'), ('close', 'd'),
+    ('volume', 'd'), ('quote_volume', 'd'), ('trades', 'q')
+)
+# Vị trí cột tương ứng trong một dòng klines của REST
+REST_INDEX = (0, 1, 2, 3, 4, 5, 7, 8)
+
+class WeightBudget:
+    """Token bucket theo trọng số request/phút, chia ngân sách rate limit với các bot đang chạy"""
+
+    def __init__(self, weight_per_minute):
+        self.rate = weight_per_minute / 60.0
+        self.capacity = weight_per_minute
+        self.tokens = weight_per_minute
+        self.updated = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self, weight):
+        while True:
+            with self._lock:
+                now = time.time()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= weight:
+                    self.tokens -= weight
+                    return
+                wait = (weight - self.tokens) / self.rate
+            time.sleep(wait)
+
+def _empty_columns():
+    return {name: array(code) for name, code in COLUMNS}
+
+def encode_block(columns, complete):
+    count = len(columns['open_time'])
+    payload = b''.join(columns[name].tobytes() for name, _ in COLUMNS)
+    return FILE_HEADER.pack(MAGIC, count, 1 if complete else 0) + zlib.compress(payload, 6)
+
+def decode_block(data):
+    magic, count, complete = FILE_HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError("Không phải file cache klines")
+    payload = zlib.decompress(data[FILE_HEADER.size:])
+    columns = {}
+    offset = 0
+    for name, code in COLUMNS:
+        column = array(code)
+        size = count * column.itemsize
+        column.frombytes(payload[offset:offset + size])
+        offset += size
+        columns[name] = column
+    return columns, bool(complete)
+
+class KlineCache:
+    """Cache klines trên đĩa theo khối cố định, nén theo cột; chỉ tải từ REST các khối còn thiếu"""
+
+    def __init__(self, root=None, max_workers=8, weight_per_minute=None):
+        self.root = root or KLINE_CACHE_DIR
+        self.max_workers = max_workers
+        if weight_per_minute is None:
+            weight_per_minute = float(os.environ.get('KLINE_WEIGHT_PER_MINUTE', '1200'))
+        self.budget = WeightBudget(weight_per_minute)
+        self.blocks_read = 0
+        self.blocks_fetched = 0
+
+    def _block_span(self, interval):
+        return INTERVAL_MS[interval] * BLOCK_CANDLES
+
+    def _path(self, symbol, interval, block_start):
+        return os.path.join(self.root, symbol, interval, f"{block_start}.klc")
+
+    def _load(self, path):
+        try:
+            with open(path, 'rb') as f:
+                return decode_block(f.read())
+        except FileNotFoundError:
+            return None, False
+        except Exception as e:
+            logger.error("File cache klines hỏng %s: %s", path, e)
+            return None, False
+
+    def _store(self, path, columns, complete):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Ghi file tạm rồi đổi tên: bị ngắt giữa chừng cũng không để lại khối hỏng
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(encode_block(columns, complete))
+        os.replace(tmp_path, path)
+
+    def _fetch(self, symbol, interval, start_ms, end_ms):
+        self.budget.acquire(BLOCK_WEIGHT)
+        data = binance_api_request(KLINES_URL, params={
+            "symbol": symbol, "interval": interval,
+            "startTime": start_ms, "endTime": end_ms - 1, "limit": BLOCK_CANDLES
+        })
+        if data is None:
+            return None
+        columns = _empty_columns()
+        for row in data:
+            for (name, code), index in zip(COLUMNS, REST_INDEX):
+                columns[name].append(int(row[index]) if code == 'q' else float(row[index]))
+        return columns
+
+    def _block(self, symbol, interval, block_start):
+        """Đọc một khối từ đĩa, tải bổ sung phần còn thiếu nếu khối chưa đủ nến đóng"""
+        interval_ms = INTERVAL_MS[interval]
+        block_end = block_start + self._block_span(interval)
+        path = self._path(symbol, interval, block_start)
+        columns, complete = self._load(path)
+        if columns is not None and complete:
+            self.blocks_read += 1
+            return columns, False
+
+        # Chỉ lấy nến đã đóng
+        closed_end = min(block_end, int(time.time() * 1000) // interval_ms * interval_ms)
+        fetch_from = block_start
+        if columns is not None and len(columns['open_time']):
+            fetch_from = columns['open_time'][-1] + interval_ms
+        else:
+            columns = _empty_columns()
+        if fetch_from < closed_end:
+            fetched = self._fetch(symbol, interval, fetch_from, closed_end)
+            if fetched is None:
+                raise IOError(f"Không tải được klines {symbol} {interval} từ {fetch_from}")
+            for name, _ in COLUMNS:
+                columns[name].extend(fetched[name])
+            self.blocks_fetched += 1
+            self._store(path, columns, closed_end == block_end)
+            return columns, True
+        self.blocks_read += 1
+        return columns, False
+
+    def _blocks(self, interval, start_ms, end_ms):
+        span = self._block_span(interval)
+        block_start = start_ms - start_ms % span
+        while block_start < end_ms:
+            yield block_start
+            block_start += span
+
+    def get(self, symbol, interval, start_ms, end_ms):
+        """Các cột array (open_time, open, high, low, close, volume, ...) của nến trong [start_ms, end_ms)"""
+        result = _empty_columns()
+        for block_start in self._blocks(interval, start_ms, end_ms):
+            columns, _ = self._block(symbol, interval, block_start)
+            times = columns['open_time']
+            lo = bisect.bisect_left(times, start_ms)
+            hi = bisect.bisect_left(times, end_ms)
+            for name, _ in COLUMNS:
+                result[name].extend(columns[name][lo:hi])
+        return result
+
+    def download(self, symbols=None, intervals=('5m',), start_ms=None, end_ms=None, progress_callback=None):
+        """Tải song song mọi khối thiếu của nhiều symbol/khung thời gian; chạy lại sẽ tiếp tục từ khối còn thiếu"""
+        symbols = symbols or get_all_usdc_pairs(limit=None)
+        end_ms = end_ms or int(time.time() * 1000)
+        start_ms = start_ms or end_ms - 30 * 86400000
+        tasks = [(symbol, interval, block_start)
+                 for symbol in symbols for interval in intervals
+                 for block_start in self._blocks(interval, start_ms, end_ms)]
+        progress = {'total': len(tasks), 'done': 0, 'fetched': 0, 'cached': 0, 'failed': []}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self._block, *task): task for task in tasks}
+            for future in as_completed(futures):
+                try:
+                    _, fetched = future.result()
+                    progress['fetched' if fetched else 'cached'] += 1
+                except Exception as e:
+                    progress['failed'].append(f"{futures[future][0]} {futures[future][1]}: {e}")
+                progress['done'] += 1
+                if progress_callback:
+                    progress_callback(dict(progress, failed=len(progress['failed'])))
+        return progress
+
+if __name__ == "__main__":
+    import argparse
+    import engine_logging
+
+    parser = argparse.ArgumentParser(description="Tải klines lịch sử vào cache trên đĩa")
+    parser.add_argument('--symbols', nargs='*', help="Mặc định: mọi cặp USDC đang giao dịch")
+    parser.add_argument('--intervals', nargs='*', default=['5m'])
+    parser.add_argument('--days', type=float, default=30)
+    parser.add_argument('--workers', type=int, default=8)
+    args = parser.parse_args()
+
+    engine_logging.setup_logging(None)
+    now = int(time.time() * 1000)
+    summary = KlineCache(max_workers=args.workers).download(
+        args.symbols, args.intervals, now - int(args.days * 86400000), now,
+        progress_callback=lambda p: print(f"\r{p['done']}/{p['total']}", end='', file=sys.stderr)
+    )
+    print(f"\nĐã tải {summary['fetched']} khối, dùng lại {summary['cached']} khối, lỗi {len(summary['failed'])}")
@@ -1,15 +1,22 @@
 import os
+import sys
+import json
+import time
+import zlib
+import asyncio
 import logging
-from fastapi import FastAPI, HTTPException
+import threading
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import Optional
 import uvicorn
+from engine_executor import EngineExecutor
+import engine_logging
 
-# Setup logging
-logging.basicConfig(level=logging.INFO)
+# Logging được cấu hình khi ứng dụng khởi động, import module không có tác dụng phụ
 logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Trading Bot System", version="1.0.0")
@@ -23,9 +30,8 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Tạo thư mục static nếu chưa tồn tại
-os.makedirs("static", exist_ok=True)
-app.mount("/static", StaticFiles(directory="static"), name="static")
+# Không tạo thư mục lúc import - thiếu static thì các file tĩnh trả 404
+app.mount("/static", StaticFiles(directory="static", check_dir=False), name="static")
 
 # Pydantic models
 class UserCredentials(BaseModel):
@@ -42,6 +48,169 @@ class BotConfig(BaseModel):
     bot_mode: str = "static"
     bot_count: int = 1
 
+class StopBotRequest(BaseModel):
+    # "all" vẫn được nhận cho client cũ; dừng toàn bộ nên dùng /api/stop-all
+    bot_id: str
+
+# BotManager của bot_core - sẽ tích hợp sau, khi None thì trả dữ liệu test mode
+bot_manager = None
+# Warm-up và /api/connect chạy _connect_manager trên các worker khác nhau - mỗi lần chỉ một lần kết nối
+_connect_lock = threading.Lock()
+
+TEST_SYSTEM_INFO = {
+    "balance": 1000.0,
+    "total_bots": 0,
+    "searching_bots": 0,
+    "waiting_bots": 0,
+    "trading_bots": 0,
+    "total_long_count": 0,
+    "total_short_count": 0,
+    "total_long_pnl": 0,
+    "total_short_pnl": 0,
+    "total_unrealized_pnl": 0,
+    "test_mode": True
+}
+
+# Trạng thái bot lưu vào SQLite để khôi phục sau khi redeploy
+STATE_DB_PATH = os.environ.get("STATE_DB_PATH", "bot_state.db")
+state_store = None
+TRADE_DB_PATH = os.environ.get("TRADE_DB_PATH", "trades.db")
+trade_journal = None
+# Số tiến trình chạy bot (>1 thì phân bot ra nhiều tiến trình)
+BOT_SHARDS = int(os.environ.get("BOT_SHARDS", "1"))
+# Thời gian tối đa (giây) để dừng bot khi tắt ứng dụng
+SHUTDOWN_DEADLINE = float(os.environ.get("SHUTDOWN_DEADLINE", "20"))
+# Dùng chung một luồng dữ liệu thị trường qua shared memory cho các shard
+MARKET_BUS = os.environ.get("MARKET_BUS", "1") == "1"
+
+# Mọi thao tác gọi Binance chạy trên executor riêng, handler chỉ trả job_id
+engine = EngineExecutor(max_workers=int(os.environ.get("ENGINE_WORKERS", "4")))
+
+# Luồng giá dùng chung của tiến trình, khởi động nền lúc startup và giao cho BotManager
+market_ws = None
+WARMUP_STATE = {'started_at': None, 'finished_at': None, 'error': None}
+# Giá cũ hơn ngưỡng này (giây) thì luồng giá coi như chưa sẵn sàng
+READY_PRICE_MAX_AGE = float(os.environ.get("READY_PRICE_MAX_AGE", "10"))
+
+# Chu kỳ đẩy delta cho dashboard (giây)
+STREAM_INTERVAL = float(os.environ.get("STREAM_INTERVAL", "1.0"))
+STREAM_QUEUE_SIZE = 32
+# Chu kỳ gửi các trường thay đổi liên tục (tuổi snapshot, uptime shard) - không đưa vào delta
+STREAM_HEARTBEAT_INTERVAL = float(os.environ.get("STREAM_HEARTBEAT_INTERVAL", "15.0"))
+VOLATILE_SUMMARY_FIELDS = ("age", "updated_at")
+VOLATILE_SHARD_FIELDS = ("uptime", "last_ok_age")
+
+def _collect_snapshot():
+    if bot_manager is None:
+        return {}, dict(TEST_SYSTEM_INFO)
+    bots = {info['bot_id']: info for info in bot_manager.get_bots_info()}
+    return bots, bot_manager.get_system_info()
+
+def _stable_summary(summary):
+    """Bỏ các trường đổi theo từng giây để delta chỉ gửi khi trạng thái thật sự thay đổi"""
+    stable = {k: v for k, v in summary.items() if k not in VOLATILE_SUMMARY_FIELDS}
+    if "shards" in stable:
+        stable["shards"] = [{k: v for k, v in shard.items() if k not in VOLATILE_SHARD_FIELDS}
+                            for shard in stable["shards"]]
+    return stable
+
+class StateBroadcaster:
+    """Tính snapshot một lần mỗi tick và đẩy delta đã mã hoá sẵn cho mọi client"""
+
+    def __init__(self, interval, heartbeat_interval=STREAM_HEARTBEAT_INTERVAL):
+        self.interval = interval
+        self.heartbeat_interval = heartbeat_interval
+        self.subscribers = set()
+        self.seq = 0
+        self._bots = {}
+        self._summary = {}
+        self._stable = {}
+        self._last_heartbeat = 0
+        self._task = None
+
+    def _full_message(self):
+        return json.dumps({
+            "type": "snapshot",
+            "seq": self.seq,
+            "ts": time.time(),
+            "bots": self._bots,
+            "summary": self._summary
+        }, default=str)
+
+    def subscribe(self):
+        queue = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+        queue.put_nowait(self._full_message())
+        self.subscribers.add(queue)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        return queue
+
+    def unsubscribe(self, queue):
+        self.subscribers.discard(queue)
+
+    def _diff(self, bots, summary):
+        changed = {}
+        for bot_id, info in bots.items():
+            old = self._bots.get(bot_id)
+            if old is None:
+                changed[bot_id] = info
+                continue
+            fields = {k: v for k, v in info.items() if old.get(k) != v}
+            if fields:
+                changed[bot_id] = fields
+        removed = [bot_id for bot_id in self._bots if bot_id not in bots]
+        stable = _stable_summary(summary)
+        summary_delta = {k: summary[k] for k, v in stable.items() if self._stable.get(k) != v}
+
+        self._bots = bots
+        self._summary = summary
+        self._stable = stable
+
+        if not changed and not removed and not summary_delta:
+            return None
+        self.seq += 1
+        delta = {"type": "delta", "seq": self.seq, "ts": time.time()}
+        if changed:
+            delta["bots"] = changed
+        if removed:
+            delta["removed"] = removed
+        if summary_delta:
+            delta["summary"] = summary_delta
+        return json.dumps(delta, default=str)
+
+    def _heartbeat(self, now):
+        """Gửi các trường biến động theo chu kỳ riêng; không tăng seq vì chỉ ghi đè giá trị"""
+        if now - self._last_heartbeat < self.heartbeat_interval:
+            return None
+        self._last_heartbeat = now
+        summary = {k: self._summary[k] for k in VOLATILE_SUMMARY_FIELDS if k in self._summary}
+        if "shards" in self._summary:
+            summary["shards"] = self._summary["shards"]
+        return json.dumps({"type": "heartbeat", "seq": self.seq, "ts": now, "summary": summary}, default=str)
+
+    def _publish(self, message):
+        for queue in list(self.subscribers):
+            if queue.full():
+                # Client chậm: bỏ các delta tồn đọng và gửi lại snapshot đầy đủ
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(self._full_message())
+            else:
+                queue.put_nowait(message)
+
+    async def _run(self):
+        while self.subscribers:
+            try:
+                bots, summary = _collect_snapshot()
+                for message in (self._diff(bots, summary), self._heartbeat(time.time())):
+                    if message:
+                        self._publish(message)
+            except Exception as e:
+                logger.error(f"Lỗi tạo snapshot dashboard: {str(e)}")
+            await asyncio.sleep(self.interval)
+
+broadcaster = StateBroadcaster(STREAM_INTERVAL)
+
 # Health check endpoint - QUAN TRỌNG
 @app.get("/")
 async def root():
@@ -123,15 +292,152 @@ async def serve_app():
         """)
 
 # API endpoints
+def _connect_manager(api_key, api_secret):
+    with _connect_lock:
+        return _connect_manager_locked(api_key, api_secret)
+
+def _connect_manager_locked(api_key, api_secret):
+    global bot_manager, state_store, trade_journal
+    from binance_client import get_balance
+    from bot_core import BotManager
+    from state_store import StateStore
+    from trade_journal import TradeJournal
+
+    if bot_manager is not None and bot_manager.api_key == api_key and bot_manager.api_secret == api_secret:
+        return bot_manager
+    # Kiểm tra key bằng một request trước khi dựng manager (WebSocket, luồng nền, tiến trình shard)
+    if get_balance(api_key, api_secret) is None:
+        return None
+    if state_store is None:
+        state_store = StateStore(STATE_DB_PATH)
+    if trade_journal is None:
+        trade_journal = TradeJournal(TRADE_DB_PATH)
+    if BOT_SHARDS > 1:
+        from bot_shards import ShardedBotManager
+        manager = ShardedBotManager(api_key, api_secret, shards=BOT_SHARDS,
+                                    state_db_path=STATE_DB_PATH, journal_path=TRADE_DB_PATH,
+                                    market_bus=MARKET_BUS)
+    else:
+        manager = BotManager(api_key, api_secret, state_store=state_store, journal=trade_journal,
+                             ws_manager=market_ws)
+    if manager.get_system_info()['balance'] is None:
+        manager.close()
+        return None
+    if bot_manager is not None:
+        # stop_all xoá bot đã lưu - chỉ dùng khi đổi sang tài khoản khác. Cùng key (đổi secret) thì chỉ đóng
+        # để manager mới khôi phục lại các bot đó
+        if bot_manager.api_key != api_key:
+            bot_manager.stop_all()
+        bot_manager.close()
+    bot_manager = manager
+    restored = manager.restore_bots()
+    if restored:
+        logger.info(f"Đã khôi phục {restored} bot từ {STATE_DB_PATH}")
+    return manager
+
+@app.on_event("shutdown")
+async def shutdown_engine():
+    if bot_manager is not None:
+        report = await asyncio.to_thread(bot_manager.close, SHUTDOWN_DEADLINE)
+        if report and (report['threads_alive'] or report['orders_pending'] or report['cancel_failed']):
+            logger.warning(f"Dừng chưa hoàn tất: {report}")
+    for store in (state_store, trade_journal):
+        if store is not None:
+            store.close()
+    engine.shutdown()
+
+def _env_credentials():
+    api_key = os.environ.get("BINANCE_API_KEY")
+    api_secret = os.environ.get("BINANCE_API_SECRET")
+    if api_key and api_secret and api_key != "your_api_key_here":
+        return api_key, api_secret
+    return None
+
+def _warm_up():
+    # Nạp module bot, exchangeInfo và luồng giá ở nền để server nhận request ngay khi khởi động
+    global market_ws
+    WARMUP_STATE['started_at'] = time.time()
+    try:
+        import bot_core
+        from binance_client import WebSocketManager, start_price_feed
+        if BOT_SHARDS <= 1 and market_ws is None:
+            market_ws = WebSocketManager()
+            start_price_feed(market_ws)
+        bot_core.eligible_universe.refresh(force=True)
+        credentials = _env_credentials()
+        if credentials:
+            # Khi có API key trong biến môi trường thì tự kết nối và khôi phục bot sau redeploy
+            _connect_manager(*credentials)
+    except Exception as e:
+        WARMUP_STATE['error'] = str(e)
+        logger.error(f"Lỗi khởi động nền: {e}")
+    finally:
+        WARMUP_STATE['finished_at'] = time.time()
+
+@app.on_event("startup")
+async def start_warm_up():
+    engine_logging.setup_logging('bot_errors.log')
+    engine.submit("warmup", _warm_up)
+
+def _readiness_checks():
+    # Chỉ đọc các module đã nạp - /ready không tự kích hoạt import nặng
+    checks = {
+        'warmup': {
+            'ready': WARMUP_STATE['finished_at'] is not None and WARMUP_STATE['error'] is None,
+            'required': True,
+            'error': WARMUP_STATE['error']
+        }
+    }
+
+    # Module có thể đang được nạp dở ở luồng khởi động nền
+    universe = getattr(sys.modules.get('bot_core'), 'eligible_universe', None)
+    checks['exchange_info'] = {
+        'ready': bool(universe and universe.symbols),
+        'required': True,
+        'symbols': len(universe.symbols) if universe else 0,
+        'age': time.time() - universe.last_refresh if universe and universe.last_refresh else None
+    }
+
+    price_cache = getattr(sys.modules.get('binance_client'), 'price_cache', None)
+    price_age = None
+    if price_cache and price_cache.last_update:
+        price_age = time.time() - price_cache.last_update
+    checks['price_feed'] = {
+        'ready': price_age is not None and price_age <= READY_PRICE_MAX_AGE,
+        'required': BOT_SHARDS <= 1,
+        'symbols': price_cache.stats()['symbols'] if price_cache else 0,
+        'age': price_age
+    }
+
+    checks['bot_manager'] = {
+        'ready': bot_manager is not None,
+        'required': _env_credentials() is not None
+    }
+    return checks
+
+@app.get("/ready")
+async def readiness():
+    checks = _readiness_checks()
+    ready = all(check['ready'] for check in checks.values() if check['required'])
+    return JSONResponse({"ready": ready, "checks": checks}, status_code=200 if ready else 503)
+
 @app.post("/api/connect")
 async def connect_binance(credentials: UserCredentials):
     try:
-        # Test mode - sẽ tích hợp với bot_core sau
+        # Xác thực API chạy trên executor, event loop không bị chặn
+        manager = await asyncio.wrap_future(
+            engine.run(_connect_manager, credentials.api_key, credentials.api_secret)
+        )
+        if manager is None:
+            return JSONResponse({
+                "success": False,
+                "message": "Không thể xác thực API key/secret với Binance"
+            })
         return JSONResponse({
             "success": True,
-            "message": "Kết nối thành công! (Test Mode)",
-            "balance": 1000.0,
-            "test_mode": True
+            "message": "Kết nối thành công!",
+            "balance": manager.get_system_info()['balance'],
+            "test_mode": False
         })
     except Exception as e:
         return JSONResponse({
@@ -141,38 +447,155 @@ async def connect_binance(credentials: UserCredentials):
 
 @app.get("/api/system-info")
 async def get_system_info():
-    return JSONResponse({
-        "balance": 1000.0,
-        "total_bots": 0,
-        "searching_bots": 0,
-        "waiting_bots": 0,
-        "trading_bots": 0,
-        "total_long_count": 0,
-        "total_short_count": 0,
-        "total_long_pnl": 0,
-        "total_short_pnl": 0,
-        "total_unrealized_pnl": 0,
-        "test_mode": True
-    })
+    if bot_manager is None:
+        return JSONResponse(TEST_SYSTEM_INFO)
+    return JSONResponse(bot_manager.get_system_info())
 
 @app.get("/api/bots")
-async def get_bots():
-    return JSONResponse([])
+async def get_bots(request: Request, since: Optional[int] = None, status: Optional[str] = None,
+                   symbol: Optional[str] = None, offset: int = 0, limit: Optional[int] = None):
+    fleet_version = bot_manager.fleet_version if bot_manager is not None else 0
+    etag = f'W/"{fleet_version}-{zlib.crc32(str(request.query_params).encode()):x}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+
+    if bot_manager is None:
+        result = {"version": 0, "total": 0, "offset": offset, "limit": limit, "bots": [], "removed": [],
+                  "resync": False}
+    else:
+        result = bot_manager.query_bots(since=since, status=status, symbol=symbol,
+                                        offset=max(offset, 0), limit=limit)
+
+    # Không có tham số phân trang/since thì giữ định dạng danh sách cũ cho client hiện tại
+    body = result if since is not None or limit is not None else result["bots"]
+    return JSONResponse(body, headers={"ETag": etag, "X-Bots-Version": str(result["version"])})
 
 @app.post("/api/add-bot")
 async def add_bot(config: BotConfig):
+    if bot_manager is None:
+        return JSONResponse({
+            "success": True,
+            "message": "Bot added successfully (Test Mode)"
+        })
+    job_id = engine.submit_with_progress(
+        "add_bot", bot_manager.add_bot,
+        config.symbol, config.lev, config.percent, config.tp, config.sl, config.roi_trigger,
+        "Global-Market", bot_count=config.bot_count, bot_mode=config.bot_mode
+    )
     return JSONResponse({
         "success": True,
-        "message": "Bot added successfully (Test Mode)"
-    })
+        "message": "Đang tạo bot",
+        "job_id": job_id
+    }, status_code=202)
 
 @app.post("/api/stop-bot")
-async def stop_bot():
+async def stop_bot(request: StopBotRequest):
+    if request.bot_id == "all":
+        return await stop_all_bots()
+    if bot_manager is None:
+        return JSONResponse({
+            "success": True,
+            "message": "Bot stopped successfully (Test Mode)"
+        })
+    job_id = engine.submit("stop_bot", bot_manager.stop_bot, request.bot_id)
+    return JSONResponse({
+        "success": True,
+        "message": "Đang dừng bot",
+        "job_id": job_id
+    }, status_code=202)
+
+@app.post("/api/stop-all")
+async def stop_all_bots():
+    if bot_manager is None:
+        return JSONResponse({
+            "success": True,
+            "message": "Bot stopped successfully (Test Mode)"
+        })
+    job_id = engine.submit("stop_all", bot_manager.stop_all)
     return JSONResponse({
         "success": True,
-        "message": "Bot stopped successfully (Test Mode)"
+        "message": "Đang dừng bot",
+        "job_id": job_id
+    }, status_code=202)
+
+@app.get("/api/journal/stats")
+async def get_journal_stats(symbol: Optional[str] = None, bot_id: Optional[str] = None):
+    if trade_journal is None:
+        return JSONResponse({"trades": 0, "wins": 0, "pnl": 0, "max_drawdown": 0, "win_rate": 0})
+    stats = await asyncio.to_thread(trade_journal.get_stats, symbol=symbol, bot_id=bot_id)
+    return JSONResponse(stats)
+
+@app.get("/api/journal/top")
+async def get_journal_top(scope: str = "symbol", order_by: str = "pnl", limit: int = 20):
+    if trade_journal is None:
+        return JSONResponse([])
+    rows = await asyncio.to_thread(trade_journal.get_top, scope, order_by, min(limit, 500))
+    return JSONResponse(rows)
+
+@app.get("/api/journal/fills")
+async def get_journal_fills(symbol: Optional[str] = None, bot_id: Optional[str] = None,
+                            since: Optional[float] = None, limit: int = 100):
+    if trade_journal is None:
+        return JSONResponse([])
+    rows = await asyncio.to_thread(trade_journal.get_fills, symbol, bot_id, since, min(limit, 1000))
+    return JSONResponse(rows)
+
+@app.get("/api/engine/stats")
+async def get_engine_stats():
+    import binance_client
+    import strategies
+    risk_engine = getattr(bot_manager, 'risk_engine', None)
+    order_books = getattr(bot_manager, 'order_books', None)
+    ws_manager = getattr(bot_manager, 'ws_manager', None) or market_ws
+    return JSONResponse({
+        "circuit_breakers": binance_client.circuit_breaker_stats(),
+        "request_coalescing": binance_client.coalescer_stats(),
+        "price_cache": binance_client.price_cache.stats(),
+        "candles": strategies.candle_registry.stats(),
+        "risk": risk_engine.stats() if risk_engine else None,
+        "order_books": order_books.stats() if order_books else None,
+        "websocket": ws_manager.stats() if hasattr(ws_manager, 'stats') else None
     })
 
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = engine.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return JSONResponse(job)
+
+# Luồng đẩy trạng thái bot cho dashboard: snapshot đầy đủ khi kết nối, sau đó chỉ gửi delta
+@app.websocket("/ws/stream")
+async def stream_ws(websocket: WebSocket):
+    await websocket.accept()
+    queue = broadcaster.subscribe()
+    try:
+        while True:
+            message = await queue.get()
+            await websocket.send_text(message)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        broadcaster.unsubscribe(queue)
+
+@app.get("/api/stream")
+async def stream_sse():
+    queue = broadcaster.subscribe()
+
+    async def event_source():
+        try:
+            while True:
+                message = await queue.get()
+                yield f"data: {message}\n\n"
+        finally:
+            broadcaster.unsubscribe(queue)
+
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 8080))
     uvicorn.run(
@@ -0,0 +1,308 @@
+import time
+import struct
+import threading
+import logging
+from multiprocessing import shared_memory
+
+from binance_client import WebSocketManager, BULK_PRICE_STREAM, price_cache
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'MDB1'
+MAX_READERS = 16
+CANDLES_PER_SLOT = 60
+CANDLE_INTERVAL_MS = 60000
+
+# magic, capacity, count
+HEADER = struct.Struct('<4sII')
+HEADER_SIZE = 16
+# name, seq, price, ts, candle head, candle count, last candle open time, cờ đăng ký của từng reader
+SLOT_HEADER = struct.Struct(f'<16sQddIIq{MAX_READERS}s')
+# Phần do publisher ghi - không đụng tới cờ wanted của reader
+SLOT_STATE = struct.Struct('<16sQddIIq')
+# open_time, open, high, low, close, volume
+CANDLE = struct.Struct('<qddddd')
+SLOT_SIZE = SLOT_HEADER.size + CANDLE.size * CANDLES_PER_SLOT
+SEQ_OFFSET = 16
+WANTED_OFFSET = SLOT_STATE.size
+
+def _slot_offset(index):
+    return HEADER_SIZE + index * SLOT_SIZE
+
+def _attach(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13: các shard được spawn từ supervisor nên dùng chung resource_tracker với publisher
+        return shared_memory.SharedMemory(name=name)
+
+class MarketDataPublisher:
+    """Sở hữu kết nối WebSocket duy nhất của máy và ghi giá/nến vào bảng shared memory (seqlock)"""
+
+    def __init__(self, name='market_bus', capacity=1024, poll_interval=0.5):
+        self.name = name
+        self.capacity = capacity
+        self.poll_interval = poll_interval
+        self.shm = shared_memory.SharedMemory(name=name, create=True, size=HEADER_SIZE + capacity * SLOT_SIZE)
+        self.buf = self.shm.buf
+        HEADER.pack_into(self.buf, 0, MAGIC, capacity, 0)
+        self.slots = {}
+        self._slot_locks = []
+        self._alloc_lock = threading.Lock()
+        self.ws_manager = WebSocketManager()
+        self._trade_streams = set()
+        self._running = True
+
+        self.ws_manager.add_stream(BULK_PRICE_STREAM, BULK_PRICE_STREAM, self._handle_bulk)
+        self._thread = threading.Thread(target=self._watch_subscriptions, daemon=True)
+        self._thread.start()
+
+    def _slot(self, symbol):
+        index = self.slots.get(symbol)
+        if index is not None:
+            return index
+        with self._alloc_lock:
+            index = self.slots.get(symbol)
+            if index is not None:
+                return index
+            index = len(self.slots)
+            if index >= self.capacity:
+                return None
+            SLOT_HEADER.pack_into(self.buf, _slot_offset(index), symbol.encode()[:16], 0, 0.0, 0.0, 0, 0, 0,
+                                  bytes(MAX_READERS))
+            self._slot_locks.append(threading.Lock())
+            self.slots[symbol] = index
+            HEADER.pack_into(self.buf, 0, MAGIC, self.capacity, len(self.slots))
+            return index
+
+    def publish(self, symbol, price, qty=0.0, trade_time_ms=None):
+        index = self._slot(symbol)
+        if index is None:
+            return
+        offset = _slot_offset(index)
+        trade_time_ms = trade_time_ms or int(time.time() * 1000)
+        with self._slot_locks[index]:
+            name, seq, _, _, head, count, last_open = SLOT_STATE.unpack_from(self.buf, offset)
+            # seq lẻ: đang ghi, reader sẽ đọc lại
+            struct.pack_into('<Q', self.buf, offset + SEQ_OFFSET, seq + 1)
+
+            open_time = trade_time_ms - trade_time_ms % CANDLE_INTERVAL_MS
+            if count and open_time == last_open:
+                candle_offset = offset + SLOT_HEADER.size + head * CANDLE.size
+                _, o, h, l, _, v = CANDLE.unpack_from(self.buf, candle_offset)
+                CANDLE.pack_into(self.buf, candle_offset, open_time, o, max(h, price), min(l, price), price, v + qty)
+            elif open_time > last_open:
+                head = (head + 1) % CANDLES_PER_SLOT if count else 0
+                count = min(count + 1, CANDLES_PER_SLOT)
+                last_open = open_time
+                CANDLE.pack_into(self.buf, offset + SLOT_HEADER.size + head * CANDLE.size,
+                                 open_time, price, price, price, price, qty)
+
+            # Ghi phần còn lại khi seq vẫn lẻ; seq chẵn phải là lần ghi cuối cùng
+            SLOT_STATE.pack_into(self.buf, offset, name, seq + 1, price, trade_time_ms / 1000,
+                                 head, count, last_open)
+            struct.pack_into('<Q', self.buf, offset + SEQ_OFFSET, seq + 2)
+
+    def _handle_bulk(self, data):
+        if not isinstance(data, list):
+            return
+        for item in data:
+            price = item.get('c') or item.get('p')
+            if not price:
+                continue
+            symbol = item['s']
+            # Symbol đã có luồng @trade thì nến được cập nhật chính xác hơn từ đó
+            if symbol in self._trade_streams:
+                continue
+            self.publish(symbol, float(price), 0.0, item.get('E'))
+
+    def _subscribe_trades(self, symbol):
+        def handle_trade(data):
+            if 'p' in data:
+                trade_time = data.get('T')
+                self.publish(symbol, float(data['p']), float(data.get('q', 0)),
+                             int(trade_time) if trade_time else None)
+
+        self._trade_streams.add(symbol)
+        self.ws_manager.add_stream(symbol, f"{symbol.lower()}@trade", handle_trade, fields=('p', 'q', 'T'))
+
+    def _watch_subscriptions(self):
+        # Reader bật cờ wanted trong slot, publisher mở/đóng luồng @trade tương ứng
+        while self._running:
+            for symbol, index in list(self.slots.items()):
+                wanted = bytes(self.buf[_slot_offset(index) + WANTED_OFFSET:_slot_offset(index) + SLOT_HEADER.size])
+                is_wanted = any(wanted)
+                if is_wanted and symbol not in self._trade_streams:
+                    self._subscribe_trades(symbol)
+                elif not is_wanted and symbol in self._trade_streams:
+                    self._trade_streams.discard(symbol)
+                    self.ws_manager.remove_symbol(symbol)
+            time.sleep(self.poll_interval)
+
+    def close(self):
+        self._running = False
+        self.ws_manager.stop()
+        self.buf = None
+        self.shm.close()
+        self.shm.unlink()
+
+class MarketDataReader:
+    """Đọc bảng giá shared memory không cần khoá: đọc lại khi seq lẻ hoặc thay đổi trong lúc đọc"""
+
+    def __init__(self, name='market_bus', reader_id=0):
+        if not 0 <= reader_id < MAX_READERS:
+            # Mỗi reader có một byte cờ wanted trong slot - vượt quá sẽ ghi đè vào vòng nến
+            raise ValueError(f"reader_id phải trong khoảng 0..{MAX_READERS - 1}")
+        self.name = name
+        self.reader_id = reader_id
+        self.shm = _attach(name)
+        self.buf = self.shm.buf
+        magic, self.capacity, _ = HEADER.unpack_from(self.buf, 0)
+        if magic != MAGIC:
+            raise ValueError(f"Vùng nhớ {name} không phải market bus")
+        self.slots = {}
+        self._known = 0
+
+    def _refresh_index(self):
+        _, _, count = HEADER.unpack_from(self.buf, 0)
+        for index in range(self._known, count):
+            name = SLOT_HEADER.unpack_from(self.buf, _slot_offset(index))[0].rstrip(b'\0').decode()
+            if name:
+                self.slots[name] = index
+        self._known = count
+
+    def slot(self, symbol):
+        index = self.slots.get(symbol)
+        if index is None:
+            self._refresh_index()
+            index = self.slots.get(symbol)
+        return index
+
+    def _read(self, index, with_candles=False, retries=100):
+        offset = _slot_offset(index)
+        for _ in range(retries):
+            header = SLOT_HEADER.unpack_from(self.buf, offset)
+            seq = header[1]
+            if seq & 1:
+                continue
+            candles = None
+            if with_candles:
+                candles = bytes(self.buf[offset + SLOT_HEADER.size:offset + SLOT_SIZE])
+            if struct.unpack_from('<Q', self.buf, offset + SEQ_OFFSET)[0] == seq:
+                return header, candles
+        return None, None
+
+    def seq(self, symbol):
+        index = self.slot(symbol)
+        if index is None:
+            return 0
+        return struct.unpack_from('<Q', self.buf, _slot_offset(index) + SEQ_OFFSET)[0]
+
+    def get_price(self, symbol):
+        index = self.slot(symbol)
+        if index is None:
+            return None
+        header, _ = self._read(index)
+        if header is None or not header[1]:
+            return None
+        return header[2], header[3]
+
+    def get_candles(self, symbol, limit=CANDLES_PER_SLOT):
+        index = self.slot(symbol)
+        if index is None:
+            return []
+        header, raw = self._read(index, with_candles=True)
+        if header is None:
+            return []
+        head, count = header[4], header[5]
+        candles = []
+        for i in range(min(limit, count)):
+            position = (head - i) % CANDLES_PER_SLOT
+            candles.append(CANDLE.unpack_from(raw, position * CANDLE.size))
+        candles.reverse()
+        return candles
+
+    def set_wanted(self, symbol, wanted=True):
+        index = self.slot(symbol)
+        if index is None:
+            return False
+        self.buf[_slot_offset(index) + WANTED_OFFSET + self.reader_id] = 1 if wanted else 0
+        return True
+
+    def close(self):
+        self.buf = None
+        self.shm.close()
+
+class BusWebSocketManager:
+    """Thay WebSocketManager trong tiến trình đọc: nhận giá từ market bus thay vì mở kết nối riêng.
+    Các luồng khác (kline của chiến lược, depth của sổ lệnh, user data) đi qua một WebSocketManager riêng của shard."""
+
+    def __init__(self, reader, poll_interval=0.1, stream_factory=None):
+        self.reader = reader
+        self.poll_interval = poll_interval
+        self.connections = {}
+        self._stream_factory = stream_factory or WebSocketManager
+        self._streams = None
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._poll, daemon=True)
+        self._thread.start()
+
+    def add_symbol(self, symbol, callback):
+        if not symbol:
+            return
+        symbol = symbol.upper()
+        with self._lock:
+            if symbol not in self.connections:
+                self.connections[symbol] = {'callback': callback, 'seq': 0, 'wanted': False}
+
+    def add_stream(self, key, stream, handler, fields=None):
+        # Luồng giá toàn thị trường đã do publisher ghi vào bus
+        if stream == BULK_PRICE_STREAM or self._stop_event.is_set():
+            return
+        with self._lock:
+            if self._streams is None:
+                # Chỉ mở khi shard thật sự cần luồng riêng
+                self._streams = self._stream_factory()
+            streams = self._streams
+        streams.add_stream(key, stream, handler, fields=fields)
+
+    def remove_symbol(self, symbol):
+        if not symbol:
+            return
+        symbol = symbol.upper()
+        with self._lock:
+            streams = self._streams
+            if self.connections.pop(symbol, None) is not None:
+                self.reader.set_wanted(symbol, False)
+        if streams is not None:
+            streams.remove_symbol(symbol)
+
+    def _poll(self):
+        while not self._stop_event.is_set():
+            with self._lock:
+                items = list(self.connections.items())
+            for symbol, conn in items:
+                try:
+                    if not conn['wanted']:
+                        conn['wanted'] = self.reader.set_wanted(symbol, True)
+                    seq = self.reader.seq(symbol)
+                    if seq and seq != conn['seq'] and not seq & 1:
+                        conn['seq'] = seq
+                        price = self.reader.get_price(symbol)
+                        if price:
+                            conn['callback'](price[0])
+                except Exception as e:
+                    logger.error("Lỗi đọc market bus %s: %s", symbol, e, extra={'log_key': f"bus:{symbol}"})
+            self._stop_event.wait(self.poll_interval)
+
+    def stop(self):
+        self._stop_event.set()
+        for symbol in list(self.connections.keys()):
+            self.remove_symbol(symbol)
+        if self._streams is not None:
+            self._streams.stop()
+
+def attach_price_cache(reader):
+    # Giá trong PriceCache cũ hơn giới hạn thì lấy từ market bus trước khi gọi REST
+    price_cache.fallback = reader.get_price
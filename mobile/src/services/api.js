@@ -85,7 +85,7 @@ export const stopBot = async (botId) => {
 
 export const stopAllBots = async () => {
   try {
-    const response = await api.post('/api/stop-bot', { bot_id: 'all' });
+    const response = await api.post('/api/stop-all');
     return response.data;
   } catch (error) {
     throw new Error('Không thể dừng tất cả bot');
@@ -0,0 +1,249 @@
+import os
+import bisect
+import threading
+import logging
+
+from binance_client import binance_api_request
+from clock import get_clock
+
+logger = logging.getLogger(__name__)
+
+DEPTH_URL = "https://fapi.binance.com/fapi/v1/depth"
+DEPTH_STREAM_SPEED = os.environ.get('DEPTH_STREAM_SPEED', '100ms')
+SNAPSHOT_LIMIT = int(os.environ.get('DEPTH_SNAPSHOT_LIMIT', '500'))
+
+class LocalOrderBook:
+    """Sổ lệnh L2 cục bộ của một symbol: snapshot REST + luồng diff-depth theo quy trình đồng bộ của Binance"""
+
+    def __init__(self, symbol, snapshot_limit=SNAPSHOT_LIMIT, max_age=5.0, clock=None):
+        self.symbol = symbol
+        self.clock = clock or get_clock()
+        self.snapshot_limit = snapshot_limit
+        self.max_age = max_age
+        self.bids = {}
+        self.asks = {}
+        # Giá được giữ sắp xếp tăng dần (bid lưu giá âm) để duyệt từ mức tốt nhất
+        self._bid_prices = []
+        self._ask_prices = []
+        self.last_update_id = 0
+        self.last_event_at = 0
+        self.synced = False
+        self._awaiting_first = False
+        self._buffer = []
+        self._syncing = False
+        self._lock = threading.Lock()
+        self.resyncs = 0
+        self.updates = 0
+
+    def _set_level(self, book, prices, price, qty, key):
+        if qty == 0:
+            if book.pop(price, None) is not None:
+                index = bisect.bisect_left(prices, key)
+                if index < len(prices) and prices[index] == key:
+                    prices.pop(index)
+        else:
+            if price not in book:
+                bisect.insort(prices, key)
+            book[price] = qty
+
+    def _apply_levels(self, bids, asks):
+        for price, qty in bids:
+            price = float(price)
+            self._set_level(self.bids, self._bid_prices, price, float(qty), -price)
+        for price, qty in asks:
+            price = float(price)
+            self._set_level(self.asks, self._ask_prices, price, float(qty), price)
+
+    def _reset(self):
+        self.bids.clear()
+        self.asks.clear()
+        self._bid_prices.clear()
+        self._ask_prices.clear()
+
+    def handle_event(self, data):
+        if 'u' not in data:
+            return
+        with self._lock:
+            self.last_event_at = self.clock.time()
+            if not self.synced:
+                self._buffer.append(data)
+                if len(self._buffer) > 1000:
+                    self._buffer.pop(0)
+                if not self._syncing:
+                    self._syncing = True
+                    threading.Thread(target=self._sync, daemon=True).start()
+                return
+            self._apply_event(data)
+
+    def _apply_event(self, data):
+        if data['u'] < self.last_update_id:
+            return
+        if self._awaiting_first:
+            # Sự kiện đầu tiên phải bao trùm lastUpdateId của snapshot
+            if data['U'] > self.last_update_id:
+                self._desync()
+                return
+            self._awaiting_first = False
+        elif data.get('pu') != self.last_update_id:
+            self._desync()
+            return
+        self._apply_levels(data.get('b', ()), data.get('a', ()))
+        self.last_update_id = data['u']
+        self.updates += 1
+
+    def _desync(self):
+        # Hụt sự kiện: bỏ sổ lệnh và đồng bộ lại từ snapshot mới
+        self.synced = False
+        self.resyncs += 1
+        self._buffer = []
+
+    def _sync(self):
+        try:
+            snapshot = binance_api_request(DEPTH_URL, params={"symbol": self.symbol, "limit": self.snapshot_limit})
+            if not snapshot or 'lastUpdateId' not in snapshot:
+                return
+            with self._lock:
+                self._reset()
+                self._apply_levels(snapshot.get('bids', ()), snapshot.get('asks', ()))
+                self.last_update_id = snapshot['lastUpdateId']
+                self._awaiting_first = True
+                self.synced = True
+                buffered, self._buffer = self._buffer, []
+                for event in buffered:
+                    if not self.synced:
+                        break
+                    self._apply_event(event)
+        except Exception as e:
+            logger.error("Lỗi đồng bộ sổ lệnh %s: %s", self.symbol, e, extra={'log_key': f"depth:{self.symbol}"})
+        finally:
+            self._syncing = False
+
+    @property
+    def ready(self):
+        return self.synced and not self._awaiting_first and self.clock.time() - self.last_event_at <= self.max_age \
+            and bool(self._bid_prices) and bool(self._ask_prices)
+
+    def mid_price(self):
+        if not self._bid_prices or not self._ask_prices:
+            return None
+        return (-self._bid_prices[0] + self._ask_prices[0]) / 2
+
+    def _levels(self, side):
+        # Lệnh BUY ăn vào phía ask, SELL ăn vào phía bid
+        if side == "BUY":
+            return self.asks, self._ask_prices, 1
+        return self.bids, self._bid_prices, -1
+
+    def estimate_fill(self, side, qty):
+        """Giá khớp trung bình, độ trượt (bps so với giá giữa) và khối lượng khớp được của lệnh MARKET"""
+        with self._lock:
+            if not self.ready:
+                return None
+            mid = self.mid_price()
+            book, prices, sign = self._levels(side)
+            remaining = qty
+            notional = 0.0
+            for key in prices:
+                price = key * sign
+                take = min(remaining, book[price])
+                notional += take * price
+                remaining -= take
+                if remaining <= 0:
+                    break
+            filled = qty - max(remaining, 0)
+            if filled <= 0:
+                return None
+            avg_price = notional / filled
+            return {
+                'avg_price': avg_price,
+                'impact_bps': (avg_price - mid) / mid * 10000 * (1 if side == "BUY" else -1),
+                'filled_qty': filled,
+                'mid_price': mid
+            }
+
+    def max_qty_within(self, side, max_bps):
+        """Khối lượng lớn nhất khớp được mà không vượt quá max_bps so với giá giữa"""
+        with self._lock:
+            if not self.ready:
+                return None
+            mid = self.mid_price()
+            book, prices, sign = self._levels(side)
+            limit = mid * (1 + sign * max_bps / 10000)
+            total = 0.0
+            for key in prices:
+                price = key * sign
+                if (price - limit) * sign > 0:
+                    break
+                total += book[price]
+            return total
+
+    def stats(self):
+        return {
+            'synced': self.synced,
+            'ready': self.ready,
+            'bid_levels': len(self._bid_prices),
+            'ask_levels': len(self._ask_prices),
+            'updates': self.updates,
+            'resyncs': self.resyncs
+        }
+
+class OrderBookManager:
+    """Sổ lệnh dùng chung theo symbol, mở luồng depth khi có bot giữ symbol và đóng khi không còn ai"""
+
+    def __init__(self, max_slippage_bps=None, clock=None):
+        self.clock = clock or get_clock()
+        self.max_slippage_bps = max_slippage_bps if max_slippage_bps is not None else \
+            float(os.environ.get('MAX_SLIPPAGE_BPS', '30'))
+        self.books = {}
+        self.subscribers = {}
+        self._ws_managers = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _stream_key(symbol):
+        return f"{symbol}@DEPTH"
+
+    def get(self, symbol):
+        return self.books.get(symbol)
+
+    def subscribe(self, ws_manager, symbol):
+        with self._lock:
+            self.subscribers[symbol] = self.subscribers.get(symbol, 0) + 1
+            if self.subscribers[symbol] > 1:
+                return self.books[symbol]
+            book = self.books[symbol] = LocalOrderBook(symbol, clock=self.clock)
+            self._ws_managers[symbol] = ws_manager
+        ws_manager.add_stream(self._stream_key(symbol), f"{symbol.lower()}@depth@{DEPTH_STREAM_SPEED}",
+                              book.handle_event)
+        return book
+
+    def unsubscribe(self, symbol):
+        with self._lock:
+            count = self.subscribers.get(symbol, 0) - 1
+            if count > 0:
+                self.subscribers[symbol] = count
+                return
+            self.subscribers.pop(symbol, None)
+            self.books.pop(symbol, None)
+            ws_manager = self._ws_managers.pop(symbol, None)
+        if ws_manager is not None:
+            try:
+                ws_manager.remove_symbol(self._stream_key(symbol))
+            except Exception:
+                pass
+
+    def limit_qty(self, symbol, side, qty):
+        """Giảm khối lượng về mức khớp được trong giới hạn trượt giá; None nếu chưa có sổ lệnh"""
+        book = self.books.get(symbol)
+        if book is None:
+            return None
+        available = book.max_qty_within(side, self.max_slippage_bps)
+        if available is None:
+            return None
+        return min(qty, available)
+
+    def stats(self):
+        return {
+            'max_slippage_bps': self.max_slippage_bps,
+            'books': {symbol: book.stats() for symbol, book in list(self.books.items())}
+        }
@@ -0,0 +1,332 @@
+import os
+import sys
+import time
+import random
+import bisect
+import itertools
+import logging
+import multiprocessing
+from array import array
+from multiprocessing import shared_memory, util
+from concurrent.futures import ProcessPoolExecutor
+
+from indicators import SMA
+
+logger = logging.getLogger(__name__)
+
+# Các cột được đặt liền nhau trong một vùng shared memory duy nhất
+SERIES_COLUMNS = ('open_time', 'open', 'high', 'low', 'close', 'signal')
+
+DEFAULT_FIB_LEVELS = (200, 300, 500, 800, 1300, 2100, 3400)
+
+# Xếp hạng theo score: cấu hình ít lệnh hơn min_trades bị xếp cuối (return 0 / drawdown 0 không được coi là tốt),
+# drawdown được chặn dưới để vài lệnh may mắn không có drawdown không đẩy score lên vô hạn
+DEFAULT_MIN_TRADES = 10
+DRAWDOWN_FLOOR = 0.05
+
+# Tham số mặc định giống BaseBot
+DEFAULT_PARAMS = {
+    'lev': 10,
+    'percent': 5,
+    'tp': 100,
+    'sl': 0,
+    'roi_trigger': None,
+    'cooldown_period': 3600,
+    'average_down_cooldown': 60,
+    'fib_levels': DEFAULT_FIB_LEVELS,
+    'max_average_down_count': 7
+}
+
+def volume_signals(opens, closes, volumes, period=9):
+    """Tín hiệu của VolumeSignalStrategy cho từng nến đã đóng: 1 = BUY, -1 = SELL, 0 = không có"""
+    signals = array('d', bytes(8 * len(closes)))
+    avg = SMA(period)
+    for i in range(len(closes)):
+        avg.update(volumes[i])
+        if i < period - 1:
+            continue
+        if volumes[i] > volumes[i - 1] * 1.2 and volumes[i] > avg.value * 1.1:
+            if closes[i] > opens[i]:
+                signals[i] = 1
+            elif closes[i] < opens[i]:
+                signals[i] = -1
+    return signals
+
+class SweepData:
+    """Nến và tín hiệu của nhiều symbol, ghép liền trong shared memory để các worker đọc không cần sao chép"""
+
+    def __init__(self, interval_ms):
+        self.interval_ms = interval_ms
+        self.columns = {name: array('d') for name in SERIES_COLUMNS}
+        self.layout = []
+        self.shm = None
+
+    def add_series(self, symbol, columns):
+        start = len(self.columns['open_time'])
+        signals = volume_signals(columns['open'], columns['close'], columns['volume'])
+        for name in SERIES_COLUMNS[:-1]:
+            self.columns[name].extend(array('d', columns[name]))
+        self.columns['signal'].extend(signals)
+        self.layout.append((symbol, start, len(signals)))
+
+    @classmethod
+    def from_cache(cls, cache, symbols, interval, start_ms, end_ms):
+        from strategies import INTERVAL_MS
+        data = cls(INTERVAL_MS[interval])
+        for symbol in symbols:
+            columns = cache.get(symbol, interval, start_ms, end_ms)
+            if len(columns['open_time']) > 10:
+                data.add_series(symbol, columns)
+        return data
+
+    def share(self):
+        total = len(self.columns['open_time'])
+        self.shm = shared_memory.SharedMemory(create=True, size=max(8, total * 8 * len(SERIES_COLUMNS)))
+        view = self.shm.buf.cast('d')
+        for index, name in enumerate(SERIES_COLUMNS):
+            view[index * total:(index + 1) * total] = self.columns[name]
+        view.release()
+        return self.shm.name, total
+
+    def close(self):
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+# Trạng thái trong tiến trình worker: view trên shared memory của tiến trình cha
+_worker = {}
+
+def _init_worker(shm_name, total, layout, interval_ms):
+    try:
+        shm = shared_memory.SharedMemory(name=shm_name, track=False)
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=shm_name)
+    view = shm.buf.cast('d')
+    columns = {name: view[index * total:(index + 1) * total] for index, name in enumerate(SERIES_COLUMNS)}
+    views = [view, *columns.values()]
+    series = []
+    for symbol, start, length in layout:
+        sliced = {name: column[start:start + length] for name, column in columns.items()}
+        views.extend(sliced.values())
+        signal = sliced['signal']
+        # Chỉ số các nến có tín hiệu - khi không có vị thế thì nhảy thẳng tới tín hiệu kế tiếp
+        signal_index = array('l', (i for i in range(length) if signal[i]))
+        signal_times = array('d', (sliced['open_time'][i] for i in signal_index))
+        series.append((symbol, sliced, signal_index, signal_times))
+    _worker.update(shm=shm, views=views, series=series, interval_ms=interval_ms)
+    # Trả các view trước khi đóng segment, nếu không SharedMemory.close() báo BufferError lúc worker thoát
+    util.Finalize(None, _release_worker, exitpriority=10)
+
+def _release_worker():
+    _worker.pop('series', None)
+    for view in reversed(_worker.pop('views', [])):
+        view.release()
+    shm = _worker.pop('shm', None)
+    if shm is not None:
+        shm.close()
+
+def simulate(columns, signal_index, signal_times, params, interval_ms, fee_rate=0.0004):
+    """Mô phỏng một bot trên chuỗi nến theo logic của BaseBot (TP/SL theo ROI, nhồi lệnh theo Fibonacci)"""
+    opens_time, highs, lows, closes, signals = (columns['open_time'], columns['high'], columns['low'],
+                                                 columns['close'], columns['signal'])
+    lev = params['lev']
+    percent = params['percent'] / 100
+    tp = params['tp']
+    sl = params['sl']
+    roi_trigger = params['roi_trigger']
+    cooldown_ms = params['cooldown_period'] * 1000
+    average_cooldown_ms = params['average_down_cooldown'] * 1000
+    fib_levels = params['fib_levels']
+    max_average = min(params['max_average_down_count'], len(fib_levels))
+
+    balance = 1.0
+    peak = 1.0
+    max_drawdown = 0.0
+    trades = wins = average_downs = roi_trigger_hits = 0
+    last_close_time = -float('inf')
+    n = len(closes)
+    i = 0
+    while i < n:
+        # Không có vị thế: tìm nến có tín hiệu sau thời gian chờ
+        k = max(bisect.bisect_left(signal_times, last_close_time + cooldown_ms - interval_ms),
+                bisect.bisect_left(signal_index, i))
+        if k >= len(signal_index):
+            break
+        j = signal_index[k]
+        side = signals[j]
+        entry = entry_base = closes[j]
+        qty = balance * percent * lev / entry
+        balance -= qty * entry * fee_rate
+        count = 0
+        last_average_time = opens_time[j]
+        high_water = 0.0
+        triggered = False
+        exit_price = None
+
+        i = j + 1
+        while i < n:
+            adverse = lows[i] if side > 0 else highs[i]
+            favorable = highs[i] if side > 0 else lows[i]
+            now = opens_time[i] + interval_ms
+
+            if count < max_average and now - last_average_time >= average_cooldown_ms:
+                level_price = entry_base * (1 - side * fib_levels[count] / (100 * lev))
+                if level_price > 0 and side * (adverse - level_price) <= 0:
+                    add_qty = balance * percent * (count + 1) * lev / level_price
+                    entry = (qty * entry + add_qty * level_price) / (qty + add_qty)
+                    qty += add_qty
+                    balance -= add_qty * level_price * fee_rate
+                    count += 1
+                    average_downs += 1
+                    last_average_time = now
+
+            # Lỗ vượt số dư: cháy tài khoản
+            if balance + side * (adverse - entry) * qty <= 0:
+                balance = 0.0
+                max_drawdown = 1.0
+                trades += 1
+                return balance, max_drawdown, trades, wins, average_downs, roi_trigger_hits
+
+            if roi_trigger is not None:
+                roi = side * (favorable - entry) / entry * lev * 100
+                if roi > high_water:
+                    high_water = roi
+                if not triggered and high_water >= roi_trigger:
+                    triggered = True
+                    roi_trigger_hits += 1
+
+            # Giả định bi quan: nếu trong nến chạm cả SL và TP thì tính SL trước
+            if sl:
+                stop_price = entry * (1 - side * sl / (100 * lev))
+                if side * (adverse - stop_price) <= 0:
+                    exit_price = stop_price
+            if exit_price is None and tp is not None:
+                take_price = entry * (1 + side * tp / (100 * lev))
+                if side * (favorable - take_price) >= 0:
+                    exit_price = take_price
+            if exit_price is not None:
+                break
+            i += 1
+
+        if exit_price is None:
+            # Hết dữ liệu khi còn vị thế: đóng theo giá cuối
+            exit_price = closes[n - 1]
+        pnl = side * (exit_price - entry) * qty - qty * exit_price * fee_rate
+        balance += pnl
+        trades += 1
+        if pnl > 0:
+            wins += 1
+        peak = max(peak, balance)
+        max_drawdown = max(max_drawdown, (peak - balance) / peak if peak > 0 else 1.0)
+        last_close_time = opens_time[min(i, n - 1)] + interval_ms
+        i += 1
+
+    return balance, max_drawdown, trades, wins, average_downs, roi_trigger_hits
+
+def _evaluate(configs, fee_rate, min_trades=DEFAULT_MIN_TRADES):
+    results = []
+    interval_ms = _worker['interval_ms']
+    for params in configs:
+        returns = []
+        drawdowns = []
+        totals = [0, 0, 0, 0]
+        for symbol, columns, signal_index, signal_times in _worker['series']:
+            balance, drawdown, *counts = simulate(columns, signal_index, signal_times, params, interval_ms, fee_rate)
+            returns.append(balance - 1)
+            drawdowns.append(drawdown)
+            totals = [a + b for a, b in zip(totals, counts)]
+        if not returns:
+            continue
+        total_return = sum(returns) / len(returns)
+        max_drawdown = max(drawdowns)
+        if totals[0] >= min_trades:
+            score = total_return / max(max_drawdown, DRAWDOWN_FLOOR)
+        else:
+            score = float('-inf')
+        results.append({
+            'params': params,
+            'return': total_return,
+            'max_drawdown': max_drawdown,
+            'score': score,
+            'trades': totals[0],
+            'win_rate': totals[1] / totals[0] if totals[0] else 0,
+            'average_downs': totals[2],
+            'roi_trigger_hits': totals[3]
+        })
+    return results
+
+def grid(space):
+    """Mọi tổ hợp của không gian tham số {tên: [giá trị, ...]}"""
+    names = list(space)
+    for values in itertools.product(*(space[name] for name in names)):
+        yield dict(DEFAULT_PARAMS, **dict(zip(names, values)))
+
+def random_samples(space, count, seed=None):
+    rng = random.Random(seed)
+    for _ in range(count):
+        yield dict(DEFAULT_PARAMS, **{name: rng.choice(values) for name, values in space.items()})
+
+def run_sweep(data, configs, workers=None, chunk_size=16, fee_rate=0.0004, rank_by='score',
+              min_trades=DEFAULT_MIN_TRADES):
+    """Chạy các cấu hình trên process pool, trả về kết quả đã xếp hạng (return cao, drawdown thấp)"""
+    configs = list(configs)
+    shm_name, total = data.share()
+    try:
+        ctx = multiprocessing.get_context('spawn')
+        chunks = [configs[i:i + chunk_size] for i in range(0, len(configs), chunk_size)]
+        results = []
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), mp_context=ctx,
+                                 initializer=_init_worker,
+                                 initargs=(shm_name, total, data.layout, data.interval_ms)) as pool:
+            for chunk_results in pool.map(_evaluate, chunks, itertools.repeat(fee_rate),
+                                          itertools.repeat(min_trades)):
+                results.extend(chunk_results)
+    finally:
+        data.close()
+
+    if rank_by == 'drawdown':
+        results.sort(key=lambda r: (r['max_drawdown'], -r['return']))
+    elif rank_by == 'return':
+        results.sort(key=lambda r: (-r['return'], r['max_drawdown']))
+    else:
+        results.sort(key=lambda r: (-r['score'], r['max_drawdown']))
+    return results
+
+if __name__ == "__main__":
+    import argparse
+    import engine_logging
+    from kline_cache import KlineCache
+
+    parser = argparse.ArgumentParser(description="Quét tham số bot trên dữ liệu klines đã lưu")
+    parser.add_argument('--symbols', nargs='+', required=True)
+    parser.add_argument('--interval', default='5m')
+    parser.add_argument('--days', type=float, default=30)
+    parser.add_argument('--samples', type=int, default=0, help="0 = chạy toàn bộ lưới")
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--top', type=int, default=20)
+    parser.add_argument('--rank-by', default='score', choices=['score', 'return', 'drawdown'])
+    parser.add_argument('--min-trades', type=int, default=DEFAULT_MIN_TRADES,
+                        help="số lệnh tối thiểu để được xếp hạng theo score")
+    args = parser.parse_args()
+
+    engine_logging.setup_logging(None)
+    space = {
+        'lev': [5, 10, 20, 50],
+        'percent': [1, 2, 5, 10],
+        'tp': [20, 50, 100, 200],
+        'sl': [0, 50, 100, 200],
+        'roi_trigger': [None, 50, 100],
+        'cooldown_period': [0, 900, 3600],
+        'average_down_cooldown': [60, 600],
+        'fib_levels': [DEFAULT_FIB_LEVELS, tuple(level // 2 for level in DEFAULT_FIB_LEVELS)]
+    }
+    now = int(time.time() * 1000)
+    data = SweepData.from_cache(KlineCache(), args.symbols, args.interval, now - int(args.days * 86400000), now)
+    configs = random_samples(space, args.samples) if args.samples else grid(space)
+    started = time.time()
+    ranked = run_sweep(data, configs, workers=args.workers, rank_by=args.rank_by, min_trades=args.min_trades)
+    print(f"Đã chạy {len(ranked)} cấu hình trong {time.time() - started:.1f}s", file=sys.stderr)
+    for result in ranked[:args.top]:
+        params = {k: v for k, v in result['params'].items() if k != 'fib_levels'}
+        print(f"return={result['return']:+.2%} dd={result['max_drawdown']:.2%} trades={result['trades']} {params}")
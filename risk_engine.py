@@ -0,0 +1,309 @@
+import os
+import threading
+import logging
+import multiprocessing
+
+from clock import get_clock
+
+logger = logging.getLogger(__name__)
+
+def _env_float(name, default):
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+class RiskLimits:
+    """Giới hạn rủi ro tính theo tỉ lệ vốn (số dư khả dụng + ký quỹ đang dùng); 0 = không giới hạn.
+
+    Mặc định chỉ bật RISK_MAX_MARGIN_RATIO=0.9: tổng ký quỹ (kể cả lệnh đang gửi) không vượt 90% vốn.
+    Bậc nhồi lệnh thứ n dùng percent*(n+1)% số dư khả dụng nên các bậc Fibonacci cuối thường chạm giới hạn này
+    trước khi hết thang - lệnh bị từ chối được ghi log với log_key risk:<lý do>:<symbol> và đếm trong stats().
+    Muốn chạy hết thang thì nâng RISK_MAX_MARGIN_RATIO (tối đa 1) hoặc giảm percent/max_average_down_count."""
+
+    def __init__(self, max_margin_ratio=None, max_gross_leverage=None, max_side_ratio=None,
+                 max_symbol_ratio=None):
+        self.max_margin_ratio = max_margin_ratio if max_margin_ratio is not None else \
+            _env_float('RISK_MAX_MARGIN_RATIO', 0.9)
+        self.max_gross_leverage = max_gross_leverage if max_gross_leverage is not None else \
+            _env_float('RISK_MAX_GROSS_LEVERAGE', 0)
+        self.max_side_ratio = max_side_ratio if max_side_ratio is not None else \
+            _env_float('RISK_MAX_SIDE_RATIO', 0)
+        self.max_symbol_ratio = max_symbol_ratio if max_symbol_ratio is not None else \
+            _env_float('RISK_MAX_SYMBOL_RATIO', 0)
+
+    def to_dict(self):
+        return {
+            'max_margin_ratio': self.max_margin_ratio,
+            'max_gross_leverage': self.max_gross_leverage,
+            'max_side_ratio': self.max_side_ratio,
+            'max_symbol_ratio': self.max_symbol_ratio
+        }
+
+class SharedRiskLedger:
+    """Phần rủi ro mà các shard cùng tài khoản chưa thấy được qua positionRisk của chính mình.
+
+    Mỗi shard ghi vào ô riêng: ký quỹ/notional đang giữ chỗ và của các lệnh đã gửi gần đây. Lệnh gần đây chỉ được
+    bỏ khi mọi shard đã đồng bộ vị thế sau thời điểm đó - trước đó có thể bị tính hai lần (an toàn) chứ không bị
+    bỏ sót. Tạo ở tiến trình cha và truyền vào tiến trình shard qua tham số Process."""
+
+    # margin, notional BUY, notional SELL đang giữ chỗ; margin, BUY, SELL gần đây; thời điểm lệnh gần đây nhất
+    FIELDS = 7
+
+    def __init__(self, shards, ctx=None):
+        ctx = ctx or multiprocessing.get_context('spawn')
+        self.shards = shards
+        self.lock = ctx.RLock()
+        self.slots = ctx.RawArray('d', shards * self.FIELDS)
+        self.synced_at = ctx.RawArray('d', shards)
+
+    def others(self, shard_id):
+        """(margin, notional BUY, notional SELL) của các shard khác - gọi khi giữ lock"""
+        margin = buy = sell = 0.0
+        for shard in range(self.shards):
+            if shard == shard_id:
+                continue
+            base = shard * self.FIELDS
+            margin += self.slots[base] + self.slots[base + 3]
+            buy += self.slots[base + 1] + self.slots[base + 4]
+            sell += self.slots[base + 2] + self.slots[base + 5]
+        return margin, buy, sell
+
+    def publish(self, shard_id, margin, buy, sell, released=None, now=0):
+        """Ghi phần giữ chỗ của shard; released=(margin, BUY, SELL) chuyển sang phần gần đây - gọi khi giữ lock"""
+        base = shard_id * self.FIELDS
+        self.slots[base:base + 3] = [margin, buy, sell]
+        if released:
+            for i, value in enumerate(released):
+                self.slots[base + 3 + i] += value
+            self.slots[base + 6] = now
+
+    def mark_synced(self, shard_id, now):
+        with self.lock:
+            self.synced_at[shard_id] = now
+            oldest = min(self.synced_at)
+            for shard in range(self.shards):
+                base = shard * self.FIELDS
+                if self.slots[base + 6] and oldest > self.slots[base + 6]:
+                    self.slots[base + 3:base + 7] = [0.0, 0.0, 0.0, 0.0]
+
+class RiskEngine:
+    """Sổ rủi ro chung của tài khoản: cộng dồn tăng dần theo từng thay đổi vị thế/giá, kiểm tra trước lệnh O(1)"""
+
+    def __init__(self, limits=None, clock=None, ledger=None, shard_id=0):
+        self.limits = limits or RiskLimits()
+        self.clock = clock or get_clock()
+        self._lock = threading.Lock()
+        # Chạy nhiều shard: giới hạn áp dụng cho cả tài khoản qua sổ dùng chung
+        self.ledger = ledger
+        self.shard_id = shard_id
+        # symbol -> [qty có dấu, giá vào, đòn bẩy, giá đánh dấu]
+        self.positions = {}
+        # bot_id -> (symbol, side, notional, margin) của lệnh đang gửi
+        self.reservations = {}
+        self.equity = None
+        self.balance_at = 0
+        self.positions_at = 0
+        self.notional = {'BUY': 0.0, 'SELL': 0.0}
+        self.cost = {'BUY': 0.0, 'SELL': 0.0}
+        self.margin = {'BUY': 0.0, 'SELL': 0.0}
+        self.count = {'BUY': 0, 'SELL': 0}
+        self.pending_notional = {'BUY': 0.0, 'SELL': 0.0}
+        self.pending_margin = 0.0
+        self.pending_symbol = {}
+        self.checks = 0
+        self.rejections = {}
+
+    @property
+    def margin_used(self):
+        return self.margin['BUY'] + self.margin['SELL']
+
+    def _apply(self, state, sign):
+        qty, entry, lev, mark = state
+        if qty == 0:
+            return
+        side = 'BUY' if qty > 0 else 'SELL'
+        size = abs(qty)
+        self.notional[side] += sign * size * (mark or entry)
+        self.cost[side] += sign * size * entry
+        self.margin[side] += sign * size * entry / (lev or 1)
+        self.count[side] += sign
+
+    def set_position(self, symbol, qty, entry, lev, mark=None):
+        if not symbol:
+            return
+        qty = float(qty or 0)
+        with self._lock:
+            old = self.positions.get(symbol)
+            if old is not None:
+                self._apply(old, -1)
+                mark = mark or old[3]
+            if qty == 0:
+                self.positions.pop(symbol, None)
+                return
+            state = [qty, float(entry or mark or 0), float(lev or 1), float(mark or entry or 0)]
+            self.positions[symbol] = state
+            self._apply(state, 1)
+
+    def on_price(self, symbol, price):
+        state = self.positions.get(symbol)
+        if state is None or price <= 0:
+            return
+        with self._lock:
+            state = self.positions.get(symbol)
+            if state is None:
+                return
+            side = 'BUY' if state[0] > 0 else 'SELL'
+            self.notional[side] += abs(state[0]) * (price - state[3])
+            state[3] = price
+
+    def set_balance(self, available):
+        if available is None:
+            return
+        with self._lock:
+            # Số dư khả dụng của sàn đã trừ ký quỹ - cộng lại để có vốn làm mốc cho các giới hạn
+            self.equity = available + self.margin_used
+            self.balance_at = self.clock.time()
+
+    def sync_positions(self, positions):
+        # Đối chiếu định kỳ với positionRisk để sửa sai lệch và nhận cả vị thế mở ngoài bot
+        seen = set()
+        for pos in positions:
+            qty = float(pos.get('positionAmt', 0))
+            if qty == 0:
+                continue
+            seen.add(pos['symbol'])
+            self.set_position(pos['symbol'], qty, float(pos.get('entryPrice', 0)),
+                              float(pos.get('leverage', 1)), float(pos.get('markPrice', 0) or 0))
+        for symbol in list(self.positions.keys()):
+            if symbol not in seen:
+                self.set_position(symbol, 0, 0, 1)
+        self.positions_at = self.clock.time()
+        if self.ledger is not None:
+            self.ledger.mark_synced(self.shard_id, self.positions_at)
+
+    def available_balance(self, max_age=30):
+        if self.equity is None or self.clock.time() - self.balance_at > max_age:
+            return None
+        return max(self.equity - self.margin_used - self.pending_margin, 0.0)
+
+    def side_summary(self, max_age=30):
+        # Thay cho việc mỗi bot tự tải và cộng lại toàn bộ positionRisk
+        if self.clock.time() - self.positions_at > max_age:
+            return None
+        with self._lock:
+            return {
+                'long_count': self.count['BUY'],
+                'short_count': self.count['SELL'],
+                'long_pnl': self.notional['BUY'] - self.cost['BUY'],
+                'short_pnl': self.cost['SELL'] - self.notional['SELL'],
+                'long_value': self.margin['BUY'],
+                'short_value': self.margin['SELL']
+            }
+
+    def _symbol_notional(self, symbol):
+        state = self.positions.get(symbol)
+        current = abs(state[0]) * (state[3] or state[1]) if state else 0.0
+        return current + self.pending_symbol.get(symbol, 0.0)
+
+    def _reject(self, reason, bot_id, symbol, value, limit):
+        self.rejections[reason] = self.rejections.get(reason, 0) + 1
+        logger.warning("Từ chối lệnh %s của bot %s do giới hạn rủi ro %s: %.2f > %.2f", symbol, bot_id, reason,
+                       value, limit, extra={'log_key': f"risk:{reason}:{symbol}"})
+        return False, reason
+
+    def reserve(self, bot_id, symbol, side, qty, price, lev):
+        """Kiểm tra lệnh tăng vị thế với các giới hạn và giữ chỗ ký quỹ cho tới khi release"""
+        if self.ledger is None:
+            return self._reserve(bot_id, symbol, side, qty, price, lev, (0.0, 0.0, 0.0))
+        with self.ledger.lock:
+            result = self._reserve(bot_id, symbol, side, qty, price, lev, self.ledger.others(self.shard_id))
+            self._publish()
+            return result
+
+    def _reserve(self, bot_id, symbol, side, qty, price, lev, others):
+        notional = abs(qty) * price
+        margin = notional / (lev or 1)
+        limits = self.limits
+        other_margin, other_buy, other_sell = others
+        other_notional = {'BUY': other_buy, 'SELL': other_sell}
+        with self._lock:
+            self.checks += 1
+            equity = self.equity
+            if equity is not None and equity > 0:
+                margin_after = self.margin_used + self.pending_margin + other_margin + margin
+                if margin_after > equity:
+                    return self._reject('insufficient_margin', bot_id, symbol, margin_after, equity)
+                if limits.max_margin_ratio and margin_after > equity * limits.max_margin_ratio:
+                    return self._reject('max_margin_ratio', bot_id, symbol, margin_after,
+                                        equity * limits.max_margin_ratio)
+                gross = (self.notional['BUY'] + self.notional['SELL'] + self.pending_notional['BUY'] +
+                         self.pending_notional['SELL'] + other_buy + other_sell + notional)
+                if limits.max_gross_leverage and gross > equity * limits.max_gross_leverage:
+                    return self._reject('max_gross_leverage', bot_id, symbol, gross,
+                                        equity * limits.max_gross_leverage)
+                side_total = self.notional[side] + self.pending_notional[side] + other_notional[side] + notional
+                if limits.max_side_ratio and side_total > equity * limits.max_side_ratio:
+                    return self._reject('max_side_ratio', bot_id, symbol, side_total, equity * limits.max_side_ratio)
+                symbol_total = self._symbol_notional(symbol) + notional
+                if limits.max_symbol_ratio and symbol_total > equity * limits.max_symbol_ratio:
+                    return self._reject('max_symbol_ratio', bot_id, symbol, symbol_total,
+                                        equity * limits.max_symbol_ratio)
+
+            self._release(bot_id)
+            self.reservations[bot_id] = (symbol, side, notional, margin)
+            self.pending_notional[side] += notional
+            self.pending_margin += margin
+            self.pending_symbol[symbol] = self.pending_symbol.get(symbol, 0.0) + notional
+            return True, None
+
+    def _release(self, bot_id):
+        reservation = self.reservations.pop(bot_id, None)
+        if reservation is None:
+            return None
+        symbol, side, notional, margin = reservation
+        self.pending_notional[side] -= notional
+        self.pending_margin -= margin
+        remaining = self.pending_symbol.get(symbol, 0.0) - notional
+        if remaining > 1e-9:
+            self.pending_symbol[symbol] = remaining
+        else:
+            self.pending_symbol.pop(symbol, None)
+        return reservation
+
+    def release(self, bot_id):
+        if self.ledger is None:
+            with self._lock:
+                self._release(bot_id)
+            return
+        with self.ledger.lock:
+            with self._lock:
+                reservation = self._release(bot_id)
+            released = None
+            if reservation is not None:
+                # Không biết lệnh đã khớp hay chưa: giữ như lệnh gần đây tới khi mọi shard đồng bộ vị thế
+                _, side, notional, margin = reservation
+                released = (margin, notional if side == 'BUY' else 0.0, notional if side == 'SELL' else 0.0)
+            self._publish(released)
+
+    def _publish(self, released=None):
+        # Gọi khi giữ ledger.lock
+        with self._lock:
+            self.ledger.publish(self.shard_id, self.pending_margin, self.pending_notional['BUY'],
+                                self.pending_notional['SELL'], released, self.clock.time())
+
+    def stats(self):
+        with self._lock:
+            return {
+                'equity': self.equity,
+                'margin_used': self.margin_used,
+                'pending_margin': self.pending_margin,
+                'long_notional': self.notional['BUY'],
+                'short_notional': self.notional['SELL'],
+                'long_count': self.count['BUY'],
+                'short_count': self.count['SELL'],
+                'symbols': len(self.positions),
+                'checks': self.checks,
+                'rejections': dict(self.rejections),
+                'limits': self.limits.to_dict()
+            }
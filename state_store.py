@@ -0,0 +1,125 @@
+import json
+import time
+import sqlite3
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+class BatchWriter:
+    """Gom các thao tác ghi và thực hiện trong một transaction trên thread nền"""
+
+    def __init__(self, conn, flush_interval=1.0):
+        self.conn = conn
+        self.flush_interval = flush_interval
+        self._pending = []
+        self._flush_hooks = []
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def enqueue(self, op):
+        with self._lock:
+            self._pending.append(op)
+
+    def add_flush_hook(self, hook):
+        # hook(conn) được gọi trong cùng transaction ở mỗi lần flush
+        self._flush_hooks.append(hook)
+
+    def _take_pending(self):
+        with self._lock:
+            ops, self._pending = self._pending, []
+        return ops
+
+    def _write(self, ops):
+        try:
+            with self._write_lock, self.conn:
+                for op in ops:
+                    op(self.conn)
+                for hook in self._flush_hooks:
+                    hook(self.conn)
+        except Exception as e:
+            logger.error(f"Lỗi ghi dữ liệu ({len(ops)} thao tác): {str(e)}")
+
+    def _loop(self):
+        while not self._stopped:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self._write(self._take_pending())
+
+    def flush(self):
+        self._write(self._take_pending())
+
+    def close(self):
+        self._stopped = True
+        self._wakeup.set()
+        self._thread.join(timeout=5)
+        self.flush()
+
+def open_database(path):
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+class StateStore:
+    """Lưu cấu hình và trạng thái bot vào SQLite (WAL) để khởi động lại nhanh"""
+
+    def __init__(self, path="bot_state.db", flush_interval=1.0):
+        self.path = path
+        self.conn = open_database(path)
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS bots ("
+                "bot_id TEXT PRIMARY KEY, state TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+        self._dirty = {}
+        self._lock = threading.Lock()
+        self.writer = BatchWriter(self.conn, flush_interval)
+        self.writer.add_flush_hook(self._write_dirty)
+
+    def mark_dirty(self, bot_id, state_fn):
+        # Chỉ giữ hàm lấy trạng thái, việc dựng dict và ghi diễn ra lúc flush
+        with self._lock:
+            self._dirty[bot_id] = state_fn
+
+    def delete_bot(self, bot_id):
+        with self._lock:
+            self._dirty[bot_id] = None
+
+    def _write_dirty(self, conn):
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+        now = time.time()
+        for bot_id, state_fn in dirty.items():
+            if state_fn is None:
+                conn.execute("DELETE FROM bots WHERE bot_id = ?", (bot_id,))
+                continue
+            try:
+                state = json.dumps(state_fn())
+            except Exception as e:
+                logger.error(f"Lỗi lấy trạng thái bot {bot_id}: {str(e)}")
+                continue
+            conn.execute(
+                "INSERT INTO bots (bot_id, state, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(bot_id) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at",
+                (bot_id, state, now)
+            )
+
+    def load_bots(self):
+        self.writer.flush()
+        rows = self.conn.execute("SELECT bot_id, state FROM bots").fetchall()
+        records = []
+        for bot_id, state in rows:
+            try:
+                records.append(json.loads(state))
+            except Exception:
+                logger.error(f"Bỏ qua trạng thái bot hỏng: {bot_id}")
+        return records
+
+    def close(self):
+        self.writer.close()
+        self.conn.close()
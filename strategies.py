@@ -0,0 +1,243 @@
+import threading
+import logging
+from collections import deque
+
+from binance_client import binance_api_request
+from indicators import SMA, EMA, RSI, ATR, VWAP, ZScore
+from clock import get_clock
+
+logger = logging.getLogger(__name__)
+
+KLINES_URL = "https://fapi.binance.com/fapi/v1/klines"
+INTERVAL_MS = {
+    '1m': 60000, '3m': 180000, '5m': 300000, '15m': 900000, '30m': 1800000,
+    '1h': 3600000, '2h': 7200000, '4h': 14400000, '1d': 86400000
+}
+
+# Cách đưa một nến (open_time, open, high, low, close, volume) vào từng loại chỉ báo
+def feed_close(indicator, candle):
+    indicator.update(candle[4])
+
+def feed_volume(indicator, candle):
+    indicator.update(candle[5])
+
+def feed_hlc(indicator, candle):
+    indicator.update(candle[2], candle[3], candle[4])
+
+def feed_typical_price(indicator, candle):
+    indicator.update((candle[2] + candle[3] + candle[4]) / 3, candle[5])
+
+class CandleSeries:
+    """Chuỗi nến đã đóng của một symbol/khung thời gian, dùng chung giữa các bot và chiến lược"""
+
+    def __init__(self, symbol, interval, maxlen=200):
+        self.symbol = symbol
+        self.interval = interval
+        self.interval_ms = INTERVAL_MS[interval]
+        self.candles = deque(maxlen=maxlen)
+        self.last_open_time = 0
+        self.indicators = {}
+        self.lock = threading.RLock()
+        self.subscribers = 0
+        self.ws_manager = None
+        self.rest_refreshes = 0
+        self.stream_candles = 0
+
+    @property
+    def live(self):
+        return self.subscribers > 0
+
+    def indicator(self, key, factory, feed):
+        # Chỉ báo trùng key được tạo một lần và cập nhật chung cho mọi chiến lược
+        with self.lock:
+            entry = self.indicators.get(key)
+            if entry is None:
+                indicator = factory()
+                for candle in self.candles:
+                    feed(indicator, candle)
+                entry = self.indicators[key] = [indicator, factory, feed]
+            return entry[0]
+
+    def _reset(self):
+        self.candles.clear()
+        self.last_open_time = 0
+        for entry in self.indicators.values():
+            entry[0] = entry[1]()
+
+    def add_candle(self, candle):
+        with self.lock:
+            if candle[0] <= self.last_open_time:
+                return False
+            # Bị hụt nến: chỉ báo không còn liên tục nên tính lại từ đầu
+            if self.last_open_time and candle[0] != self.last_open_time + self.interval_ms:
+                self._reset()
+            self.candles.append(candle)
+            self.last_open_time = candle[0]
+            for indicator, _, feed in self.indicators.values():
+                feed(indicator, candle)
+            return True
+
+    def is_fresh(self, now_ms=None):
+        now_ms = now_ms or int(get_clock().time() * 1000)
+        # Nến đang chạy sau nến cuối cùng đã đóng chưa kết thúc thì dữ liệu vẫn còn mới
+        grace = 5000 if self.live else 0
+        return self.last_open_time and now_ms < self.last_open_time + 2 * self.interval_ms + grace
+
+    def ensure_fresh(self, limit):
+        if self.is_fresh() and len(self.candles) >= limit:
+            return True
+        data = binance_api_request(KLINES_URL, params={
+            "symbol": self.symbol, "interval": self.interval, "limit": limit + 1
+        })
+        if not data:
+            return False
+        self.rest_refreshes += 1
+        with self.lock:
+            if len(self.candles) < limit:
+                self._reset()
+            # Phần tử cuối là nến chưa đóng
+            for k in data[:-1]:
+                self.add_candle((int(k[0]), float(k[1]), float(k[2]), float(k[3]), float(k[4]), float(k[5])))
+        return True
+
+    def handle_kline(self, data):
+        k = data.get('k')
+        if not k or not k.get('x'):
+            return
+        if self.add_candle((int(k['t']), float(k['o']), float(k['h']), float(k['l']), float(k['c']), float(k['v']))):
+            self.stream_candles += 1
+
+class CandleRegistry:
+    def __init__(self):
+        self.series_map = {}
+        self._lock = threading.Lock()
+
+    def get(self, symbol, interval):
+        key = (symbol, interval)
+        series = self.series_map.get(key)
+        if series is None:
+            with self._lock:
+                series = self.series_map.setdefault(key, CandleSeries(symbol, interval))
+        return series
+
+    @staticmethod
+    def _stream_key(symbol, interval):
+        return f"{symbol}@KLINE_{interval.upper()}"
+
+    def subscribe(self, ws_manager, symbol, interval):
+        series = self.get(symbol, interval)
+        with self._lock:
+            series.subscribers += 1
+            if series.subscribers > 1:
+                return series
+            series.ws_manager = ws_manager
+        try:
+            ws_manager.add_stream(self._stream_key(symbol, interval),
+                                  f"{symbol.lower()}@kline_{interval}", series.handle_kline)
+        except Exception as e:
+            logger.error("Không thể mở luồng nến %s %s: %s", symbol, interval, e,
+                         extra={'log_key': f"kline:{symbol}"})
+        return series
+
+    def unsubscribe(self, symbol, interval):
+        series = self.series_map.get((symbol, interval))
+        if series is None:
+            return
+        with self._lock:
+            if series.subscribers <= 0:
+                return
+            series.subscribers -= 1
+            if series.subscribers:
+                return
+            ws_manager, series.ws_manager = series.ws_manager, None
+        try:
+            ws_manager.remove_symbol(self._stream_key(symbol, interval))
+        except Exception:
+            pass
+
+    def stats(self):
+        series_list = list(self.series_map.values())
+        return {
+            'series': len(series_list),
+            'live': sum(1 for s in series_list if s.live),
+            'rest_refreshes': sum(s.rest_refreshes for s in series_list),
+            'stream_candles': sum(s.stream_candles for s in series_list)
+        }
+
+candle_registry = CandleRegistry()
+
+class Strategy:
+    """Giao diện chiến lược: trả về tín hiệu BUY/SELL/None cho một symbol từ các chỉ báo dùng chung"""
+
+    interval = '5m'
+    # Số nến đã đóng tối thiểu để tính tín hiệu
+    warmup = 30
+
+    def __init__(self, registry=None):
+        self.registry = registry or candle_registry
+
+    def series(self, symbol):
+        series = self.registry.get(symbol, self.interval)
+        series.ensure_fresh(self.warmup)
+        return series
+
+    def subscribe(self, ws_manager, symbol):
+        return self.registry.subscribe(ws_manager, symbol, self.interval)
+
+    def unsubscribe(self, symbol):
+        self.registry.unsubscribe(symbol, self.interval)
+
+    # Các chỉ báo thường dùng - key gồm tham số để chiến lược khác nhau dùng chung được
+    def sma(self, series, period, feed=feed_close):
+        return series.indicator(('sma', period, feed.__name__), lambda: SMA(period), feed)
+
+    def ema(self, series, period, feed=feed_close):
+        return series.indicator(('ema', period, feed.__name__), lambda: EMA(period), feed)
+
+    def rsi(self, series, period=14):
+        return series.indicator(('rsi', period), lambda: RSI(period), feed_close)
+
+    def atr(self, series, period=14):
+        return series.indicator(('atr', period), lambda: ATR(period), feed_hlc)
+
+    def vwap(self, series, period=None):
+        return series.indicator(('vwap', period), lambda: VWAP(period), feed_typical_price)
+
+    def volume_zscore(self, series, period=20):
+        return series.indicator(('volume_zscore', period), lambda: ZScore(period), feed_volume)
+
+    def signal(self, symbol):
+        raise NotImplementedError
+
+class VolumeSignalStrategy(Strategy):
+    """Nến vừa đóng có khối lượng tăng mạnh so với nến trước và trung bình: đi theo màu nến"""
+
+    interval = '5m'
+    warmup = 9
+
+    def signal(self, symbol):
+        try:
+            series = self.series(symbol)
+            with series.lock:
+                avg_volume = self.sma(series, self.warmup, feed_volume)
+                if len(series.candles) < self.warmup or not avg_volume.ready:
+                    return None
+                current_candle = series.candles[-1]
+                prev_candle = series.candles[-2]
+                avg = avg_volume.value
+
+            _, open_price, _, _, close_price, current_volume = current_candle
+            prev_volume = prev_candle[5]
+
+            volume_increase = current_volume > prev_volume * 1.2
+            volume_above_average = current_volume > avg * 1.1
+
+            if volume_increase and volume_above_average:
+                if close_price > open_price:
+                    return "BUY"
+                elif close_price < open_price:
+                    return "SELL"
+            return None
+
+        except Exception:
+            return None
@@ -0,0 +1,16 @@
+import os
+import sys
+
+import pytest
+
+# Các module nằm phẳng ở thư mục gốc của repo
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import clock as clock_module
+from clock import VirtualClock
+
+@pytest.fixture
+def virtual_clock(monkeypatch):
+    clock = VirtualClock(seed=7)
+    monkeypatch.setattr(clock_module, '_clock', clock)
+    return clock
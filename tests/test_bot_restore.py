@@ -0,0 +1,47 @@
+import bot_core
+import clock as clock_module
+from clock import VirtualClock
+
+class FakeWebSocketManager:
+    def add_symbol(self, *args):
+        pass
+
+    def add_stream(self, *args, **kwargs):
+        pass
+
+    def remove_symbol(self, *args):
+        pass
+
+PERSISTED = {'symbol': 'AAAUSDC', 'status': 'open', 'side': 'BUY', 'qty': 2.0, 'entry': 100.0,
+             'entry_base': 100.0, 'average_down_count': 1, 'last_side': 'BUY', 'is_first_trade': False}
+
+def restore(monkeypatch, positions):
+    clock = VirtualClock()
+    monkeypatch.setattr(clock_module, '_clock', clock)
+    cancels = []
+    monkeypatch.setattr(bot_core, 'cancel_all_orders', lambda symbol, *a: cancels.append(symbol) or True)
+    monkeypatch.setattr(bot_core, 'get_positions', lambda *a, **k: None)
+    # Chỉ kiểm tra bước khôi phục trong constructor, vòng lặp giao dịch không chạy
+    monkeypatch.setattr(bot_core.BaseBot, '_loop', lambda self: None)
+    bot = bot_core.GlobalMarketBot('AAAUSDC', 10, 5, 50, 100, None, FakeWebSocketManager(), 'k', 's',
+                                   bot_id='bot1', restored_state=dict(PERSISTED), positions=positions,
+                                   clock=clock)
+    bot.thread.join(5)
+    return bot, cancels
+
+def test_restore_cancels_resting_orders_when_position_closed_while_down(monkeypatch):
+    bot, cancels = restore(monkeypatch, {})
+    assert not bot.position_open
+    assert bot.status == 'waiting'
+    assert cancels == ['AAAUSDC']
+
+def test_restore_keeps_orders_of_open_position(monkeypatch):
+    position = {'symbol': 'AAAUSDC', 'positionAmt': '2', 'entryPrice': '100'}
+    bot, cancels = restore(monkeypatch, {'AAAUSDC': position})
+    assert bot.position_open and bot.qty == 2
+    assert cancels == []
+
+def test_restore_trusts_saved_state_when_positions_unknown(monkeypatch):
+    bot, cancels = restore(monkeypatch, None)
+    assert bot.position_open and bot.average_down_count == 1
+    assert cancels == []
@@ -0,0 +1,47 @@
+from binance_client import CircuitBreaker
+
+def test_opens_after_threshold_and_recovers_through_half_open(virtual_clock):
+    breaker = CircuitBreaker('test', failure_threshold=3, base_delay=1.0, max_delay=60.0)
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED and breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert 0.5 <= breaker.open_delay <= 1.5
+    assert not breaker.allow()
+    assert breaker.rejected == 1
+
+    virtual_clock.advance(breaker.open_delay + 0.01)
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert (breaker.failures, breaker.trips) == (0, 0)
+
+def test_half_open_failure_reopens_with_longer_delay(virtual_clock):
+    breaker = CircuitBreaker('test', failure_threshold=1, base_delay=1.0, max_delay=60.0)
+    breaker.record_failure()
+    virtual_clock.advance(breaker.open_delay + 0.01)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.trips == 2
+    assert 1.0 <= breaker.open_delay <= 3.0
+
+def test_open_delay_never_exceeds_max_delay(virtual_clock):
+    breaker = CircuitBreaker('test', failure_threshold=1, base_delay=1.0, max_delay=8.0)
+    for _ in range(20):
+        breaker.record_failure()
+        assert breaker.open_delay <= 8.0
+
+def test_retry_after_opens_immediately_and_sets_minimum_delay(virtual_clock):
+    breaker = CircuitBreaker('test', failure_threshold=5, base_delay=1.0, max_delay=60.0)
+    breaker.record_failure(retry_after=30)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.open_delay == 30
+    virtual_clock.advance(29)
+    assert not breaker.allow()
+    virtual_clock.advance(1)
+    assert breaker.allow()
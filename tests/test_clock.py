@@ -0,0 +1,166 @@
+import math
+import threading
+import time
+
+import bot_core
+import clock as clock_module
+from clock import VirtualClock
+
+class FakeExchange:
+    """Sàn giả: giá là hàm của thời gian ảo, lệnh MARKET khớp ngay tại giá hiện tại"""
+
+    def __init__(self, clock, symbols):
+        self.clock = clock
+        self.start = clock.time()
+        self.symbols = symbols
+        self.positions = {}
+        self.events = []
+
+    def price(self, symbol):
+        phase = self.symbols.index(symbol)
+        return 100 * (1 + 0.12 * math.sin((self.clock.time() - self.start) / 3600 + phase))
+
+    def get_positions(self, symbol=None, api_key=None, api_secret=None):
+        result = [{'symbol': 'OTHERUSDC', 'positionAmt': '1', 'unRealizedProfit': '5',
+                   'entryPrice': '1', 'leverage': '1'}]
+        for s, (qty, entry) in self.positions.items():
+            result.append({'symbol': s, 'positionAmt': str(qty), 'entryPrice': str(entry),
+                           'unRealizedProfit': '0', 'leverage': '10'})
+        return [p for p in result if symbol is None or p['symbol'] == symbol]
+
+    def place_order(self, symbol, side, qty, api_key, api_secret):
+        price = self.price(symbol)
+        old_qty, entry = self.positions.get(symbol, (0.0, 0.0))
+        delta = qty if side == 'BUY' else -qty
+        new_qty = old_qty + delta
+        if abs(new_qty) < 1e-12:
+            self.positions.pop(symbol, None)
+        elif old_qty == 0 or (old_qty > 0) == (delta > 0):
+            self.positions[symbol] = (new_qty, (entry * abs(old_qty) + price * qty) / abs(new_qty))
+        else:
+            self.positions[symbol] = (new_qty, entry)
+        self.events.append((self.clock.time(), symbol, side, round(qty, 6), round(price, 6)))
+        return {'orderId': len(self.events), 'executedQty': str(qty), 'avgPrice': str(price)}
+
+class FakeWebSocketManager:
+    def add_symbol(self, *args):
+        pass
+
+    def add_stream(self, *args, **kwargs):
+        pass
+
+    def remove_symbol(self, *args):
+        pass
+
+class RecordingJournal:
+    def __init__(self, clock):
+        self.clock = clock
+        self.entries = []
+
+    def record_entry(self, trade_id, *args):
+        self.entries.append((trade_id, self.clock.time()))
+
+    def record_average_down(self, *args):
+        pass
+
+    def record_exit(self, *args, **kwargs):
+        pass
+
+class AlwaysBuy:
+    def signal(self, symbol):
+        return 'BUY'
+
+    def subscribe(self, *args):
+        pass
+
+    def unsubscribe(self, *args):
+        pass
+
+def replay_day(monkeypatch, seconds=86400):
+    clock = VirtualClock(seed=7)
+    monkeypatch.setattr(clock_module, '_clock', clock)
+    symbols = ['AAAUSDC', 'BBBUSDC']
+    exchange = FakeExchange(clock, symbols)
+    monkeypatch.setattr(bot_core, 'get_positions', exchange.get_positions)
+    monkeypatch.setattr(bot_core, 'place_order', exchange.place_order)
+    monkeypatch.setattr(bot_core, 'get_current_price', lambda symbol, *a, **k: exchange.price(symbol))
+    monkeypatch.setattr(bot_core, 'set_leverage', lambda *a: True)
+    monkeypatch.setattr(bot_core, 'get_balance', lambda *a: 1000.0)
+    monkeypatch.setattr(bot_core, 'get_step_size', lambda *a: 0.001)
+    monkeypatch.setattr(bot_core, 'cancel_all_orders', lambda *a: True)
+    monkeypatch.setattr(bot_core.SmartCoinFinder, 'get_symbol_leverage', lambda self, symbol: 50)
+
+    journal = RecordingJournal(clock)
+    bots = [bot_core.GlobalMarketBot(symbol, 10, 5, 50, 100, None, FakeWebSocketManager(), 'k', 's',
+                                     positions={}, strategy=AlwaysBuy(), journal=journal, clock=clock)
+            for symbol in symbols]
+    started = time.monotonic()
+    clock.run_for(seconds)
+    elapsed = time.monotonic() - started
+    state = [(bot.bot_id, bot.status, bot.qty, bot.average_down_count) for bot in bots]
+    for bot in bots:
+        bot.signal_stop()
+    for bot in bots:
+        bot.thread.join(5)
+    assert not any(bot.thread.is_alive() for bot in bots)
+    return exchange.events, state, elapsed, journal
+
+def test_virtual_clock_advances_without_waiting():
+    clock = VirtualClock(start=0)
+    started = time.monotonic()
+    clock.sleep(3600)
+    assert clock.time() == 3600
+    assert time.monotonic() - started < 1
+
+def test_participants_wake_in_deadline_order():
+    clock = VirtualClock(start=0)
+    order = []
+
+    def worker(name, delays, ticket):
+        with clock.participant(ticket):
+            for delay in delays:
+                clock.sleep(delay)
+                order.append((clock.time(), name))
+
+    threads = [threading.Thread(target=worker, args=(name, delays, clock.register()))
+               for name, delays in (('a', [10, 10, 10]), ('b', [5, 15, 10]), ('c', [10, 20]))]
+    for thread in threads:
+        thread.start()
+    clock.run_until(100)
+    for thread in threads:
+        thread.join(5)
+    # Cùng thời điểm thì luồng xếp hàng trước chạy trước
+    assert order == [(5, 'b'), (10, 'a'), (10, 'c'), (20, 'b'), (20, 'a'), (30, 'c'), (30, 'b'), (30, 'a')]
+    assert clock.time() == 100
+
+def test_run_until_stops_at_horizon():
+    clock = VirtualClock(start=0)
+    ticks = []
+    stop = threading.Event()
+
+    def worker(ticket):
+        with clock.participant(ticket):
+            while not clock.wait(stop, 60):
+                ticks.append(clock.time())
+
+    thread = threading.Thread(target=worker, args=(clock.register(),))
+    thread.start()
+    clock.run_until(300)
+    assert ticks == [60, 120, 180, 240, 300]
+    stop.set()
+    thread.join(5)
+    assert not thread.is_alive()
+
+def test_bot_day_replays_quickly_and_deterministically(monkeypatch):
+    first, first_state, elapsed, journal = replay_day(monkeypatch)
+    second, second_state, _, second_journal = replay_day(monkeypatch)
+    assert len(first) > 10
+    assert elapsed < 30
+    assert first == second
+    assert first_state == second_state
+    assert journal.entries == second_journal.entries
+    # Mã lệnh lấy theo đồng hồ ảo, không theo giờ thật
+    trade_ids = [event[0] for event in journal.entries]
+    assert trade_ids
+    for trade_id, ts in zip(trade_ids, (event[1] for event in journal.entries)):
+        assert int(trade_id.rsplit('-', 1)[1]) == int(ts * 1000)
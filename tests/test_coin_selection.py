@@ -0,0 +1,100 @@
+import threading
+
+import pytest
+
+import bot_core
+import clock as clock_module
+from bot_core import CoinManager, EligibleUniverse, SmartCoinFinder
+from clock import VirtualClock
+
+def exchange_info(*entries):
+    return {'symbols': [
+        {'symbol': symbol, 'status': status,
+         'filters': [{'filterType': 'LEVERAGE', 'maxLeverage': str(max_lev)}]}
+        for symbol, max_lev, status in entries
+    ]}
+
+@pytest.fixture
+def universe(monkeypatch):
+    monkeypatch.setattr(clock_module, '_clock', VirtualClock())
+    universe = EligibleUniverse(refresh_interval=3600)
+    universe.update(exchange_info(('AUSDC', 20, 'TRADING'), ('BUSDC', 50, 'TRADING'),
+                                  ('CUSDC', 75, 'BREAK'), ('DUSDT', 125, 'TRADING')))
+    return universe
+
+class FixedSignals:
+    def __init__(self, signals):
+        self.signals = signals
+
+    def signal(self, symbol):
+        return self.signals.get(symbol)
+
+def test_try_claim_gives_each_symbol_to_one_caller():
+    manager = CoinManager()
+    winners = []
+    barrier = threading.Barrier(8)
+
+    def claim():
+        barrier.wait()
+        if manager.try_claim('btcusdc'):
+            winners.append(threading.get_ident())
+
+    threads = [threading.Thread(target=claim) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(winners) == 1
+    assert manager.is_coin_active('BTCUSDC')
+    manager.unregister_coin('BTCUSDC')
+    assert manager.try_claim('BTCUSDC')
+    assert not manager.try_claim('')
+
+def test_universe_buckets_by_leverage_and_status(universe):
+    assert universe.candidates(10) == {'AUSDC', 'BUSDC'}
+    assert universe.candidates(25) == {'BUSDC'}
+    assert universe.candidates(10, excluded={'BUSDC'}) == {'AUSDC'}
+    assert universe.candidates(10, status='BREAK') == {'CUSDC'}
+    assert universe.max_leverage('ausdc') == 20
+    assert universe.max_leverage('DUSDT') is None
+
+def test_universe_update_applies_only_the_diff(universe):
+    universe.update(exchange_info(('AUSDC', 20, 'BREAK'), ('BUSDC', 50, 'TRADING'), ('EUSDC', 10, 'TRADING')))
+    assert set(universe.symbols) == {'AUSDC', 'BUSDC', 'EUSDC'}
+    assert universe.candidates(10) == {'BUSDC', 'EUSDC'}
+    assert 'CUSDC' not in universe.by_leverage[75]
+    assert 'AUSDC' not in universe.by_status['TRADING']
+
+def test_find_best_coin_skips_positions_and_claims_first_match(universe, monkeypatch):
+    monkeypatch.setattr(bot_core, 'get_positions', lambda *a, **k: [
+        {'symbol': 'AUSDC', 'positionAmt': '1'}, {'symbol': 'BUSDC', 'positionAmt': '0'}])
+    finder = SmartCoinFinder('key', 'secret', universe=universe,
+                             strategy=FixedSignals({'AUSDC': 'BUY', 'BUSDC': 'BUY'}))
+    manager = CoinManager()
+    assert finder.find_best_coin('BUY', required_leverage=10, claim=manager.try_claim) == 'BUSDC'
+    assert manager.get_active_coins() == ['BUSDC']
+    assert finder.find_best_coin('BUY', required_leverage=10, claim=manager.try_claim) is None
+    assert finder.find_best_coin('SELL', required_leverage=10) is None
+
+def test_find_best_coin_gives_up_when_positions_are_unknown(universe, monkeypatch):
+    monkeypatch.setattr(bot_core, 'get_positions', lambda *a, **k: None)
+    finder = SmartCoinFinder('key', 'secret', universe=universe, strategy=FixedSignals({'BUSDC': 'BUY'}))
+    assert finder.find_best_coin('BUY', required_leverage=10) is None
+
+def test_shard_coin_managers_never_claim_the_same_symbol(universe, monkeypatch):
+    monkeypatch.setattr(bot_core, 'get_positions', lambda *a, **k: [])
+    symbols = [f"S{i}USDC" for i in range(40)]
+    managers = [CoinManager(shard, 3) for shard in range(3)]
+    for symbol in symbols:
+        owners = [manager for manager in managers if manager.try_claim(symbol)]
+        assert len(owners) == 1
+        assert owners[0].shard_id == bot_core.shard_for_symbol(symbol, 3)
+
+    finder = SmartCoinFinder('key', 'secret', universe=universe,
+                             strategy=FixedSignals({'AUSDC': 'BUY', 'BUSDC': 'BUY'}))
+    fresh = [CoinManager(shard, 3) for shard in range(3)]
+    found = [finder.find_best_coin('BUY', required_leverage=10, claim=m.try_claim, symbol_filter=m.owns)
+             for m in fresh]
+    for manager, symbol in zip(fresh, found):
+        owned = {s for s in ('AUSDC', 'BUSDC') if manager.owns(s)}
+        assert (symbol in owned) if owned else symbol is None
@@ -0,0 +1,70 @@
+import threading
+import time
+
+import pytest
+
+import binance_client
+import bot_core
+import main
+
+class FakeManager:
+    built = []
+
+    def __init__(self, api_key, api_secret, **kwargs):
+        self.api_key = api_key
+        self.api_secret = api_secret
+        self.calls = []
+        FakeManager.built.append(self)
+        # Dựng manager chậm để hai lần kết nối chồng lên nhau
+        time.sleep(0.05)
+
+    def get_system_info(self):
+        return {'balance': 100.0}
+
+    def restore_bots(self):
+        self.calls.append('restore')
+        return 0
+
+    def stop_all(self):
+        self.calls.append('stop_all')
+
+    def close(self, deadline=None):
+        self.calls.append('close')
+
+@pytest.fixture
+def connect(monkeypatch, tmp_path):
+    FakeManager.built = []
+    monkeypatch.setattr(bot_core, 'BotManager', FakeManager)
+    monkeypatch.setattr(binance_client, 'get_balance', lambda *a: 100.0)
+    monkeypatch.setattr(main, 'BOT_SHARDS', 1)
+    monkeypatch.setattr(main, 'STATE_DB_PATH', str(tmp_path / 'state.db'))
+    monkeypatch.setattr(main, 'TRADE_DB_PATH', str(tmp_path / 'trades.db'))
+    monkeypatch.setattr(main, 'bot_manager', None)
+    monkeypatch.setattr(main, 'state_store', None)
+    monkeypatch.setattr(main, 'trade_journal', None)
+    yield main._connect_manager
+    for store in (main.state_store, main.trade_journal):
+        if store is not None:
+            store.close()
+
+def test_concurrent_connects_with_same_key_build_one_manager(connect):
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(connect('key', 'secret'))) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert len(FakeManager.built) == 1
+    assert results == [FakeManager.built[0]] * 2
+    assert FakeManager.built[0].calls == ['restore']
+
+def test_same_key_new_secret_keeps_persisted_bots(connect):
+    first = connect('key', 'secret')
+    second = connect('key', 'rotated')
+    assert second is not first
+    assert first.calls == ['restore', 'close']
+
+def test_switching_account_stops_old_bots(connect):
+    first = connect('key', 'secret')
+    connect('other', 'secret')
+    assert first.calls == ['restore', 'stop_all', 'close']
@@ -0,0 +1,95 @@
+import math
+import random
+
+import pytest
+
+from indicators import ATR, EMA, RSI, SMA, VWAP, ZScore
+
+@pytest.fixture
+def closes():
+    rng = random.Random(42)
+    price = 100.0
+    values = []
+    for _ in range(300):
+        price *= 1 + rng.gauss(0, 0.01)
+        values.append(price)
+    return values
+
+def test_sma_matches_window_mean(closes):
+    sma = SMA(20)
+    for i, x in enumerate(closes):
+        value = sma.update(x)
+        window = closes[max(0, i - 19):i + 1]
+        assert value == pytest.approx(sum(window) / len(window))
+        assert sma.ready == (i >= 19)
+
+def test_ema_matches_recursive_definition(closes):
+    ema = EMA(10)
+    alpha = 2 / 11
+    expected = None
+    for i, x in enumerate(closes):
+        expected = x if expected is None else alpha * x + (1 - alpha) * expected
+        assert ema.update(x) == pytest.approx(expected)
+        assert ema.ready == (i >= 9)
+
+def wilder_rsi(closes, period):
+    changes = [b - a for a, b in zip(closes, closes[1:])]
+    gains = [max(c, 0) for c in changes]
+    losses = [max(-c, 0) for c in changes]
+    avg_gain = sum(gains[:period]) / period
+    avg_loss = sum(losses[:period]) / period
+    values = [100 - 100 / (1 + avg_gain / avg_loss)]
+    for gain, loss in zip(gains[period:], losses[period:]):
+        avg_gain = (avg_gain * (period - 1) + gain) / period
+        avg_loss = (avg_loss * (period - 1) + loss) / period
+        values.append(100 - 100 / (1 + avg_gain / avg_loss))
+    return values
+
+def test_rsi_matches_wilder(closes):
+    rsi = RSI(14)
+    values = [rsi.update(x) for x in closes]
+    assert values[:14] == [None] * 14
+    assert values[14:] == pytest.approx(wilder_rsi(closes, 14))
+
+def test_rsi_without_losses_is_100():
+    rsi = RSI(3)
+    for x in (1, 2, 3, 4):
+        value = rsi.update(x)
+    assert value == 100.0
+
+def test_atr_uses_true_range_with_wilder_smoothing():
+    atr = ATR(3)
+    candles = [(10, 8, 9), (12, 9, 11), (11, 7, 8), (9, 8, 8.5), (15, 9, 14)]
+    values = [atr.update(*c) for c in candles]
+    # TR: 2, max(3, 3, 0)=3, max(4, 0, 4)=4, max(1, 1, 0)=1, max(6, 6.5, 0.5)=6.5
+    assert values[:3] == pytest.approx([2, 2.5, 3])
+    assert values[3] == pytest.approx((3 * 2 + 1) / 3)
+    assert values[4] == pytest.approx((values[3] * 2 + 6.5) / 3)
+    assert atr.ready
+
+def test_vwap_window_and_cumulative():
+    rolling = VWAP(2)
+    cumulative = VWAP()
+    assert not rolling.ready
+    trades = [(10, 1), (20, 3), (30, 0), (40, 1)]
+    for price, volume in trades:
+        rolling.update(price, volume)
+        cumulative.update(price, volume)
+    assert rolling.value == pytest.approx(40)
+    assert cumulative.value == pytest.approx((10 + 60 + 40) / 5)
+    assert VWAP(2).update(10, 0) is None
+
+def test_zscore_compares_against_previous_window(closes):
+    zscore = ZScore(20)
+    assert zscore.update(closes[0]) is None
+    for i in range(1, len(closes)):
+        value = zscore.update(closes[i])
+        window = closes[max(0, i - 20):i]
+        mean = sum(window) / len(window)
+        std = math.sqrt(sum((x - mean) ** 2 for x in window) / len(window))
+        assert value == pytest.approx((closes[i] - mean) / std if std else 0.0, rel=1e-6, abs=1e-6)
+
+def test_zscore_of_constant_series_is_zero():
+    zscore = ZScore(5)
+    for _ in range(10):
+        assert zscore.update(3.0) in (None, 0.0)
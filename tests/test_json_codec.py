@@ -0,0 +1,36 @@
+import os
+import json
+
+import pytest
+
+import json_codec
+
+@pytest.mark.parametrize('message', [
+    '{"e":"trade","s":"BTCUSDC","p":"43000.10","q":"0.002","T":1700000000000}',
+    '{"e": "trade", "s": "BTCUSDC", "p": "43000.10", "q": "0.002", "T": 1700000000000}',
+    '{ "e" : "trade" , "s" : "BTCUSDC" , "p" : "43000.10" , "q" : "0.002" , "T" : 1700000000000 }',
+])
+def test_extract_fields_matches_full_decode(message):
+    full = json.loads(message)
+    fields = json_codec.extract_fields(message, ('p', 'T'))
+    assert fields == {'p': full['p'], 'T': str(full['T'])}
+    assert json_codec.extract_fields(message.encode(), ('p', 'T')) == fields
+
+@pytest.mark.parametrize('message', [
+    '{"e":"trade","q":"1"}',
+    '{"p":',
+    '{"p":"43000',
+    '{"p":"a\\"b"}',
+    '{"p":{"x":1}}',
+    '{"p":}',
+    b'\xff\xfe',
+])
+def test_extract_fields_falls_back_on_missing_or_unparsable(message):
+    assert json_codec.extract_fields(message, ('p',)) is None
+
+def test_set_backend_falls_back_to_stdlib():
+    try:
+        assert json_codec.set_backend('json') == 'json'
+        assert json_codec.loads('{"a": 1}') == {'a': 1}
+    finally:
+        json_codec.set_backend(os.environ.get('JSON_BACKEND') or None)
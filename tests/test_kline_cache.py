@@ -0,0 +1,86 @@
+import types
+from array import array
+
+import pytest
+
+import kline_cache
+from kline_cache import BLOCK_CANDLES, COLUMNS, KlineCache, decode_block, encode_block
+from strategies import INTERVAL_MS
+
+INTERVAL = '1m'
+STEP = INTERVAL_MS[INTERVAL]
+SPAN = STEP * BLOCK_CANDLES
+BASE = 1700000000000 // SPAN * SPAN
+
+def rows(start_ms, end_ms):
+    result = []
+    for open_time in range(start_ms, end_ms, STEP):
+        i = (open_time - BASE) // STEP
+        result.append([open_time, str(100 + i), str(101 + i), str(99 + i), str(100.5 + i), str(i),
+                       open_time + STEP - 1, str(i * 100), i % 7])
+    return result
+
+class Rest:
+    def __init__(self, monkeypatch, now_ms):
+        self.calls = []
+        self.now_ms = now_ms
+        monkeypatch.setattr(kline_cache, 'binance_api_request', self.request)
+        monkeypatch.setattr(kline_cache, 'time', types.SimpleNamespace(time=lambda: self.now_ms / 1000,
+                                                                       sleep=lambda seconds: None))
+
+    def request(self, url, params=None):
+        self.calls.append((params['startTime'], params['endTime'] + 1))
+        return rows(params['startTime'], min(params['endTime'] + 1, self.now_ms // STEP * STEP))
+
+def sample_columns(count):
+    columns = {name: array(code) for name, code in COLUMNS}
+    for row in rows(BASE, BASE + count * STEP):
+        for (name, code), value in zip(COLUMNS, (row[0], row[1], row[2], row[3], row[4], row[5], row[7], row[8])):
+            columns[name].append(int(value) if code == 'q' else float(value))
+    return columns
+
+@pytest.mark.parametrize('count', [0, 1, 250])
+@pytest.mark.parametrize('complete', [True, False])
+def test_block_round_trip(count, complete):
+    columns = sample_columns(count)
+    decoded, decoded_complete = decode_block(encode_block(columns, complete))
+    assert decoded_complete is complete
+    assert decoded == columns
+    assert all(decoded[name].typecode == code for name, code in COLUMNS)
+
+def test_decode_rejects_foreign_data():
+    data = encode_block(sample_columns(3), True)
+    with pytest.raises(ValueError):
+        decode_block(b'XXXX' + data[4:])
+
+def test_get_fetches_missing_blocks_once_and_slices(tmp_path, monkeypatch):
+    rest = Rest(monkeypatch, BASE + 3 * SPAN)
+    cache = KlineCache(root=str(tmp_path))
+    start, end = BASE + 10 * STEP, BASE + SPAN + 20 * STEP
+    columns = cache.get('BTCUSDC', INTERVAL, start, end)
+    assert list(columns['open_time']) == list(range(start, end, STEP))
+    assert columns['close'][0] == 110.5
+    assert rest.calls == [(BASE, BASE + SPAN), (BASE + SPAN, BASE + 2 * SPAN)]
+
+    again = KlineCache(root=str(tmp_path)).get('BTCUSDC', INTERVAL, start, end)
+    assert again == columns
+    assert len(rest.calls) == 2
+
+def test_open_block_resumes_from_last_closed_candle(tmp_path, monkeypatch):
+    rest = Rest(monkeypatch, BASE + 300 * STEP + 5)
+    cache = KlineCache(root=str(tmp_path))
+    assert len(cache.get('BTCUSDC', INTERVAL, BASE, BASE + SPAN)['open_time']) == 300
+
+    rest.now_ms = BASE + 450 * STEP
+    columns = cache.get('BTCUSDC', INTERVAL, BASE, BASE + SPAN)
+    assert list(columns['open_time']) == list(range(BASE, BASE + 450 * STEP, STEP))
+    assert rest.calls == [(BASE, BASE + 300 * STEP), (BASE + 300 * STEP, BASE + 450 * STEP)]
+
+def test_corrupt_block_is_fetched_again(tmp_path, monkeypatch):
+    rest = Rest(monkeypatch, BASE + 2 * SPAN)
+    cache = KlineCache(root=str(tmp_path))
+    cache.get('BTCUSDC', INTERVAL, BASE, BASE + SPAN)
+    with open(cache._path('BTCUSDC', INTERVAL, BASE), 'wb') as f:
+        f.write(b'garbage')
+    assert len(cache.get('BTCUSDC', INTERVAL, BASE, BASE + SPAN)['open_time']) == BLOCK_CANDLES
+    assert len(rest.calls) == 2
@@ -0,0 +1,151 @@
+import struct
+import threading
+import time
+import uuid
+
+import pytest
+
+import market_bus
+from market_bus import (CANDLE_INTERVAL_MS, CANDLES_PER_SLOT, MAX_READERS, SEQ_OFFSET, MarketDataPublisher,
+                        MarketDataReader, _slot_offset)
+
+class FakeWebSocketManager:
+    def __init__(self):
+        self.streams = {}
+
+    def add_stream(self, key, stream, handler, fields=None):
+        self.streams[key] = stream
+
+    def remove_symbol(self, key):
+        self.streams.pop(key, None)
+
+    def stop(self):
+        self.streams.clear()
+
+@pytest.fixture
+def bus(monkeypatch):
+    monkeypatch.setattr(market_bus, 'WebSocketManager', FakeWebSocketManager)
+    publisher = MarketDataPublisher(name=f"mdb_{uuid.uuid4().hex[:10]}", capacity=8, poll_interval=0.01)
+    readers = []
+
+    def reader(reader_id=0):
+        readers.append(MarketDataReader(publisher.name, reader_id))
+        return readers[-1]
+
+    yield publisher, reader
+    for r in readers:
+        r.close()
+    publisher._running = False
+    publisher._thread.join()
+    publisher.close()
+
+def test_reader_sees_published_price_with_even_seq(bus):
+    publisher, reader = bus
+    r = reader()
+    assert r.get_price('BTCUSDC') is None
+    publisher.publish('BTCUSDC', 43000.5, 0.1, 1700000000123)
+    assert r.get_price('BTCUSDC') == (43000.5, 1700000000.123)
+    publisher.publish('BTCUSDC', 43001.0, 0.1, 1700000000456)
+    assert r.seq('BTCUSDC') == 4
+    assert r.get_price('BTCUSDC') == (43001.0, 1700000000.456)
+
+def test_reader_does_not_return_a_slot_while_it_is_being_written(bus):
+    publisher, reader = bus
+    r = reader()
+    publisher.publish('BTCUSDC', 100.0, 1, 1700000000000)
+    offset = _slot_offset(r.slot('BTCUSDC')) + SEQ_OFFSET
+    struct.pack_into('<Q', publisher.buf, offset, 3)
+    assert r.get_price('BTCUSDC') is None
+    assert r.get_candles('BTCUSDC') == []
+    struct.pack_into('<Q', publisher.buf, offset, 4)
+    assert r.get_price('BTCUSDC') == (100.0, 1700000000.0)
+
+def test_concurrent_reads_are_never_torn(bus):
+    publisher, reader = bus
+    r = reader()
+    publisher.publish('BTCUSDC', 1.0, 0, 1000)
+    stop = threading.Event()
+
+    def write():
+        i = 1
+        while not stop.is_set():
+            i += 1
+            publisher.publish('BTCUSDC', float(i), 0, i * 1000)
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    try:
+        for _ in range(20000):
+            result = r.get_price('BTCUSDC')
+            if result is not None:
+                price, ts = result
+                assert price == ts
+    finally:
+        stop.set()
+        writer.join()
+
+def test_candles_aggregate_per_minute_and_wrap(bus):
+    publisher, reader = bus
+    r = reader()
+    start = 1700000040000 - 1700000040000 % CANDLE_INTERVAL_MS
+    publisher.publish('ETHUSDC', 10.0, 1, start)
+    publisher.publish('ETHUSDC', 12.0, 2, start + 1000)
+    publisher.publish('ETHUSDC', 9.0, 3, start + 2000)
+    assert r.get_candles('ETHUSDC') == [(start, 10.0, 12.0, 9.0, 9.0, 6.0)]
+
+    for minute in range(1, CANDLES_PER_SLOT + 5):
+        publisher.publish('ETHUSDC', float(minute), 1, start + minute * CANDLE_INTERVAL_MS)
+    candles = r.get_candles('ETHUSDC')
+    assert len(candles) == CANDLES_PER_SLOT
+    assert [c[0] for c in candles] == [start + m * CANDLE_INTERVAL_MS
+                                       for m in range(5, CANDLES_PER_SLOT + 5)]
+    assert r.get_candles('ETHUSDC', limit=2)[-1][4] == float(CANDLES_PER_SLOT + 4)
+
+def test_wanted_flags_survive_publishes_and_drive_subscriptions(bus):
+    publisher, reader = bus
+    first, last = reader(0), reader(MAX_READERS - 1)
+    publisher.publish('SOLUSDC', 20.0, 1, 1700000000000)
+    assert first.set_wanted('SOLUSDC') and last.set_wanted('SOLUSDC')
+    publisher.publish('SOLUSDC', 21.0, 1, 1700000001000)
+    first.set_wanted('SOLUSDC', False)
+    for _ in range(200):
+        if 'SOLUSDC' in publisher.ws_manager.streams:
+            break
+        time.sleep(0.01)
+    assert 'SOLUSDC' in publisher.ws_manager.streams
+    last.set_wanted('SOLUSDC', False)
+    for _ in range(200):
+        if 'SOLUSDC' not in publisher.ws_manager.streams:
+            break
+        time.sleep(0.01)
+    assert 'SOLUSDC' not in publisher.ws_manager.streams
+
+@pytest.mark.parametrize('reader_id', [-1, MAX_READERS])
+def test_reader_id_must_fit_wanted_flags(bus, reader_id):
+    _, reader = bus
+    with pytest.raises(ValueError):
+        reader(reader_id)
+
+def test_bus_manager_forwards_non_price_streams(bus):
+    publisher, reader = bus
+    created = []
+
+    def factory():
+        created.append(FakeWebSocketManager())
+        created[-1].stopped = False
+        created[-1].stop = lambda: setattr(created[-1], 'stopped', True)
+        return created[-1]
+
+    manager = market_bus.BusWebSocketManager(reader(), poll_interval=0.01, stream_factory=factory)
+    try:
+        manager.add_stream(market_bus.BULK_PRICE_STREAM, market_bus.BULK_PRICE_STREAM, lambda data: None)
+        assert created == []
+        manager.add_stream('BTCUSDC@DEPTH', 'btcusdc@depth@100ms', lambda data: None)
+        manager.add_stream('listenKey', 'abc', lambda data: None)
+        assert len(created) == 1
+        assert created[0].streams == {'BTCUSDC@DEPTH': 'btcusdc@depth@100ms', 'listenKey': 'abc'}
+        manager.remove_symbol('BTCUSDC@DEPTH')
+        assert list(created[0].streams) == ['listenKey']
+    finally:
+        manager.stop()
+    assert created[0].stopped
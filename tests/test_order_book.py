@@ -0,0 +1,135 @@
+import threading
+import types
+
+import pytest
+
+import order_book
+from clock import VirtualClock
+from order_book import LocalOrderBook, OrderBookManager
+
+class Depth:
+    """Snapshot REST giả; luồng đồng bộ được giữ lại để test tự chạy đúng lúc"""
+
+    def __init__(self, monkeypatch):
+        self.snapshots = []
+        self.pending = []
+        monkeypatch.setattr(order_book, 'binance_api_request', lambda url, params=None: self.snapshots.pop(0))
+        monkeypatch.setattr(order_book, 'threading',
+                            types.SimpleNamespace(Lock=threading.Lock, Thread=self._thread))
+
+    def _thread(self, target, daemon=None):
+        self.pending.append(target)
+        return types.SimpleNamespace(start=lambda: None)
+
+    def run_sync(self):
+        while self.pending:
+            self.pending.pop(0)()
+
+def event(first, last, prev, bids=(), asks=()):
+    return {'U': first, 'u': last, 'pu': prev, 'b': list(bids), 'a': list(asks)}
+
+SNAPSHOT = {'lastUpdateId': 100,
+            'bids': [['99.0', '1'], ['98.0', '2']],
+            'asks': [['101.0', '1'], ['102.0', '3']]}
+
+@pytest.fixture
+def depth(monkeypatch):
+    return Depth(monkeypatch)
+
+@pytest.fixture
+def book():
+    return LocalOrderBook('BTCUSDC', clock=VirtualClock())
+
+def test_sync_drops_stale_events_and_applies_the_covering_one(depth, book):
+    depth.snapshots.append(dict(SNAPSHOT))
+    book.handle_event(event(90, 95, 89, bids=[['99.0', '50']]))
+    book.handle_event(event(96, 105, 95, bids=[['99.5', '4']]))
+    assert not book.synced and len(depth.pending) == 1
+
+    depth.run_sync()
+    assert book.synced and book.ready
+    assert book.last_update_id == 105
+    assert book.bids == {99.5: 4.0, 99.0: 1.0, 98.0: 2.0}
+
+    book.handle_event(event(106, 110, 105, asks=[['101.0', '0'], ['100.5', '2']]))
+    assert book.last_update_id == 110
+    assert book.asks == {100.5: 2.0, 102.0: 3.0}
+    assert book.mid_price() == pytest.approx(100.0)
+    assert book.stats()['resyncs'] == 0
+
+def test_pu_gap_triggers_resync_from_a_new_snapshot(depth, book):
+    depth.snapshots.append(dict(SNAPSHOT))
+    book.handle_event(event(99, 101, 98))
+    depth.run_sync()
+    assert book.ready
+
+    book.handle_event(event(105, 108, 104, bids=[['99.0', '7']]))
+    assert not book.synced
+    assert book.resyncs == 1
+    assert book.bids[99.0] == 1.0
+
+    depth.snapshots.append({'lastUpdateId': 120, 'bids': [['97.0', '1']], 'asks': [['103.0', '1']]})
+    book.handle_event(event(115, 121, 114, bids=[['97.5', '1']]))
+    depth.run_sync()
+    assert book.ready and book.last_update_id == 121
+    assert book.bids == {97.5: 1.0, 97.0: 1.0}
+
+def test_first_event_after_snapshot_must_cover_it(depth, book):
+    depth.snapshots.append(dict(SNAPSHOT))
+    book.handle_event(event(102, 104, 101))
+    depth.run_sync()
+    assert not book.synced
+    assert book.resyncs == 1
+
+def test_failed_snapshot_retries_on_next_event(depth, book):
+    depth.snapshots.extend([None, dict(SNAPSHOT)])
+    book.handle_event(event(99, 101, 98))
+    depth.run_sync()
+    assert not book.synced
+    book.handle_event(event(102, 103, 101))
+    depth.run_sync()
+    assert book.synced and book.last_update_id == 103
+
+def test_fill_estimates_walk_the_book(depth, book):
+    depth.snapshots.append(dict(SNAPSHOT))
+    book.handle_event(event(99, 101, 98))
+    depth.run_sync()
+
+    fill = book.estimate_fill('BUY', 2)
+    assert fill['avg_price'] == pytest.approx(101.5)
+    assert fill['impact_bps'] == pytest.approx(150)
+    assert book.estimate_fill('SELL', 10)['filled_qty'] == 3
+    assert book.max_qty_within('BUY', 150) == 1
+    assert book.max_qty_within('BUY', 200) == 4
+
+    book.clock.advance(book.max_age + 1)
+    assert not book.ready
+    assert book.estimate_fill('BUY', 1) is None
+
+def test_manager_shares_books_and_limits_qty(depth):
+    class FakeWebSocketManager:
+        def __init__(self):
+            self.streams = {}
+
+        def add_stream(self, key, stream, handler, fields=None):
+            self.streams[key] = handler
+
+        def remove_symbol(self, key):
+            self.streams.pop(key)
+
+    ws = FakeWebSocketManager()
+    manager = OrderBookManager(max_slippage_bps=150, clock=VirtualClock())
+    book = manager.subscribe(ws, 'BTCUSDC')
+    assert manager.subscribe(ws, 'BTCUSDC') is book
+    assert manager.limit_qty('BTCUSDC', 'BUY', 5) is None
+
+    depth.snapshots.append(dict(SNAPSHOT))
+    ws.streams['BTCUSDC@DEPTH'](event(99, 101, 98))
+    depth.run_sync()
+    assert manager.limit_qty('BTCUSDC', 'BUY', 5) == 1
+    assert manager.limit_qty('BTCUSDC', 'BUY', 0.5) == 0.5
+
+    manager.unsubscribe('BTCUSDC')
+    assert 'BTCUSDC@DEPTH' in ws.streams
+    manager.unsubscribe('BTCUSDC')
+    assert ws.streams == {} and manager.get('BTCUSDC') is None
@@ -0,0 +1,46 @@
+import itertools
+import threading
+from collections import OrderedDict, deque
+
+from bot_shards import ShardedBotManager
+
+def fleet(bots, removed_maxlen=1000):
+    manager = ShardedBotManager.__new__(ShardedBotManager)
+    manager._lock = threading.Lock()
+    manager._version_counter = itertools.count(1)
+    manager._bots = OrderedDict()
+    manager._bot_shard = {}
+    manager._removed_bots = deque(maxlen=removed_maxlen)
+    manager.fleet_version = 0
+    for bot_id, status in bots:
+        set_status(manager, bot_id, status)
+    return manager
+
+def set_status(manager, bot_id, status):
+    version = next(manager._version_counter)
+    manager._bots[bot_id] = {'bot_id': bot_id, 'symbol': 'BTCUSDC', 'status': status, 'version': version}
+    manager._bots.move_to_end(bot_id)
+    manager._bot_shard[bot_id] = 0
+    manager.fleet_version = version
+
+def test_filtered_delta_reports_bots_leaving_the_filter():
+    manager = fleet([('a', 'trading'), ('b', 'trading')])
+    since = manager.query_bots(status='trading')['version']
+    set_status(manager, 'a', 'searching')
+    result = manager.query_bots(since=since, status='trading')
+    assert result['bots'] == []
+    assert result['removed'] == ['a']
+    assert result['resync'] is False
+
+def test_delta_older_than_removal_window_requests_resync():
+    manager = fleet([(str(i), 'trading') for i in range(4)], removed_maxlen=2)
+    since = manager.fleet_version
+    with manager._lock:
+        for bot_id in ('0', '1', '2'):
+            manager._drop_bot(bot_id)
+    result = manager.query_bots(since=since)
+    assert result['resync'] is True
+    assert [info['bot_id'] for info in result['bots']] == ['3']
+    assert result['removed'] == []
+    recent = manager.query_bots(since=manager._removed_bots[0][0])
+    assert recent['resync'] is False and recent['removed'] == ['2']
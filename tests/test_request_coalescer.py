@@ -0,0 +1,87 @@
+import threading
+
+import pytest
+
+from binance_client import RequestCoalescer
+
+class WaiterCountingEvent(threading.Event):
+    """Event báo qua all_waiting khi đủ số luồng đang chờ nó"""
+
+    def __init__(self, expected):
+        super().__init__()
+        self.expected = expected
+        self.waiting = 0
+        self.all_waiting = threading.Event()
+        self._count_lock = threading.Lock()
+
+    def wait(self, timeout=None):
+        with self._count_lock:
+            self.waiting += 1
+            if self.waiting >= self.expected:
+                self.all_waiting.set()
+        return super().wait(timeout)
+
+def test_concurrent_identical_calls_share_one_request(virtual_clock):
+    coalescer = RequestCoalescer()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return {'price': '1.0'}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(coalescer.get('k', '/price', fetch)))
+               for _ in range(5)]
+    threads[0].start()
+    assert started.wait(5)
+    # Thay event của lần gọi đang chạy trước khi các luồng theo sau bắt đầu chờ nó
+    inflight = coalescer._inflight['k']
+    inflight.event = WaiterCountingEvent(4)
+    for thread in threads[1:]:
+        thread.start()
+    assert inflight.event.all_waiting.wait(5)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert results == [{'price': '1.0'}] * 5
+    assert coalescer.stats()['inflight'] == 0
+
+def test_leader_exception_releases_followers(virtual_clock):
+    coalescer = RequestCoalescer()
+
+    def fail():
+        raise IOError("boom")
+
+    with pytest.raises(IOError):
+        coalescer.get('k', '/price', fail)
+    assert coalescer.get('k', '/price', lambda: 2) == 2
+
+def test_results_are_cached_for_endpoint_ttl(virtual_clock):
+    coalescer = RequestCoalescer(ttls={'/price': 1.0})
+    values = iter(range(10))
+    fetch = lambda: next(values)
+    assert coalescer.get('k', '/price', fetch) == 0
+    virtual_clock.advance(0.5)
+    assert coalescer.get('k', '/price', fetch) == 0
+    virtual_clock.advance(0.6)
+    assert coalescer.get('k', '/price', fetch) == 1
+    assert coalescer.get('other', '/other', fetch) == 2
+    assert coalescer.get('other', '/other', fetch) == 3
+    assert (coalescer.hits, coalescer.misses) == (1, 4)
+
+def test_none_results_are_not_cached(virtual_clock):
+    coalescer = RequestCoalescer(ttls={'/price': 10.0})
+    assert coalescer.get('k', '/price', lambda: None) is None
+    assert coalescer.get('k', '/price', lambda: 5) == 5
+
+def test_cache_is_bounded(virtual_clock):
+    coalescer = RequestCoalescer(ttls={'/price': 1.0}, max_entries=3)
+    for i in range(10):
+        coalescer.get(i, '/price', lambda: i)
+        assert len(coalescer._cache) <= 3
@@ -0,0 +1,125 @@
+import logging
+import multiprocessing
+
+import pytest
+
+from clock import VirtualClock
+from risk_engine import RiskEngine, RiskLimits, SharedRiskLedger
+
+def make_engine(equity=1000.0, **limits):
+    defaults = dict(max_margin_ratio=0, max_gross_leverage=0, max_side_ratio=0, max_symbol_ratio=0)
+    defaults.update(limits)
+    engine = RiskEngine(RiskLimits(**defaults), clock=VirtualClock())
+    engine.set_balance(equity)
+    return engine
+
+def test_reserve_holds_margin_until_release():
+    engine = make_engine()
+    ok, reason = engine.reserve('b1', 'BTCUSDC', 'BUY', 2, 100, 10)
+    assert (ok, reason) == (True, None)
+    assert engine.pending_margin == pytest.approx(20)
+    assert engine.pending_notional['BUY'] == pytest.approx(200)
+    assert engine.available_balance() == pytest.approx(980)
+
+    engine.release('b1')
+    assert engine.pending_margin == pytest.approx(0)
+    assert engine.pending_notional['BUY'] == pytest.approx(0)
+    assert engine.pending_symbol == {}
+    assert engine.available_balance() == pytest.approx(1000)
+
+def test_reserve_replaces_previous_reservation_of_same_bot():
+    engine = make_engine()
+    engine.reserve('b1', 'BTCUSDC', 'BUY', 2, 100, 10)
+    engine.reserve('b1', 'BTCUSDC', 'BUY', 5, 100, 10)
+    assert engine.pending_margin == pytest.approx(50)
+    engine.release('b1')
+    engine.release('b1')
+    assert engine.pending_margin == pytest.approx(0)
+
+def test_pending_reservations_count_against_margin():
+    engine = make_engine(equity=100)
+    assert engine.reserve('b1', 'AUSDC', 'BUY', 6, 100, 10)[0]
+    assert engine.reserve('b2', 'BUSDC', 'SELL', 5, 100, 10) == (False, 'insufficient_margin')
+    engine.release('b1')
+    assert engine.reserve('b2', 'BUSDC', 'SELL', 5, 100, 10)[0]
+
+def test_margin_ratio_rejection_is_logged_and_counted(caplog):
+    engine = make_engine(equity=100, max_margin_ratio=0.9)
+    engine.set_position('AUSDC', 8, 100, 10)
+    engine.set_balance(20)
+    with caplog.at_level(logging.WARNING, logger='risk_engine'):
+        assert engine.reserve('b1', 'AUSDC', 'BUY', 2, 100, 10) == (False, 'max_margin_ratio')
+    assert engine.stats()['rejections'] == {'max_margin_ratio': 1}
+    assert engine.reservations == {}
+    record = caplog.records[-1]
+    assert record.log_key == 'risk:max_margin_ratio:AUSDC'
+    assert 'b1' in record.getMessage()
+
+def test_side_and_symbol_limits():
+    engine = make_engine(equity=100, max_side_ratio=5, max_symbol_ratio=3)
+    engine.set_position('AUSDC', 2, 100, 10)
+    assert engine.reserve('b1', 'AUSDC', 'BUY', 2, 100, 10) == (False, 'max_symbol_ratio')
+    assert engine.reserve('b1', 'BUSDC', 'BUY', 2, 100, 10)[0]
+    assert engine.reserve('b2', 'CUSDC', 'BUY', 2, 100, 10) == (False, 'max_side_ratio')
+    assert engine.reserve('b2', 'CUSDC', 'SELL', 2, 100, 10)[0]
+
+def test_positions_update_incrementally():
+    engine = make_engine()
+    engine.set_position('AUSDC', 2, 100, 10)
+    engine.set_position('BUSDC', -1, 50, 5)
+    engine.on_price('AUSDC', 110)
+    assert engine.margin_used == pytest.approx(30)
+    assert engine.notional['BUY'] == pytest.approx(220)
+    engine.sync_positions([{'symbol': 'BUSDC', 'positionAmt': '-1', 'entryPrice': '50', 'leverage': '5'}])
+    assert set(engine.positions) == {'BUSDC'}
+    assert engine.margin_used == pytest.approx(10)
+    assert engine.count == {'BUY': 0, 'SELL': 1}
+
+def test_stale_balance_is_not_used():
+    engine = make_engine()
+    engine.clock.advance(31)
+    assert engine.available_balance() is None
+
+def shard_engines(equity=100.0, shards=2):
+    ledger = SharedRiskLedger(shards)
+    clock = VirtualClock()
+    engines = [RiskEngine(RiskLimits(max_margin_ratio=0.5, max_gross_leverage=0, max_side_ratio=0,
+                                     max_symbol_ratio=0), clock=clock, ledger=ledger, shard_id=shard)
+               for shard in range(shards)]
+    for engine in engines:
+        engine.set_balance(equity)
+        engine.sync_positions([])
+    return ledger, clock, engines
+
+def test_ledger_applies_margin_limit_across_shards():
+    ledger, clock, (a, b) = shard_engines()
+    assert a.reserve('a1', 'AUSDC', 'BUY', 3, 100, 10)[0]
+    assert b.reserve('b1', 'BUSDC', 'BUY', 3, 100, 10) == (False, 'max_margin_ratio')
+    assert b.reserve('b1', 'BUSDC', 'BUY', 2, 100, 10)[0]
+
+def test_released_reservation_counts_until_every_shard_synced():
+    ledger, clock, (a, b) = shard_engines()
+    a.reserve('a1', 'AUSDC', 'BUY', 4, 100, 10)
+    a.release('a1')
+    clock.advance(1)
+    # Lệnh của shard a có thể đã khớp nhưng shard b chưa thấy qua positionRisk
+    assert b.reserve('b1', 'BUSDC', 'BUY', 2, 100, 10) == (False, 'max_margin_ratio')
+    a.sync_positions([{'symbol': 'AUSDC', 'positionAmt': '4', 'entryPrice': '100', 'leverage': '10'}])
+    assert b.reserve('b1', 'BUSDC', 'BUY', 2, 100, 10) == (False, 'max_margin_ratio')
+    b.sync_positions([{'symbol': 'AUSDC', 'positionAmt': '4', 'entryPrice': '100', 'leverage': '10'}])
+    assert ledger.others(1) == (0.0, 0.0, 0.0)
+    assert b.reserve('b1', 'BUSDC', 'BUY', 1, 100, 10)[0]
+
+def _reserve_in_child(ledger):
+    engine = RiskEngine(RiskLimits(max_margin_ratio=0.5), ledger=ledger, shard_id=1)
+    engine.set_balance(100.0)
+    engine.reserve('child', 'CUSDC', 'SELL', 3, 100, 10)
+
+def test_ledger_is_shared_with_spawned_shard_process():
+    ledger = SharedRiskLedger(2)
+    process = multiprocessing.get_context('spawn').Process(target=_reserve_in_child, args=(ledger,))
+    process.start()
+    process.join(30)
+    assert process.exitcode == 0
+    with ledger.lock:
+        assert ledger.others(0) == (pytest.approx(30), 0.0, pytest.approx(300))
@@ -0,0 +1,100 @@
+import threading
+import types
+
+import binance_client
+import bot_core
+import clock as clock_module
+from clock import VirtualClock
+
+class FakeBot:
+    def __init__(self, bot_id, symbol):
+        self.bot_id = bot_id
+        self.symbol = symbol
+        self._order_idle = threading.Event()
+        self._order_idle.set()
+        self.thread = threading.Thread(target=lambda: None)
+        self.thread.start()
+        self.stopped = False
+        self.released = None
+
+    def signal_stop(self):
+        self.stopped = True
+
+    def release(self, cancel_orders=True):
+        self.released = cancel_orders
+
+def fake_manager(bots):
+    manager = types.SimpleNamespace(api_key='k', api_secret='s', bots={bot.bot_id: bot for bot in bots})
+    manager._unregister_bot = lambda bot_id: manager.bots.pop(bot_id, None)
+    return manager
+
+def test_cancel_all_orders_reports_rest_failure(monkeypatch):
+    monkeypatch.setattr(binance_client, 'binance_api_request', lambda *a, **k: None)
+    assert binance_client.cancel_all_orders('BTCUSDC', 'k', 's') is False
+    monkeypatch.setattr(binance_client, 'binance_api_request', lambda *a, **k: {'code': 200})
+    assert binance_client.cancel_all_orders('BTCUSDC', 'k', 's') is True
+
+def test_shutdown_reports_symbols_whose_cancel_failed(monkeypatch):
+    monkeypatch.setattr(bot_core, 'cancel_all_orders', lambda symbol, *a: symbol != 'BADUSDC')
+    bots = [FakeBot('a', 'OKUSDC'), FakeBot('b', 'BADUSDC'), FakeBot('c', None)]
+    manager = fake_manager(bots)
+    report = bot_core.BotManager.shutdown(manager, deadline=5, forget=True)
+    assert report['cancel_failed'] == ['BADUSDC']
+    assert report['stopped'] == report['total'] == 3
+    assert all(bot.stopped and bot.released is False for bot in bots)
+    assert manager.bots == {}
+
+class FakeWebSocketManager:
+    def add_symbol(self, *args):
+        pass
+
+    def add_stream(self, *args, **kwargs):
+        pass
+
+    def remove_symbol(self, *args):
+        pass
+
+def test_stopped_bot_sends_no_orders(monkeypatch):
+    clock = VirtualClock()
+    monkeypatch.setattr(clock_module, '_clock', clock)
+    monkeypatch.setattr(bot_core.BaseBot, '_loop', lambda self: None)
+    monkeypatch.setattr(bot_core, 'get_positions', lambda *a, **k: [])
+    sent = []
+    monkeypatch.setattr(bot_core, 'place_order', lambda *a: sent.append(a) or {'orderId': 1})
+    monkeypatch.setattr(bot_core, 'place_trigger_order', lambda *a, **k: sent.append(a) or {'orderId': 1})
+    monkeypatch.setattr(bot_core, 'cancel_all_orders', lambda *a: True)
+    monkeypatch.setattr(bot_core, 'get_tick_size', lambda *a: 0.01)
+    user_stream = types.SimpleNamespace(subscribe=lambda *a: None)
+    bot = bot_core.GlobalMarketBot('AAAUSDC', 10, 5, 50, 100, None, FakeWebSocketManager(), 'k', 's',
+                                   bot_id='bot1', positions={}, user_stream=user_stream, clock=clock)
+    bot.thread.join(5)
+    bot.position_open, bot.side, bot.qty, bot.entry = True, 'BUY', 1.0, 100.0
+
+    bot.signal_stop()
+    assert bot._send_order('BUY', 1.0) is None
+    assert bot._place_exchange_orders() is False
+    assert sent == []
+    assert bot._order_idle.is_set()
+
+def test_close_journals_pnl_at_fill_price(monkeypatch):
+    clock = VirtualClock()
+    monkeypatch.setattr(clock_module, '_clock', clock)
+    monkeypatch.setattr(bot_core.BaseBot, '_loop', lambda self: None)
+    monkeypatch.setattr(bot_core, 'get_positions', lambda *a, **k: [])
+    monkeypatch.setattr(bot_core, 'cancel_all_orders', lambda *a: True)
+    monkeypatch.setattr(bot_core, 'place_order', lambda *a: {'orderId': 1, 'avgPrice': '110.0'})
+    monkeypatch.setattr(bot_core, 'get_current_price', lambda symbol: 150.0)
+    exits = []
+    journal = types.SimpleNamespace(record_exit=lambda *a: exits.append(a))
+    user_stream = types.SimpleNamespace(subscribe=lambda *a: None)
+    bot = bot_core.GlobalMarketBot('AAAUSDC', 10, 5, 50, 100, None, FakeWebSocketManager(), 'k', 's',
+                                   bot_id='bot1', positions={}, user_stream=user_stream, clock=clock,
+                                   journal=journal)
+    bot.thread.join(5)
+    monkeypatch.setattr(bot_core, 'get_positions', lambda *a, **k: None)
+    bot.position_open, bot.side, bot.qty, bot.entry = True, 'BUY', 2.0, 100.0
+
+    assert bot.close_position('test') is True
+    exit_price, pnl = exits[0][5], exits[0][6]
+    assert exit_price == 110.0
+    assert pnl == 20.0
@@ -0,0 +1,27 @@
+import json
+
+import main
+
+def summary(age, uptime, restarts=0):
+    return {'total_bots': 1, 'age': age, 'updated_at': 100.0 - age, 'stale': False,
+            'shards': [{'shard_id': 0, 'alive': True, 'restarts': restarts, 'uptime': uptime, 'last_ok_age': age}]}
+
+def test_volatile_fields_do_not_produce_deltas():
+    broadcaster = main.StateBroadcaster(1.0, heartbeat_interval=15.0)
+    assert broadcaster._diff({}, summary(1.0, 10.0)) is not None
+    assert broadcaster._diff({}, summary(2.0, 11.0)) is None
+    assert broadcaster.seq == 1
+
+    delta = json.loads(broadcaster._diff({}, summary(3.0, 12.0, restarts=1)))
+    assert set(delta['summary']) == {'shards'}
+    assert delta['summary']['shards'][0]['restarts'] == 1
+
+def test_heartbeat_carries_volatile_fields_on_its_own_interval():
+    broadcaster = main.StateBroadcaster(1.0, heartbeat_interval=15.0)
+    broadcaster._diff({}, summary(4.0, 20.0))
+    beat = json.loads(broadcaster._heartbeat(1000.0))
+    assert beat['type'] == 'heartbeat' and beat['seq'] == broadcaster.seq
+    assert beat['summary']['age'] == 4.0
+    assert beat['summary']['shards'][0]['uptime'] == 20.0
+    assert broadcaster._heartbeat(1010.0) is None
+    assert broadcaster._heartbeat(1015.0) is not None
@@ -0,0 +1,16 @@
+from trade_journal import TradeJournal
+
+def test_get_fills_applies_bot_and_symbol_filters(tmp_path):
+    journal = TradeJournal(str(tmp_path / "trades.db"), flush_interval=0.01)
+    try:
+        journal.record_entry('t1', 'bot1', 'BTCUSDC', 'BUY', 1, 100)
+        journal.record_entry('t2', 'bot1', 'ETHUSDC', 'BUY', 1, 10)
+        journal.record_entry('t3', 'bot2', 'BTCUSDC', 'SELL', 1, 100)
+        journal.close()
+        journal = TradeJournal(str(tmp_path / "trades.db"))
+
+        assert [f['trade_id'] for f in journal.get_fills(bot_id='bot1', symbol='btcusdc')] == ['t1']
+        assert sorted(f['trade_id'] for f in journal.get_fills(bot_id='bot1')) == ['t1', 't2']
+        assert sorted(f['trade_id'] for f in journal.get_fills(symbol='BTCUSDC')) == ['t1', 't3']
+    finally:
+        journal.close()
@@ -0,0 +1,130 @@
+import threading
+import logging
+from state_store import BatchWriter, open_database
+from clock import get_clock
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS fills ("
+    "id INTEGER PRIMARY KEY AUTOINCREMENT, trade_id TEXT NOT NULL, bot_id TEXT NOT NULL, "
+    "symbol TEXT NOT NULL, event TEXT NOT NULL, side TEXT, qty REAL, price REAL, "
+    "pnl REAL, reason TEXT, latency_ms REAL, leg INTEGER, ts REAL NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS idx_fills_symbol_ts ON fills (symbol, ts)",
+    "CREATE INDEX IF NOT EXISTS idx_fills_bot_ts ON fills (bot_id, ts)",
+    "CREATE INDEX IF NOT EXISTS idx_fills_trade ON fills (trade_id)",
+    # Thống kê cộng dồn theo symbol/bot, cập nhật khi có lệnh đóng để truy vấn O(1)
+    "CREATE TABLE IF NOT EXISTS pnl_stats ("
+    "scope TEXT NOT NULL, key TEXT NOT NULL, trades INTEGER NOT NULL, wins INTEGER NOT NULL, "
+    "pnl REAL NOT NULL, peak REAL NOT NULL, max_drawdown REAL NOT NULL, updated_at REAL NOT NULL, "
+    "PRIMARY KEY (scope, key))"
+]
+
+class TradeJournal:
+    """Nhật ký lệnh chỉ ghi thêm, ghi nền theo lô để luồng đặt lệnh không chờ đĩa"""
+
+    def __init__(self, path="trades.db", flush_interval=1.0):
+        self.path = path
+        self.conn = open_database(path)
+        with self.conn:
+            for statement in SCHEMA:
+                self.conn.execute(statement)
+        self._read_conn = open_database(path)
+        self._read_lock = threading.Lock()
+        self.writer = BatchWriter(self.conn, flush_interval)
+
+    def _record(self, trade_id, bot_id, symbol, event, side=None, qty=None, price=None,
+                pnl=None, reason=None, latency_ms=None, leg=None):
+        row = (trade_id, bot_id, symbol, event, side, qty, price, pnl, reason, latency_ms, leg, get_clock().time())
+
+        def op(conn):
+            conn.execute(
+                "INSERT INTO fills (trade_id, bot_id, symbol, event, side, qty, price, pnl, reason, "
+                "latency_ms, leg, ts) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", row
+            )
+            if event == 'exit':
+                for scope, key in (('all', ''), ('symbol', symbol), ('bot', bot_id)):
+                    self._update_stats(conn, scope, key, pnl or 0, row[-1])
+
+        self.writer.enqueue(op)
+
+    def _update_stats(self, conn, scope, key, pnl, ts):
+        current = conn.execute(
+            "SELECT trades, wins, pnl, peak, max_drawdown FROM pnl_stats WHERE scope = ? AND key = ?",
+            (scope, key)
+        ).fetchone()
+        trades, wins, total, peak, max_drawdown = current or (0, 0, 0.0, 0.0, 0.0)
+        trades += 1
+        wins += 1 if pnl > 0 else 0
+        total += pnl
+        peak = max(peak, total)
+        max_drawdown = max(max_drawdown, peak - total)
+        conn.execute(
+            "INSERT OR REPLACE INTO pnl_stats (scope, key, trades, wins, pnl, peak, max_drawdown, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (scope, key, trades, wins, total, peak, max_drawdown, ts)
+        )
+
+    def record_entry(self, trade_id, bot_id, symbol, side, qty, price, latency_ms=None):
+        self._record(trade_id, bot_id, symbol, 'entry', side, qty, price, latency_ms=latency_ms, leg=0)
+
+    def record_average_down(self, trade_id, bot_id, symbol, side, qty, price, leg, latency_ms=None):
+        self._record(trade_id, bot_id, symbol, 'average_down', side, qty, price,
+                     latency_ms=latency_ms, leg=leg)
+
+    def record_exit(self, trade_id, bot_id, symbol, side, qty, price, pnl, reason="", latency_ms=None):
+        self._record(trade_id, bot_id, symbol, 'exit', side, qty, price, pnl=pnl,
+                     reason=reason, latency_ms=latency_ms)
+
+    def _query(self, sql, params=()):
+        with self._read_lock:
+            cursor = self._read_conn.execute(sql, params)
+            columns = [c[0] for c in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def get_stats(self, symbol=None, bot_id=None):
+        if bot_id:
+            scope, key = 'bot', bot_id
+        elif symbol:
+            scope, key = 'symbol', symbol.upper()
+        else:
+            scope, key = 'all', ''
+        rows = self._query(
+            "SELECT trades, wins, pnl, max_drawdown, updated_at FROM pnl_stats WHERE scope = ? AND key = ?",
+            (scope, key)
+        )
+        stats = rows[0] if rows else {'trades': 0, 'wins': 0, 'pnl': 0, 'max_drawdown': 0, 'updated_at': None}
+        stats['win_rate'] = stats['wins'] / stats['trades'] * 100 if stats['trades'] else 0
+        stats['scope'] = scope
+        stats['key'] = key
+        return stats
+
+    def get_top(self, scope='symbol', order_by='pnl', limit=20):
+        if scope not in ('symbol', 'bot') or order_by not in ('pnl', 'trades', 'max_drawdown'):
+            return []
+        return self._query(
+            f"SELECT key, trades, wins, pnl, max_drawdown FROM pnl_stats WHERE scope = ? "
+            f"ORDER BY {order_by} DESC LIMIT ?",
+            (scope, limit)
+        )
+
+    def get_fills(self, symbol=None, bot_id=None, since=None, limit=100):
+        conditions = []
+        params = []
+        if bot_id:
+            conditions.append("bot_id = ?")
+            params.append(bot_id)
+        if symbol:
+            conditions.append("symbol = ?")
+            params.append(symbol.upper())
+        if since:
+            conditions.append("ts > ?")
+            params.append(since)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        params.append(limit)
+        return self._query(f"SELECT * FROM fills {where} ORDER BY ts DESC LIMIT ?", params)
+
+    def close(self):
+        self.writer.close()
+        self.conn.close()
+        self._read_conn.close()